@@ -0,0 +1,67 @@
+from django.core.cache import cache
+from django.utils.crypto import get_random_string
+
+
+class AggregateCache:
+
+    """Values computed for an entity, like the occupancy of a room at a date, kept in the cache.
+
+    The keys of the values contain a version of the entity and a version of the whole cache. Invalidating an entity, or
+    all of them, gives them a new random version, so all their values, for any arguments, are dropped at once, with a
+    single cache write; the old values are never read again and expire after the timeout. A random version, rather than
+    a counter, cannot come back after the cache evicted it.
+
+    None is not cached, so aggregates that are None are computed every time.
+    """
+
+    timeout = 24 * 60 * 60
+
+    def __init__(self, name):
+        """Constructor.
+
+        :param name: Prefix of the cache keys, like 'buildings.room_occupancy'.
+        """
+        self.name = name
+
+    def get(self, entity_id, compute, *arguments):
+        """Get a value of an entity, from the cache when available.
+
+        :param entity_id: The id of the entity, invalidated with invalidate(entity_id).
+        :param compute: Function without arguments that computes the value when it is not in the cache.
+        :param arguments: Other parts of the key, like the date of the value. Their str() is used in the key.
+        """
+        key = self.__value_key(entity_id, arguments)
+        value = cache.get(key)
+        if value is None:
+            value = compute()
+            cache.set(key, value, self.timeout)
+        return value
+
+    def invalidate(self, *entity_ids):
+        """Drop the values of the given entities."""
+        cache.set_many({self.__version_key(entity_id): self.__new_version() for entity_id in entity_ids}, self.timeout)
+
+    def invalidate_all(self):
+        """Drop the values of all the entities."""
+        cache.set(self.__version_key(None), self.__new_version(), self.timeout)
+
+    def __value_key(self, entity_id, arguments):
+        version_keys = [self.__version_key(None), self.__version_key(entity_id)]
+        versions = cache.get_many(version_keys)
+        for version_key in version_keys:
+            if version_key not in versions:
+                version = self.__new_version()
+                if not cache.add(version_key, version, self.timeout):  # Added by another process meanwhile.
+                    version = cache.get(version_key, version)
+                versions[version_key] = version
+        return '.'.join([self.name, versions[version_keys[0]], str(entity_id), versions[version_keys[1]]] +
+                        [str(argument) for argument in arguments])
+
+    def __version_key(self, entity_id):
+        if entity_id is None:
+            return '%s.version' % self.name
+        return '%s.version.%s' % (self.name, entity_id)
+
+    @staticmethod
+    def __new_version():
+        return get_random_string(8)
@@ -0,0 +1,61 @@
+import inspect
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+_scope = threading.local()
+
+
+@contextmanager
+def memoization_scope():
+    """Memoize the request_memoized methods called inside the block.
+
+    The values are kept until the end of the outermost scope, or until clear_memoized is called, which the apps do
+    when an event the memoized methods depend on is saved or deleted. Scopes can be nested; the inner scopes share the
+    values of the outer scope. RequestMemoizationMiddleware runs every request in a scope.
+    """
+    outermost = getattr(_scope, 'values', None) is None
+    if outermost:
+        _scope.values = {}
+    try:
+        yield
+    finally:
+        if outermost:
+            _scope.values = None
+
+
+def clear_memoized():
+    """Forget the values memoized in the current scope, if any."""
+    if getattr(_scope, 'values', None) is not None:
+        _scope.values.clear()
+
+
+def request_memoized(method):
+    """Decorator for model methods that are memoized within a memoization_scope.
+
+    The values are keyed on the model, the primary key of the instance and the arguments, so different instances of the
+    same room or flock share them. Outside of a scope, for unsaved instances, or with arguments that cannot be hashed,
+    the method is called directly. The signature of the method is kept, as the templates inspect it.
+    """
+    name = method.__qualname__
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        values = getattr(_scope, 'values', None)
+        if values is None or self.pk is None:
+            return method(self, *args, **kwargs)
+
+        key = (self._meta.label, self.pk, name, args, tuple(sorted(kwargs.items())))
+        try:
+            return values[key]
+        except KeyError:
+            pass
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        value = method(self, *args, **kwargs)
+        values[key] = value
+        return value
+
+    wrapper.__signature__ = inspect.signature(method)
+    return wrapper
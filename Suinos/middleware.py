@@ -0,0 +1,186 @@
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+from .memoization import memoization_scope
+from .profiling import Profile, logged_queries
+from .utils import normalize_sql
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+
+    """Rolling, in-memory statistics of the requests per view.
+
+    For every view the last samples are kept, so the memory used is bounded and the statistics follow the recent load.
+    The statistics are per process: with several worker processes, every process reports its own requests.
+    """
+
+    def __init__(self, max_samples=200):
+        self.max_samples = max_samples
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, view_name, sample):
+        """Add the sample of a request.
+
+        :param view_name: The name of the view that handled the request.
+        :param sample: A dict with total_time, query_count, query_time (times in ms) and duplicates, a list of
+        (sql, count) tuples.
+        """
+        with self.lock:
+            if view_name not in self.samples:
+                self.samples[view_name] = deque(maxlen=self.max_samples)
+            self.samples[view_name].append(sample)
+
+    def clear(self):
+        with self.lock:
+            self.samples = {}
+
+    def summary(self, top=5):
+        """Get the statistics per view, the views with the most total time first.
+
+        :param top: Number of duplicated statements reported per view.
+        :return: A list of dicts.
+        """
+        with self.lock:
+            samples = {view_name: list(view_samples) for view_name, view_samples in self.samples.items()}
+
+        views = []
+        for view_name, view_samples in samples.items():
+            total_times = sorted(sample['total_time'] for sample in view_samples)
+            duplicates = Counter()
+            for sample in view_samples:
+                for sql, count in sample['duplicates']:
+                    duplicates[sql] += count
+            views.append({
+                'view': view_name,
+                'requests': len(view_samples),
+                'total_time': round(sum(total_times), 3),
+                'average_time': round(sum(total_times) / len(total_times), 3),
+                'p95_time': round(total_times[int(0.95 * (len(total_times) - 1))], 3),
+                'max_time': round(total_times[-1], 3),
+                'average_queries': round(sum(sample['query_count'] for sample in view_samples) / len(view_samples), 1),
+                'max_queries': max(sample['query_count'] for sample in view_samples),
+                'average_query_time': round(sum(sample['query_time'] for sample in view_samples) / len(view_samples),
+                                            3),
+                'duplicated_queries': [{'sql': sql, 'count': count} for sql, count in duplicates.most_common(top)],
+            })
+        return sorted(views, key=lambda view: view['total_time'], reverse=True)
+
+
+query_stats = QueryStats()
+
+
+class QueryInstrumentationMiddleware:
+
+    """Middleware that measures the time and the queries of every request.
+
+    The middleware is only used when the QUERY_INSTRUMENTATION setting is True. It then records, for a fraction
+    QUERY_INSTRUMENTATION_SAMPLE_RATE of the requests, the total time, the number of queries, the time spent in the
+    database and the statements that were executed more than once with different parameters. The numbers are added to
+    the response in a Server-Timing and an X-Query-Count header, and kept per view in query_stats, which is shown by
+    the query stats page.
+
+    The queries are captured as the debug cursor does with DEBUG on, so only the SQL and the time of each query are
+    kept, and only until the end of the request. They are logged with logged_queries, like the profiles do, so the
+    count is right even when the queries log of the connection is full.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'QUERY_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'QUERY_INSTRUMENTATION_SAMPLE_RATE', 1.0)
+        query_stats.max_samples = getattr(settings, 'QUERY_INSTRUMENTATION_SAMPLES', query_stats.max_samples)
+
+    def __call__(self, request):
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        with logged_queries() as queries_log:
+            start = time.perf_counter()
+            response = self.get_response(request)
+            total_time = (time.perf_counter() - start) * 1000
+        queries = list(queries_log)
+        query_count = queries_log.total
+
+        # Only the last queries are kept in a request with more queries than the log holds.
+        query_time = sum(float(query['time']) for query in queries) * 1000
+        response['Server-Timing'] = 'db;dur=%.1f;desc="%d queries", total;dur=%.1f' % (query_time, query_count,
+                                                                                        total_time)
+        response['X-Query-Count'] = str(query_count)
+
+        duplicates = Counter(normalize_sql(query['sql']) for query in queries)
+        query_stats.add(self.view_name(request), {
+            'total_time': total_time,
+            'query_count': query_count,
+            'query_time': query_time,
+            'duplicates': [(sql, count) for sql, count in duplicates.most_common(5) if count > 1],
+        })
+        return response
+
+    @staticmethod
+    def view_name(request):
+        resolver_match = getattr(request, 'resolver_match', None)
+        if resolver_match is None:
+            return 'unresolved'
+        return resolver_match.view_name
+
+
+class DomainProfilingMiddleware:
+
+    """Middleware that profiles the domain calculations of every request.
+
+    The middleware is only used when the DOMAIN_PROFILING setting is True. Every request is run inside a Profile, and
+    its report is written, as text and as JSON, to the DOMAIN_PROFILING_DIR directory. The report shows which of the
+    profiled Room, Building and Flock calculations took the time and the queries of a slow page.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'DOMAIN_PROFILING', False):
+            raise MiddlewareNotUsed()
+        self.get_response = get_response
+        self.directory = settings.DOMAIN_PROFILING_DIR
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __call__(self, request):
+        with Profile(request.path) as profile:
+            response = self.get_response(request)
+
+        profile.label = QueryInstrumentationMiddleware.view_name(request)
+        # The random part keeps the reports of requests of the same view in the same second apart.
+        name = '%s-%d-%s-%s' % (time.strftime('%Y%m%d-%H%M%S'), os.getpid(), uuid.uuid4().hex[:8],
+                                profile.label.replace(':', '-'))
+        filename = os.path.join(self.directory, name)
+        with open(filename + '.txt', 'w') as report:
+            report.write(profile.report_text())
+        with open(filename + '.json', 'w') as report:
+            report.write(profile.report_json())
+        logger.info('%s: %.1f ms, %d queries, profile in %s.txt', profile.label, profile.total_time,
+                    profile.total_queries, filename)
+        return response
+
+
+class RequestMemoizationMiddleware:
+
+    """Middleware that runs every request in a memoization_scope.
+
+    The room, building and flock methods that are asked the same question several times in one request, by the
+    templates, the KPIs or the forms, are then only computed once. The values are dropped at the end of the request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with memoization_scope():
+            return self.get_response(request)
@@ -0,0 +1,164 @@
+import inspect
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+from django.db import connection
+
+_active = threading.local()
+
+
+class CountingQueriesLog(deque):
+
+    """Queries log that also counts all the queries appended to it, also after the oldest ones are dropped."""
+
+    def __init__(self, iterable=(), maxlen=None):
+        super().__init__(iterable, maxlen)
+        self.total = 0
+
+    def append(self, query):
+        self.total += 1
+        super().append(query)
+
+
+@contextmanager
+def logged_queries():
+    """Log the queries of the block in a new, empty CountingQueriesLog, which is yielded.
+
+    The log keeps the last queries, as many as the queries log of the connection, and counts all of them, so the count
+    stays right when the log of the connection is full. Afterwards the queries are added to the log of the connection,
+    and to the count of an enclosing block.
+    """
+    saved_force_debug_cursor = connection.force_debug_cursor
+    saved_queries_log = connection.queries_log
+    connection.force_debug_cursor = True
+    queries_log = connection.queries_log = CountingQueriesLog(maxlen=saved_queries_log.maxlen)
+    try:
+        yield queries_log
+    finally:
+        connection.queries_log = saved_queries_log
+        saved_queries_log.extend(queries_log)
+        if isinstance(saved_queries_log, CountingQueriesLog):  # Nested in another block.
+            saved_queries_log.total += queries_log.total
+        connection.force_debug_cursor = saved_force_debug_cursor
+
+
+class Profile:
+
+    """Profile of the domain calculations run in a block of code.
+
+    While a profile is active in a thread, every call of a function decorated with profiled is counted, with its time
+    and the number of queries it issued. The cumulative values include the nested profiled calls, the own values do
+    not. Recursive calls of the same function are only counted once in the cumulative values.
+
+    Usage::
+
+        with Profile('farm:index') as profile:
+            ...
+        print(profile.report_text())
+    """
+
+    def __init__(self, label=''):
+        self.label = label
+        self.previous = None
+        self.stats = {}
+        self.stack = []
+        self.running = {}
+        self.total_time = 0
+        self.total_queries = 0
+
+    def __enter__(self):
+        self.previous = getattr(_active, 'profile', None)
+        self.queries = logged_queries()
+        self.queries.__enter__()
+        _active.profile = self
+        self.start_queries = self.query_count()
+        self.start_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.total_time = (time.perf_counter() - self.start_time) * 1000
+        self.total_queries = self.query_count() - self.start_queries
+        _active.profile = self.previous
+        self.queries.__exit__(exc_type, exc_value, traceback)
+
+    @staticmethod
+    def current():
+        """Get the profile active in this thread, or None."""
+        return getattr(_active, 'profile', None)
+
+    def query_count(self):
+        return getattr(connection.queries_log, 'total', 0)
+
+    def call(self, name, function, *args, **kwargs):
+        """Call a function and add its time and queries to the statistics of name."""
+        frame = [0.0, 0]  # Time and queries of the nested profiled calls.
+        self.stack.append(frame)
+        self.running[name] = self.running.get(name, 0) + 1
+        start_queries = self.query_count()
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            queries = self.query_count() - start_queries
+            self.stack.pop()
+            self.running[name] -= 1
+            stats = self.stats.setdefault(name, {'calls': 0, 'cumulative_time': 0.0, 'own_time': 0.0,
+                                                 'queries': 0, 'own_queries': 0})
+            stats['calls'] += 1
+            stats['own_time'] += elapsed - frame[0]
+            stats['own_queries'] += queries - frame[1]
+            if self.running[name] == 0:
+                stats['cumulative_time'] += elapsed
+                stats['queries'] += queries
+            if self.stack:
+                self.stack[-1][0] += elapsed
+                self.stack[-1][1] += queries
+
+    def as_dict(self):
+        """Get the profile as a dict, with the methods that took the most time first."""
+        methods = [dict(name=name, **stats) for name, stats in self.stats.items()]
+        methods.sort(key=lambda method: method['cumulative_time'], reverse=True)
+        for method in methods:
+            method['cumulative_time'] = round(method['cumulative_time'], 3)
+            method['own_time'] = round(method['own_time'], 3)
+        return {'label': self.label, 'total_time': round(self.total_time, 3), 'total_queries': self.total_queries,
+                'methods': methods}
+
+    def report_json(self):
+        return json.dumps(self.as_dict(), indent=2)
+
+    def report_text(self):
+        profile = self.as_dict()
+        lines = ['Profile %s: %.1f ms, %d queries' % (profile['label'], profile['total_time'],
+                                                       profile['total_queries']),
+                 '%-55s %7s %10s %10s %8s %8s' % ('Method', 'Calls', 'Cum ms', 'Own ms', 'Queries', 'Own q')]
+        for method in profile['methods']:
+            lines.append('%-55s %7d %10.1f %10.1f %8d %8d' % (method['name'], method['calls'],
+                                                               method['cumulative_time'], method['own_time'],
+                                                               method['queries'], method['own_queries']))
+        return '\n'.join(lines)
+
+
+def profiled(function):
+    """Decorator for domain calculations that are counted by the active Profile.
+
+    Without an active profile the function is called directly, so the decorator can stay on the models in production.
+    The signature of the function is kept, as the templates inspect it to tell whether a method can be called without
+    arguments.
+    """
+    name = function.__qualname__
+
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = getattr(_active, 'profile', None)
+        if profile is None:
+            return function(*args, **kwargs)
+        return profile.call(name, function, *args, **kwargs)
+
+    wrapper.__signature__ = inspect.signature(function)
+    return wrapper
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+from django.core.exceptions import ImproperlyConfigured
 from .utils import load_environment_file
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -31,6 +32,15 @@ else:
 
 ALLOWED_HOSTS = os.environ.get('DJANGO_ALLOWED_HOSTS', '*').split()
 
+# Per request timing and query statistics, see Suinos.middleware.QueryInstrumentationMiddleware.
+QUERY_INSTRUMENTATION = os.environ.get('DJANGO_QUERY_INSTRUMENTATION', 'False') == 'True'
+QUERY_INSTRUMENTATION_SAMPLE_RATE = float(os.environ.get('DJANGO_QUERY_INSTRUMENTATION_SAMPLE_RATE', '1.0'))
+QUERY_INSTRUMENTATION_SAMPLES = 200
+
+# Profile reports of the domain calculations per request, see Suinos.middleware.DomainProfilingMiddleware.
+DOMAIN_PROFILING = os.environ.get('DJANGO_DOMAIN_PROFILING', 'False') == 'True'
+DOMAIN_PROFILING_DIR = os.environ.get('DJANGO_DOMAIN_PROFILING_DIR', os.path.join(BASE_DIR, 'profiles'))
+
 LOGIN_REDIRECT_URL = '/'
 
 # Application definition
@@ -52,6 +62,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'Suinos.middleware.QueryInstrumentationMiddleware',
+    'Suinos.middleware.DomainProfilingMiddleware',
+    'Suinos.middleware.RequestMemoizationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -95,6 +108,31 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+# A local memory cache by default. With several worker processes, use the file based or the memcached cache, shared by
+# all the processes, so an event registered in one process invalidates the cached values of the others. The memcached
+# cache needs the python-memcached package, which is not in requirements.txt: pip install python-memcached.
+
+CACHE_BACKENDS = {
+    'locmem': ('django.core.cache.backends.locmem.LocMemCache', 'suinos'),
+    'file': ('django.core.cache.backends.filebased.FileBasedCache', os.path.join(BASE_DIR, 'cache')),
+    'memcached': ('django.core.cache.backends.memcached.MemcachedCache', '127.0.0.1:11211'),
+}
+if os.environ.get('DJANGO_CACHE_BACKEND', 'locmem') not in CACHE_BACKENDS:
+    raise ImproperlyConfigured('Unknown DJANGO_CACHE_BACKEND %r, use one of %s.' %
+                               (os.environ['DJANGO_CACHE_BACKEND'], ', '.join(sorted(CACHE_BACKENDS))))
+CACHE_BACKEND, CACHE_LOCATION = CACHE_BACKENDS[os.environ.get('DJANGO_CACHE_BACKEND', 'locmem')]
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', CACHE_LOCATION),
+        'KEY_PREFIX': 'suinos',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -0,0 +1,89 @@
+from collections import Counter
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.test.utils import CaptureQueriesContext
+
+from .utils import normalize_sql
+
+
+def describe_queries(queries, limit=10):
+    """Describe a list of captured queries, with the most repeated queries first.
+
+    :param queries: The captured queries, as dicts with a 'sql' key.
+    :param limit: The maximum number of distinct queries in the description.
+    :return: A multi-line string.
+    """
+    counts = Counter(normalize_sql(query['sql']) for query in queries)
+    lines = []
+    repeated = [(sql, count) for sql, count in counts.most_common() if count > 1]
+    if repeated:
+        lines.append('Repeated queries:')
+        lines.extend('  %dx %s' % (count, sql) for sql, count in repeated[:limit])
+    lines.append('All queries:')
+    lines.extend('  %d. %s' % (number, query['sql']) for number, query in enumerate(queries[:limit * 5], 1))
+    if len(queries) > limit * 5:
+        lines.append('  ... and %d more' % (len(queries) - limit * 5))
+    return '\n'.join(lines)
+
+
+class _AssertMaxQueriesContext(CaptureQueriesContext):
+    def __init__(self, test_case, budget, connection):
+        self.test_case = test_case
+        self.budget = budget
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self)
+        if executed > self.budget:
+            self.test_case.fail('%d queries executed, the budget is %d.\n%s' % (
+                executed, self.budget, describe_queries(self.captured_queries)))
+
+
+class QueryBudgetMixin:
+
+    """Mixin for test cases with assertions on the number of queries.
+
+    Unlike assertNumQueries, the assertions allow any number of queries up to a budget, and on failure they show the
+    queries that were repeated with different parameters, which are usually the N+1 queries that broke the budget.
+    """
+
+    def assertMaxQueries(self, budget, func=None, *args, using=DEFAULT_DB_ALIAS, **kwargs):
+        """Assert that at most budget queries are executed, by func or inside the with block.
+
+        :param budget: The maximum number of queries.
+        :param func: The function to call. When not given, a context manager is returned.
+        """
+        context = _AssertMaxQueriesContext(self, budget, connections[using])
+        if func is None:
+            return context
+
+        with context:
+            func(*args, **kwargs)
+
+    def assertQueriesDoNotGrow(self, func, grow, using=DEFAULT_DB_ALIAS):
+        """Assert that func executes the same number of queries before and after the data is grown.
+
+        :param func: Function that runs the code under test, e.g. requests a page. It is called before and after grow.
+        :param grow: Function that adds data, e.g. more rooms or flocks.
+        """
+        before = self.captureQueries(func, using=using)
+        grow()
+        after = self.captureQueries(func, using=using)
+
+        if len(after) > len(before):
+            before_counts = Counter(normalize_sql(query['sql']) for query in before)
+            after_counts = Counter(normalize_sql(query['sql']) for query in after)
+            grown = ['  %dx -> %dx %s' % (before_counts[sql], count, sql) for sql, count in after_counts.most_common()
+                     if count > before_counts[sql]]
+            self.fail('The number of queries grew from %d to %d with the data.\nGrown queries:\n%s' % (
+                len(before), len(after), '\n'.join(grown)))
+
+    @staticmethod
+    def captureQueries(func, using=DEFAULT_DB_ALIAS):
+        """Call func and return the queries it executed."""
+        with CaptureQueriesContext(connections[using]) as context:
+            func()
+        return context.captured_queries
@@ -0,0 +1,318 @@
+import json
+import os
+import tempfile
+from collections import deque
+from datetime import date
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.shortcuts import reverse
+from django.test import TestCase, override_settings
+
+from buildings.models import Building, Room, RoomGroup, OccupancyLedger, OccupancyCheckpoint, FeedStockForecast
+from flocks.models import Flock, KpiSnapshot
+from .caching import AggregateCache
+from .memoization import memoization_scope
+from .middleware import query_stats, QueryStats
+from .profiling import Profile, profiled
+from .utils import normalize_sql
+
+
+class NormalizeSqlTest(TestCase):
+    def test_normalize(self):
+        self.assertEqual('SELECT * FROM "room" WHERE "id" = ? AND "name" = ?',
+                         normalize_sql('SELECT * FROM "room" WHERE "id" = 12 AND "name" = \'Room 1\''))
+        self.assertEqual('SELECT * FROM "room" WHERE "id" IN (...)',
+                         normalize_sql('SELECT * FROM "room" WHERE "id" IN (1, 2, 3)'))
+
+
+class QueryStatsTest(TestCase):
+    def test_summary(self):
+        stats = QueryStats(max_samples=2)
+        stats.add('farm:index', {'total_time': 10, 'query_count': 5, 'query_time': 2, 'duplicates': [('SELECT ?', 3)]})
+        stats.add('farm:index', {'total_time': 20, 'query_count': 7, 'query_time': 4, 'duplicates': [('SELECT ?', 2)]})
+        stats.add('farm:index', {'total_time': 30, 'query_count': 9, 'query_time': 6, 'duplicates': []})
+        stats.add('flocks:index', {'total_time': 5, 'query_count': 1, 'query_time': 1, 'duplicates': []})
+        summary = stats.summary()
+        self.assertEqual(['farm:index', 'flocks:index'], [view['view'] for view in summary])
+        self.assertEqual(2, summary[0]['requests'])
+        self.assertEqual(25, summary[0]['average_time'])
+        self.assertEqual(9, summary[0]['max_queries'])
+        self.assertEqual([{'sql': 'SELECT ?', 'count': 2}], summary[0]['duplicated_queries'])
+
+
+class QueryInstrumentationMiddlewareTest(TestCase):
+    def setUp(self):
+        query_stats.clear()
+        self.building = Building.objects.create(name='Building')
+        self.other_building = Building.objects.create(name='Other')
+        for group in [self.building, self.other_building]:
+            Room.objects.create(name='Room', capacity=10, group=RoomGroup.objects.create(name='Group', group=group))
+        User.objects.create_user(username='NormalUser', password='Password')
+        User.objects.create_user(username='Staff', password='Password', is_staff=True)
+
+    def test_disabled_by_default(self):
+        self.client.login(username='NormalUser', password='Password')
+        response = self.client.get(reverse('buildings:index'))
+        self.assertNotIn('X-Query-Count', response)
+        self.assertEqual([], query_stats.summary())
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_headers(self):
+        self.client.login(username='NormalUser', password='Password')
+        response = self.client.get(reverse('buildings:index'))
+        self.assertEqual(200, response.status_code)
+        self.assertGreater(int(response['X-Query-Count']), 0)
+        self.assertIn('queries", total;dur=', response['Server-Timing'])
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_stats_per_view(self):
+        self.client.login(username='NormalUser', password='Password')
+        self.client.get(reverse('buildings:index'))
+        self.client.get(reverse('buildings:index'))
+        self.client.get(reverse('buildings:building_detail', kwargs={'building_id': self.building.id}))
+        views = {view['view']: view for view in query_stats.summary()}
+        self.assertEqual(2, views['buildings:index']['requests'])
+        self.assertEqual(1, views['buildings:building_detail']['requests'])
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_query_count_with_full_queries_log(self):
+        self.client.login(username='NormalUser', password='Password')
+        url = reverse('buildings:building_detail', kwargs={'building_id': self.building.id})
+        self.client.get(url)
+        expected = int(self.client.get(url)['X-Query-Count'])
+        self.assertGreater(expected, 3)
+
+        self.addCleanup(setattr, connection, 'queries_log', connection.queries_log)
+        connection.queries_log = deque(maxlen=3)
+        response = self.client.get(url)
+        self.assertEqual(expected, int(response['X-Query-Count']))
+        self.assertIn('desc="%d queries"' % expected, response['Server-Timing'])
+
+    @override_settings(QUERY_INSTRUMENTATION=True, QUERY_INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_sample_rate(self):
+        self.client.login(username='NormalUser', password='Password')
+        response = self.client.get(reverse('buildings:index'))
+        self.assertNotIn('X-Query-Count', response)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_stats_page_for_staff_only(self):
+        self.client.login(username='NormalUser', password='Password')
+        self.assertEqual(302, self.client.get(reverse('query_stats')).status_code)
+        self.client.login(username='Staff', password='Password')
+        self.client.get(reverse('buildings:index'))
+        response = self.client.get(reverse('query_stats'))
+        self.assertEqual(200, response.status_code)
+        self.assertTrue(response.json()['enabled'])
+        self.assertIn('buildings:index', [view['view'] for view in response.json()['views']])
+
+
+@profiled
+def count_rooms():
+    return Room.objects.count()
+
+
+@profiled
+def count_rooms_twice():
+    return count_rooms() + count_rooms() + Building.objects.count()
+
+
+@profiled
+def countdown(number):
+    return 0 if number == 0 else countdown(number - 1)
+
+
+class ProfileTest(TestCase):
+    def setUp(self):
+        self.building = Building.objects.create(name='Building')
+        self.room = Room.objects.create(name='Room', capacity=10, group=self.building)
+
+    def test_not_active(self):
+        self.assertIsNone(Profile.current())
+        self.assertEqual(1, count_rooms())
+
+    def test_calls_and_queries(self):
+        with Profile('test') as profile:
+            self.assertIs(profile, Profile.current())
+            count_rooms_twice()
+            self.room.get_occupancy_at_date(date(2017, 1, 1))
+        self.assertIsNone(Profile.current())
+
+        self.assertEqual(4, profile.total_queries)
+        self.assertEqual({'calls': 2, 'queries': 2, 'own_queries': 2}, self.__counts(profile, 'count_rooms'))
+        self.assertEqual({'calls': 1, 'queries': 3, 'own_queries': 1}, self.__counts(profile, 'count_rooms_twice'))
+        self.assertEqual(1, profile.stats['Room.get_occupancy_at_date']['calls'])
+        stats = profile.stats['count_rooms_twice']
+        self.assertGreaterEqual(stats['cumulative_time'], stats['own_time'])
+
+    def test_recursion(self):
+        with Profile() as profile:
+            countdown(3)
+        stats = profile.stats['countdown']
+        self.assertEqual(4, stats['calls'])
+        self.assertLessEqual(stats['cumulative_time'], profile.total_time)
+
+    def test_nested_profiles(self):
+        with Profile('outer') as outer:
+            count_rooms()
+            with Profile('inner') as inner:
+                count_rooms()
+        self.assertEqual(1, inner.total_queries)
+        self.assertEqual(2, outer.total_queries)
+        self.assertEqual(1, outer.stats['count_rooms']['calls'])
+
+    def test_reports(self):
+        with Profile('test') as profile:
+            count_rooms_twice()
+        report = json.loads(profile.report_json())
+        self.assertEqual('test', report['label'])
+        self.assertEqual(['count_rooms_twice', 'count_rooms'], [method['name'] for method in report['methods']])
+        self.assertIn('count_rooms_twice', profile.report_text())
+
+    @staticmethod
+    def __counts(profile, name):
+        return {key: profile.stats[name][key] for key in ['calls', 'queries', 'own_queries']}
+
+
+class DomainProfilingMiddlewareTest(TestCase):
+    def setUp(self):
+        self.building = Building.objects.create(name='Building')
+        Room.objects.create(name='Room', capacity=10, group=self.building)
+        User.objects.create_user(username='NormalUser', password='Password')
+        self.client.login(username='NormalUser', password='Password')
+
+    def test_reports_per_request(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DOMAIN_PROFILING=True, DOMAIN_PROFILING_DIR=directory):
+                response = self.client.get(reverse('buildings:building_detail',
+                                                   kwargs={'building_id': self.building.id}))
+            self.assertEqual(200, response.status_code)
+            reports = sorted(os.listdir(directory))
+            self.assertEqual(2, len(reports))
+            self.assertTrue(reports[0].endswith('buildings-building_detail.json'))
+            with open(os.path.join(directory, reports[0])) as report:
+                report = json.load(report)
+            self.assertEqual('buildings:building_detail', report['label'])
+            self.assertGreater(report['total_queries'], 0)
+
+    def test_reports_of_the_same_second(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DOMAIN_PROFILING=True, DOMAIN_PROFILING_DIR=directory):
+                with mock.patch('time.strftime', return_value='20170101-000000'):
+                    for _ in range(2):
+                        self.client.get(reverse('buildings:building_detail', kwargs={'building_id': self.building.id}))
+            self.assertEqual(4, len(os.listdir(directory)))
+
+    def test_disabled_by_default(self):
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(DOMAIN_PROFILING_DIR=directory):
+                self.client.get(reverse('buildings:index'))
+            self.assertEqual([], os.listdir(directory))
+
+
+class ProfileCommandTest(TestCase):
+    def test_profile_command(self):
+        out = StringIO()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'profile.json')
+            call_command('profile_command', 'generate_farm', '--years', '1', '--buildings', '1', '--rooms-per-group',
+                         '1', '--end-date', '2017-03-01', json=path, stdout=out)
+            with open(path) as report:
+                report = json.load(report)
+        self.assertEqual('generate_farm', report['label'])
+        self.assertGreater(report['total_queries'], 0)
+        self.assertIn('Profile generate_farm', out.getvalue())
+
+
+class RequestMemoizationTest(TestCase):
+    def setUp(self):
+        self.flock = Flock.objects.create(entry_date=date(2017, 1, 1), entry_weight=220, number_of_animals=10)
+        self.building = Building.objects.create(name='Building')
+        self.room = Room.objects.create(name='Room', capacity=20, group=self.building)
+        self.room.animalroomentry_set.create(number_of_animals=10, flock=self.flock, date='2017-01-01')
+
+    def test_not_memoized_outside_scope(self):
+        self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 2))
+        with self.assertNumQueries(1):
+            self.assertEqual(10, self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 2)))
+
+    def test_memoized_per_instance_and_arguments(self):
+        with memoization_scope():
+            self.assertEqual({self.flock: 10}, self.room.get_flocks_present_at(date(2017, 1, 2)))
+            with self.assertNumQueries(0):
+                self.assertEqual({self.flock: 10}, self.room.get_flocks_present_at(date(2017, 1, 2)))
+            other_instance = Room.objects.get(id=self.room.id)
+            with self.assertNumQueries(0):
+                self.assertEqual({self.flock: 10}, other_instance.get_flocks_present_at(date(2017, 1, 2)))
+            self.assertEqual({}, self.room.get_flocks_present_at(date(2016, 12, 31)))
+
+    def test_cleared_on_write(self):
+        with memoization_scope():
+            self.assertEqual(10, self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 5)))
+            self.room.animalroomexit_set.create(number_of_animals=4, flock=self.flock, date='2017-01-03')
+            self.assertEqual(6, self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 5)))
+
+    def test_bulk_deletes_without_signals(self):
+        for model in [OccupancyLedger, OccupancyCheckpoint, FeedStockForecast, KpiSnapshot]:
+            self.assertFalse(post_delete.has_listeners(model), model)
+
+    def test_cleared_at_end_of_scope(self):
+        with memoization_scope():
+            with memoization_scope():
+                self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 2))
+            with self.assertNumQueries(0):
+                self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 2))
+        with self.assertNumQueries(1):
+            self.room.get_animals_for_flock(self.flock.id, date(2017, 1, 2))
+
+    def test_flock_properties(self):
+        with memoization_scope():
+            expected_exit_date = self.flock.expected_exit_date
+            other_instance = Flock.objects.get(id=self.flock.id)
+            with self.assertNumQueries(0):
+                self.assertEqual(expected_exit_date, other_instance.expected_exit_date)
+
+
+class AggregateCacheTest(TestCase):
+    def setUp(self):
+        self.cache = AggregateCache('tests.aggregate')
+        self.cache.invalidate_all()
+        self.computed = []
+
+    def compute(self, value):
+        def compute():
+            self.computed.append(value)
+            return value
+        return compute
+
+    def test_cached_per_entity_and_arguments(self):
+        self.assertEqual(1, self.cache.get(1, self.compute(1), date(2017, 1, 1)))
+        self.assertEqual(1, self.cache.get(1, self.compute(2), date(2017, 1, 1)))
+        self.assertEqual(3, self.cache.get(1, self.compute(3), date(2017, 1, 2)))
+        self.assertEqual(4, self.cache.get(2, self.compute(4), date(2017, 1, 1)))
+        self.assertEqual([1, 3, 4], self.computed)
+
+    def test_invalidate(self):
+        self.cache.get(1, self.compute(1), 'a')
+        self.cache.get(1, self.compute(2), 'b')
+        self.cache.get(2, self.compute(3), 'a')
+        self.cache.invalidate(1)
+        self.assertEqual(4, self.cache.get(1, self.compute(4), 'a'))
+        self.assertEqual(5, self.cache.get(1, self.compute(5), 'b'))
+        self.assertEqual(3, self.cache.get(2, self.compute(6), 'a'))
+
+    def test_invalidate_all(self):
+        self.cache.get(1, self.compute(1))
+        self.cache.get(2, self.compute(2))
+        self.cache.invalidate_all()
+        self.assertEqual(3, self.cache.get(1, self.compute(3)))
+        self.assertEqual(4, self.cache.get(2, self.compute(4)))
+
+    def test_none_is_not_cached(self):
+        self.assertIsNone(self.cache.get(1, self.compute(None)))
+        self.assertIsNone(self.cache.get(1, self.compute(None)))
+        self.assertEqual([None, None], self.computed)
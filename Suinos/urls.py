@@ -17,8 +17,11 @@ from django.conf.urls import url, include
 from django.contrib import admin
 from django.contrib.auth.views import login
 
+from .views import query_stats_view
+
 urlpatterns = [
     url(r'^accounts/login/$', login, {'template_name': 'farm/login.html'}, name='login'),
+    url(r'^stats/queries/$', query_stats_view, name='query_stats'),
     url(r'^flocks/', include('flocks.urls')),
     url(r'^feeding/', include('feeding.urls')),
     url(r'^medications/', include('medications.urls')),
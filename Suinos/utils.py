@@ -1,4 +1,5 @@
 import os
+import re
 import string
 from filelock import FileLock
 from configparser import ConfigParser
@@ -7,6 +8,10 @@ from django.utils.crypto import get_random_string
 
 VALID_KEY_CHARS = string.ascii_uppercase + string.ascii_lowercase + string.digits
 
+QUOTED_STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\((?:\s*\?\s*,)+\s*\?\s*\)')
+
 
 class FilePermissionError(Exception):
     """The file permissions are insecure."""
@@ -47,3 +52,10 @@ def load_environment_file(envfile, key_length=64):
             envname = 'DJANGO_%s' % key.upper()  # Prefix to avoid collisions with existing env variables
             if envname not in os.environ:  # Don't replace existing defined variables
                 os.environ[envname] = value
+
+
+def normalize_sql(sql):
+    """Replace the literal values in a query by placeholders, so the same query with other parameters compares equal."""
+    sql = QUOTED_STRING.sub('?', sql)
+    sql = NUMBER.sub('?', sql)
+    return VALUE_LIST.sub('(...)', sql)
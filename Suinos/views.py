@@ -0,0 +1,12 @@
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+
+from .middleware import query_stats
+
+
+@staff_member_required
+def query_stats_view(request):
+    """Show the rolling query statistics per view, collected by the QueryInstrumentationMiddleware, as JSON."""
+    return JsonResponse({'enabled': getattr(settings, 'QUERY_INSTRUMENTATION', False),
+                         'views': query_stats.summary()})
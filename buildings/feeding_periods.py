@@ -0,0 +1,105 @@
+from bisect import bisect_right
+
+from django.core.cache import cache
+
+
+class FeedingPeriodIndex:
+
+    """The feeding periods of a room, kept in the cache.
+
+    Every RoomFeedingChange starts a period in which the room is fed with one feed type. Consecutive changes to the same
+    feed type are merged, so the index is a sorted list of (feed_type_id, start_date, end_date) intervals, where the
+    end_date of the last interval is None. The index of a room is built with one query, stored in the cache, and
+    invalidated when a RoomFeedingChange of that room is saved or deleted. The index also expires after the timeout, so
+    a process with its own local memory cache does not keep the periods it missed the invalidation of.
+    """
+
+    cache_key = 'buildings.feeding_periods.%d'
+    timeout = 24 * 60 * 60
+
+    def __init__(self, periods):
+        self.periods = periods
+        self.start_dates = [period[1] for period in periods]
+
+    @classmethod
+    def for_room(cls, room_id):
+        """Get the index of a room, from the cache when available."""
+        periods = cache.get(cls.cache_key % room_id)
+        if periods is None:
+            periods = cls.__build_periods(room_id)
+            cache.set(cls.cache_key % room_id, periods, cls.timeout)
+        return cls(periods)
+
+    @classmethod
+    def for_rooms(cls, room_ids):
+        """Get the indexes of several rooms, loading the rooms missing from the cache with one query.
+
+        :return: A dict with the index of every room, keyed by room id.
+        """
+        keys = {room_id: cls.cache_key % room_id for room_id in room_ids}
+        cached = cache.get_many(keys.values())
+        periods = {room_id: cached[key] for room_id, key in keys.items() if key in cached}
+        missing = [room_id for room_id in keys if room_id not in periods]
+        if missing:
+            built = cls.__build_periods_for_rooms(missing)
+            cache.set_many({keys[room_id]: built[room_id] for room_id in missing}, cls.timeout)
+            periods.update(built)
+        return {room_id: cls(room_periods) for room_id, room_periods in periods.items()}
+
+    @classmethod
+    def invalidate(cls, room_id):
+        """Remove the index of a room from the cache."""
+        cache.delete(cls.cache_key % room_id)
+
+    def feed_type_id_at(self, at_date):
+        """Get the id of the feed type used at a date, or None if the room had no feed type yet."""
+        index = bisect_right(self.start_dates, at_date) - 1
+        if index < 0:
+            return None
+        return self.periods[index][0]
+
+    def periods_for(self, start_date, end_date, feed_type_id):
+        """Get the periods, within [start_date, end_date], in which the room was fed with the given feed type.
+
+        :return: A list of [start, end] lists, as returned by Room.get_feeding_periods.
+        """
+        feeding_periods = []
+        first = bisect_right(self.start_dates, start_date) - 1
+        if first < 0:
+            return feeding_periods
+
+        last = bisect_right(self.start_dates, end_date)
+        for period_feed_type_id, period_start, period_end in self.periods[first:last]:
+            if period_feed_type_id != feed_type_id:
+                continue
+            if period_end is None or period_end > end_date:
+                period_end = end_date
+            feeding_periods.append([max(period_start, start_date), period_end])
+
+        return feeding_periods
+
+    @staticmethod
+    def __build_periods(room_id):
+        from .models import RoomFeedingChange
+        changes = RoomFeedingChange.objects.filter(room_id=room_id).order_by('date', 'id')
+        periods = []
+        for feed_type_id, change_date in changes.values_list('feed_type_id', 'date'):
+            FeedingPeriodIndex.__add_change(periods, feed_type_id, change_date)
+        return periods
+
+    @staticmethod
+    def __build_periods_for_rooms(room_ids):
+        from .models import RoomFeedingChange
+        changes = RoomFeedingChange.objects.filter(room_id__in=room_ids).order_by('room_id', 'date', 'id')
+        periods = {room_id: [] for room_id in room_ids}
+        for room_id, feed_type_id, change_date in changes.values_list('room_id', 'feed_type_id', 'date'):
+            FeedingPeriodIndex.__add_change(periods[room_id], feed_type_id, change_date)
+        return periods
+
+    @staticmethod
+    def __add_change(periods, feed_type_id, change_date):
+        if periods and periods[-1][0] == feed_type_id:
+            return
+        if periods:
+            periods[-1] = (periods[-1][0], periods[-1][1], change_date)
+        periods.append((feed_type_id, change_date, None))
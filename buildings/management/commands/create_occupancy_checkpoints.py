@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from buildings.models import OccupancyCheckpoint
+
+
+class Command(BaseCommand):
+
+    """Create the occupancy checkpoints that are due.
+
+    Meant to be run periodically, e.g. daily from cron. A checkpoint is only created when the interval since the last
+    one has passed, so running the command more often does no harm.
+    """
+
+    help = 'Create the occupancy checkpoints of the farm that are due.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=30, help='Number of days between two checkpoints.')
+        parser.add_argument('--until', type=parse_date, default=None,
+                            help='Last date to create a checkpoint for (YYYY-MM-DD), today by default.')
+
+    def handle(self, *args, **options):
+        checkpoints = OccupancyCheckpoint.objects.create_due(options['interval'], options['until'])
+        self.stdout.write('Created %d occupancy checkpoints.' % len(checkpoints))
@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+from time import perf_counter
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from buildings.models import Building, Room, AnimalRoomEntry, AnimalRoomExit, RoomFeedingChange, OccupancyLedger
+from feeding.models import FeedType, FeedEntry
+from flocks.models import Flock
+from medications.models import Treatment
+
+
+class Command(BaseCommand):
+
+    """Show the query plan and the time of the queries that filter the event tables on a room or flock and a date.
+
+    Run it on a database with a few years of data, e.g. one filled by a synthetic data generator, before and after
+    applying the index migrations, to compare the plans: without the indexes the plans scan the tables, with them they
+    search the composite indexes.
+    """
+
+    help = 'Explain and time the date filtered queries on the event tables.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='Number of times every query is timed.')
+
+    def handle(self, *args, **options):
+        room = Room.objects.order_by('id').first()
+        flock = Flock.objects.order_by('id').first()
+        feed_type = FeedType.objects.order_by('id').first()
+        building = Building.objects.order_by('id').first()
+        if None in [room, flock, feed_type, building]:
+            self.stderr.write('The database needs at least one building, room, flock and feed type.')
+            return
+
+        for name, queryset in self.__get_queries(building, room, flock, feed_type):
+            sql, params = queryset.query.sql_with_params()
+            self.stdout.write('%s: %.3f ms' % (name, self.__time(sql, params, options['repeat'])))
+            for line in self.__explain(sql, params):
+                self.stdout.write('    ' + line)
+
+    @staticmethod
+    def __get_queries(building, room, flock, feed_type):
+        today = date.today()
+        return [
+            ('Room entries until today', AnimalRoomEntry.objects.filter(room=room, date__lte=today)),
+            ('Room exits until today', AnimalRoomExit.objects.filter(room=room, date__lte=today)),
+            ('Flock entries until today', AnimalRoomEntry.objects.filter(flock=flock, date__lte=today)),
+            ('Flock exits until today', AnimalRoomExit.objects.filter(flock=flock, date__lte=today)),
+            ('Room feeding type today',
+             RoomFeedingChange.objects.filter(room=room, date__lte=today).order_by('-date')[:1]),
+            ('Room occupancy today', OccupancyLedger.objects.filter(room=room, date__lte=today).order_by('-date')[:1]),
+            ('Feed entries of the past year',
+             FeedEntry.objects.filter(feed_type=feed_type, date__gt=today - timedelta(days=365))),
+            ('Silo deliveries of a building', building.get_delivery_timeline(feed_type)),
+            ('Active treatments of a flock', Treatment.objects.filter(flock=flock, stop_date__isnull=True)),
+        ]
+
+    @staticmethod
+    def __time(sql, params, repeat):
+        """Get the average time, in milliseconds, to execute a query and fetch its rows."""
+        with connection.cursor() as cursor:
+            start = perf_counter()
+            for _ in range(repeat):
+                cursor.execute(sql, params)
+                cursor.fetchall()
+            return (perf_counter() - start) * 1000 / repeat
+
+    @staticmethod
+    def __explain(sql, params):
+        """Get the lines of the query plan of a query, in the format of the database."""
+        prefix = 'EXPLAIN QUERY PLAN ' if connection.vendor == 'sqlite' else 'EXPLAIN '
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return [' | '.join([str(column) for column in row]) for row in cursor.fetchall()]
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from buildings.models import FeedStockForecast
+
+
+class Command(BaseCommand):
+
+    """Recompute the feed stock forecasts of all buildings.
+
+    Meant to be run periodically, e.g. from cron, so the building page and the dashboard only read the stored
+    forecasts.
+    """
+
+    help = 'Recompute the feed stock forecast of every building and feed type.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', type=parse_date, default=None,
+                            help='Date of the forecast (YYYY-MM-DD), today by default.')
+
+    def handle(self, *args, **options):
+        forecasts = FeedStockForecast.objects.refresh(options['date'])
+        self.stdout.write('Stored %d feed stock forecasts.' % len(forecasts))
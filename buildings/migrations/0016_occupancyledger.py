@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:27
+from __future__ import unicode_literals
+
+import buildings.models
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_ledger(apps, schema_editor):
+    Room = apps.get_model('buildings', 'Room')
+    OccupancyLedger = apps.get_model('buildings', 'OccupancyLedger')
+    for room_id in Room.objects.values_list('id', flat=True):
+        OccupancyLedger.objects.rebuild(room_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flocks', '0015_auto_20170624_1312'),
+        ('buildings', '0015_animalroomtransfer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OccupancyLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('flock_count', models.IntegerField()),
+                ('room_count', models.IntegerField()),
+                ('flock', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='flocks.Flock')),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='buildings.Room')),
+            ],
+            managers=[
+                ('objects', buildings.models.OccupancyLedgerManager()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='occupancyledger',
+            index=models.Index(fields=['room', 'date'], name='buildings_o_room_id_4337ee_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='occupancyledger',
+            index=models.Index(fields=['room', 'flock', 'date'], name='buildings_o_room_id_70c991_idx'),
+        ),
+        migrations.RunPython(build_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:29
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    RoomGroup = apps.get_model('buildings', 'RoomGroup')
+    pending = [(group, '/') for group in RoomGroup.objects.filter(group__isnull=True)]
+    while pending:
+        group, parent_path = pending.pop()
+        group.path = '%s%d/' % (parent_path, group.id)
+        group.save(update_fields=['path'])
+        pending.extend([(child, group.path) for child in RoomGroup.objects.filter(group=group)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildings', '0016_occupancyledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='roomgroup',
+            name='path',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:35
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('feeding', '0008_auto_20170702_1117'),
+        ('buildings', '0017_roomgroup_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedStockForecast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('computed_at', models.DateTimeField()),
+                ('capacity', models.FloatField()),
+                ('remaining', models.FloatField()),
+                ('average_consumption', models.FloatField()),
+                ('daily_consumption', models.FloatField()),
+                ('estimated_end_date', models.DateField(blank=True, null=True)),
+                ('building', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='buildings.Building')),
+                ('feed_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='feeding.FeedType')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='feedstockforecast',
+            unique_together=set([('building', 'feed_type', 'date')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('buildings', '0019_occupancycheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='animalroomentry',
+            index=models.Index(fields=['room', 'date'], name='buildings_a_room_id_ff6729_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animalroomentry',
+            index=models.Index(fields=['flock', 'date'], name='buildings_a_flock_i_ca3b61_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animalroomexit',
+            index=models.Index(fields=['room', 'date'], name='buildings_a_room_id_d74e9e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='animalroomexit',
+            index=models.Index(fields=['flock', 'date'], name='buildings_a_flock_i_c704ec_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomfeedingchange',
+            index=models.Index(fields=['room', 'date'], name='buildings_r_room_id_a66db0_idx'),
+        ),
+    ]
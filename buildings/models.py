@@ -1,145 +1,230 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Sum, Min, Max, Value, OuterRef, Subquery
+from django.db.models.functions import Concat, Substr
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.dateparse import parse_date
 
 from flocks.models import Flock, AnimalDeath, AnimalSeparation, AnimalFarmExit
 from feeding.models import FeedType, FeedEntry
 from medications.models import Treatment, Surgery
+from Suinos.caching import AggregateCache
+from Suinos.memoization import request_memoized, clear_memoized, memoization_scope
+from Suinos.profiling import profiled
+
+from .feeding_periods import FeedingPeriodIndex
 
 from datetime import date, timedelta
-from itertools import chain
 
 
 class RoomGroup(models.Model):
     name = models.CharField(max_length=20)
     group = models.ForeignKey('self', blank=True, null=True)
+    path = models.CharField(max_length=255, blank=True, editable=False, db_index=True)
+    occupancy_panel_cache = AggregateCache('buildings.occupancy_panel')
+
+    def save(self, *args, **kwargs):
+        """Save the group, and keep the materialized path of the group and its sub-groups up to date."""
+        super().save(*args, **kwargs)
+        self.__update_path()
+
+    def get_descendant_groups(self):
+        """Get this group and all the groups below it, at any depth, in a single query."""
+        if self.pk is None:
+            return RoomGroup.objects.none()
+        return RoomGroup.objects.filter(path__startswith=self.path)
+
+    def get_all_rooms(self):
+        """Get all the rooms in this group and in its sub-groups, at any depth, in a single query."""
+        if self.pk is None:
+            return Room.objects.none()
+        return Room.objects.filter(group__path__startswith=self.path)
+
+    @property
+    def ancestor_ids(self):
+        """The ids of the groups above this group, starting at the top-level group."""
+        return [int(group_id) for group_id in self.path.strip('/').split('/')[:-1] if group_id]
 
     @property
     def number_of_rooms(self):
-        count = 0
-        for group in self.roomgroup_set.all():
-            count += group.number_of_rooms
+        return self.get_all_rooms().count()
 
-        count += self.room_set.count()
-        return count
+    @staticmethod
+    def invalidate_occupancy_panels(group_ids=(), room_ids=()):
+        """Drop the cached occupancy panels of groups, of the groups of rooms, and of all the groups above them.
+
+        :param group_ids: The ids of the groups that changed.
+        :param room_ids: The ids of the rooms that changed.
+        """
+        group_ids = set(group_ids) - {None}
+        room_ids = set(room_ids) - {None}
+        if room_ids:
+            group_ids.update(Room.objects.filter(id__in=room_ids).values_list('group_id', flat=True))
+        if not group_ids:
+            return
+
+        panel_ids = set()
+        for path in RoomGroup.objects.filter(id__in=group_ids).values_list('path', flat=True):
+            panel_ids.update(int(group_id) for group_id in path.strip('/').split('/') if group_id)
+        RoomGroup.occupancy_panel_cache.invalidate(*(panel_ids | group_ids))
 
     @property
     def animal_capacity(self):
-        count = 0
-        for group in self.roomgroup_set.all():
-            count += group.animal_capacity
-
-        for room in self.room_set.all():
-            count += room.capacity
-
-        return count
+        capacity = self.get_all_rooms().aggregate(Sum('capacity'))['capacity__sum']
+        if capacity is None:
+            return 0
+        return capacity
 
     @property
     def occupancy(self):
-        count = 0
-        for group in self.roomgroup_set.all():
-            count += group.occupancy
-
-        for room in self.room_set.all():
-            count += room.occupancy
+        return self.occupancy_snapshot().occupancy_of(self)
+
+    @profiled
+    def occupancy_snapshot(self, at_date=None):
+        """Get the occupancy of all the rooms and sub-groups of this group, loaded at once.
+
+        :param at_date: The date for the occupancy. Defaults to today.
+        :return: An OccupancySnapshot.
+        """
+        from .occupancy import OccupancySnapshot
+        if at_date is None:
+            at_date = date.today()
+        if isinstance(at_date, str):
+            at_date = parse_date(at_date)
 
-        return count
+        return OccupancySnapshot(self, at_date)
 
+    @profiled
     def animal_days_for_feed_type(self, start_date, end_date, feed_type):
+        from .occupancy import AnimalDaysEngine
+        rooms = list(self.get_all_rooms())
+        engine = AnimalDaysEngine(rooms)
         total = 0
-        for group in self.roomgroup_set.all():
-            total += group.animal_days_for_feed_type(start_date, end_date, feed_type)
-
-        for room in self.room_set.all():
-            total += room.get_animal_days_for_feeding_period(start_date, end_date, feed_type)
+        for room in rooms:
+            total += room.get_animal_days_for_feeding_period(start_date, end_date, feed_type, engine=engine)
 
         return total
 
     def __str__(self):
         return self.name
 
+    def __update_path(self):
+        parent_path = '/'
+        if self.group_id is not None:
+            parent_path = RoomGroup.objects.values_list('path', flat=True).get(id=self.group_id)
+
+        old_path = self.path
+        new_path = '%s%d/' % (parent_path, self.id)
+        if old_path == new_path:
+            return
+
+        RoomGroup.objects.filter(id=self.id).update(path=new_path)
+        if old_path:
+            RoomGroup.objects.filter(path__startswith=old_path).exclude(id=self.id).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1)))
+        self.path = new_path
+
 
 class Building(RoomGroup):
     location = models.CharField(max_length=150, blank=True)
+    remaining_feed_cache = AggregateCache('buildings.remaining_feed')
 
+    @request_memoized
+    @profiled
     def feed_capacity(self, feed_type):
         capacity = 0
         for silo in self.silo_set.all():
-            if silo.feed_type == feed_type:
+            if silo.feed_type_id == feed_type.id:
                 capacity += silo.capacity
 
         return capacity
 
+    def get_delivery_timeline(self, feed_type, start_date=None, end_date=None):
+        """Get the silo feed entries of this building for a feed type, ordered by delivery date.
+
+        The entries of all the silos come from a single query, with their FeedEntry joined in, so reading their date
+        and weight does not hit the database again.
+
+        :param start_date: Optional first delivery date to include.
+        :param end_date: Optional last delivery date to include.
+        :return: A QuerySet of SiloFeedEntry.
+        """
+        entries = SiloFeedEntry.objects.filter(silo__building=self, silo__feed_type=feed_type)
+        if start_date is not None:
+            entries = entries.filter(feed_entry__date__gte=start_date)
+        if end_date is not None:
+            entries = entries.filter(feed_entry__date__lte=end_date)
+
+        return entries.select_related('feed_entry').order_by('feed_entry__date', 'silo_id', 'id')
+
+    @profiled
     def get_feed_entries(self, start_date, end_date, feed_type):
         if isinstance(start_date, str):
             start_date = parse_date(start_date)
         if isinstance(end_date, str):
             end_date = parse_date(end_date)
 
-        silos = self.silo_set.filter(feed_type=feed_type)
-        entries = []
-        for silo in silos:
-            s_entries = silo.silofeedentry_set.filter(feed_entry__date__gte=start_date, feed_entry__date__lte=end_date)
-            s_entries.order_by('feed_entry__date')
-            entries.extend(list(s_entries))
-
-        entries = sorted(entries, key=lambda instance: instance.feed_entry.date)
-        return entries
+        return list(self.get_delivery_timeline(feed_type, start_date, end_date))
 
+    @profiled
     def get_last_feed_entries(self, at_date, feed_type):
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
 
-        silos = self.silo_set.filter(feed_type=feed_type)
-        entries = []
-        for silo in silos:
-            s_entries = silo.silofeedentry_set.filter(feed_entry__date__lte=at_date).order_by('-feed_entry__date').first()
-            if s_entries is not None:
-                entries.append(s_entries)
-
-        entries = sorted(entries, key=lambda instance: instance.date)
-        if len(entries) >= 1:
-            return entries[-1]
-        else:
-            return None
+        return self.get_delivery_timeline(feed_type, end_date=at_date).last()
 
+    @request_memoized
+    @profiled
     def get_estimated_remaining_feed(self, at_date, feed_type):
+        """Get the feed of a type estimated to be left in the silos of the building at a date.
+
+        The estimation is kept in the cache, until a movement, feed entry, feeding change, silo or room is saved or
+        deleted.
+        """
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
+        if self.pk is None:
+            return self.__compute_estimated_remaining_feed(at_date, feed_type)
 
+        return self.remaining_feed_cache.get(
+            self.id, lambda: self.__compute_estimated_remaining_feed(at_date, feed_type), at_date, feed_type.id)
+
+    def __compute_estimated_remaining_feed(self, at_date, feed_type):
         end_date = at_date + timedelta(days=1)
         last_feed_entry = self.get_last_feed_entries(at_date, feed_type)
         if last_feed_entry is not None:
-            consumption_animal_days = self.animal_days_for_feed_type(last_feed_entry.date, end_date, feed_type)
+            consumption_animal_days = self.get_feed_animal_days(feed_type).animal_days(last_feed_entry.date, end_date)
             consumption_kg = consumption_animal_days * self.get_average_feed_consumption(at_date, feed_type)
             return max([last_feed_entry.weight + last_feed_entry.remaining - consumption_kg, 0])
         else:
             return 0
 
+    @request_memoized
+    @profiled
     def get_average_feed_consumption(self, at_date, feed_type):
+        """Get the average feed consumption per animal per day, over the feed entries of the past year."""
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
 
-        start_date = at_date - timedelta(365)
-        entries = self.get_feed_entries(start_date, at_date, feed_type)
-        intervals = zip(entries, entries[1:])
-        interval_count = len(entries) - 1
-        average = 0
-        for entry, next_entry in intervals:
-            weight_begin = entry.weight + entry.remaining
-            weight_end = next_entry.remaining
-            avg_for_entry = (weight_begin - weight_end) / self.animal_days_for_feed_type(entry.date,
-                                                                                         next_entry.date, feed_type)
+        return self.__compute_average_feed_consumption(at_date, feed_type)
 
-            average += avg_for_entry / interval_count
-        return average
+    @request_memoized
+    @profiled
+    def get_feed_animal_days(self, feed_type):
+        """Get a FeedAnimalDays for this building and feed type, loaded once per request."""
+        from .occupancy import FeedAnimalDays
+        return FeedAnimalDays(self, feed_type)
 
+    @request_memoized
+    @profiled
     def get_estimated_feed_end_date(self, at_date, feed_type):
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
 
         remaining_feed = self.get_estimated_remaining_feed(at_date, feed_type)
         average_daily_consumption = self.get_average_feed_consumption(at_date, feed_type)
-        current_consumption = self.animal_days_for_feed_type(at_date, at_date + timedelta(days=1), feed_type)
+        current_consumption = self.get_feed_animal_days(feed_type).animal_days(at_date, at_date + timedelta(days=1))
         daily_consumption = average_daily_consumption * current_consumption
         if daily_consumption > 0:
             remaining_days = remaining_feed / daily_consumption
@@ -147,6 +232,23 @@ class Building(RoomGroup):
         else:
             return None
 
+    def __compute_average_feed_consumption(self, at_date, feed_type):
+        start_date = at_date - timedelta(365)
+        entries = self.get_feed_entries(start_date, at_date, feed_type)
+        animal_days = self.get_feed_animal_days(feed_type)
+        consumptions = []
+        for entry, next_entry in zip(entries, entries[1:]):
+            weight_begin = entry.weight + entry.remaining
+            weight_end = next_entry.remaining
+            interval_animal_days = animal_days.animal_days(entry.date, next_entry.date)
+            if interval_animal_days > 0:  # No animals were fed with this feed type between the two deliveries.
+                consumptions.append((weight_begin - weight_end, interval_animal_days))
+
+        average = 0
+        for consumed, interval_animal_days in consumptions:
+            average += consumed / interval_animal_days / len(consumptions)
+        return average
+
 
 class Silo(models.Model):
     capacity = models.FloatField()
@@ -163,54 +265,51 @@ class Room(models.Model):
     name = models.CharField(max_length=20)
     group = models.ForeignKey(RoomGroup)
     is_separation = models.BooleanField(default=False)
+    occupancy_cache = AggregateCache('buildings.room_occupancy')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.occupancy_transitions = {}
         self.transition_start_date = None
         self.transition_end_date = None
-        self._entry_list = []
-        self._exit_list = []
 
     @property
     def occupancy(self, at_date=date.today()):
         return self.get_occupancy_at_date(at_date)
 
+    @request_memoized
+    @profiled
     def get_occupancy_at_date(self, at_date=date.today()):
+        """Get the number of animals in the room at a date, kept in the cache until a movement of the room changes."""
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
+        if self.pk is None:
+            return 0
 
-        count = 0
-        for entry in self.__get_entry_list(start_date=None, end_date=at_date):
-            count += entry.number_of_animals
+        return self.occupancy_cache.get(self.id, lambda: self.__load_occupancy_at_date(at_date), at_date)
 
-        for room_exit in self.__get_exit_list(start_date=None, end_date=at_date):
-            count -= room_exit.number_of_animals
-        return count
+    def __load_occupancy_at_date(self, at_date):
+        ledger_row = self.occupancyledger_set.filter(date__lte=at_date).order_by('-date').first()
+        if ledger_row is None:
+            return 0
+        return ledger_row.room_count
 
+    @request_memoized
+    @profiled
     def get_animals_for_flock(self, flock_id, at_date=date.today()):
-        count = 0
-        for entry in self.animalroomentry_set.filter(flock_id=flock_id, date__lte=at_date):
-            count += entry.number_of_animals
-
-        for room_exit in self.animalroomexit_set.filter(flock_id=flock_id, date__lte=at_date):
-            count -= room_exit.number_of_animals
-        return count
+        ledger_row = self.occupancyledger_set.filter(flock_id=flock_id, date__lte=at_date).order_by('-date').first()
+        if ledger_row is None:
+            return 0
+        return ledger_row.flock_count
 
+    @request_memoized
+    @profiled
     def get_flocks_present_at(self, at_date=date.today()):
-        flocks = {}
-        for entry in self.animalroomentry_set.filter(date__lte=at_date):
-            count = flocks.get(entry.flock, 0) + entry.number_of_animals
-            flocks.update({entry.flock: count})
-
-        for room_exit in self.animalroomexit_set.filter(date__lte=at_date):
-            count = flocks.get(room_exit.flock, 0) - room_exit.number_of_animals
-            flocks.update({room_exit.flock: count})
-
-        flocks = {key: value for key, value in flocks.items() if value > 0}
-
-        return flocks
+        flock_counts = OccupancyCheckpoint.objects.flock_counts_at(at_date, room_id=self.id)
+        flocks = Flock.objects.in_bulk([flock_id for _, flock_id in flock_counts.keys()])
+        return {flocks[flock_id]: count for (_, flock_id), count in flock_counts.items()}
 
+    @profiled
     def get_occupancy_transitions(self, start_date, end_date):
         if isinstance(start_date, str):
             start_date = parse_date(start_date)
@@ -230,28 +329,30 @@ class Room(models.Model):
 
         return results
 
+    @profiled
     def get_animal_days_for_period(self, start_date, end_date):
-        changes = self.get_occupancy_transitions(start_date, end_date)
-        dates = sorted(changes.keys())
-        previous_count = changes[dates[0]]
-        previous_date = dates[0]
-        animals_days = 0
-        for transition_date in dates[1:]:
-            days = (transition_date - previous_date).days
-            animals_days += previous_count * days
-            previous_date = transition_date
-            previous_count = changes[transition_date]
-
-        return animals_days
-
-    def get_animal_days_for_feeding_period(self, start_date, end_date, feed_type):
+        from .occupancy import AnimalDaysEngine
+        return AnimalDaysEngine([self]).animal_days(self, start_date, end_date)
+
+    @profiled
+    def get_animal_days_for_feeding_period(self, start_date, end_date, feed_type, engine=None):
+        """Get the animal days in the room, during which the room was fed with the given feed type.
+
+        :param engine: Optional AnimalDaysEngine already loaded for this room, to avoid loading the occupancy again.
+        """
+        if engine is None:
+            from .occupancy import AnimalDaysEngine
+            engine = AnimalDaysEngine([self])
+
         feeding_periods = self.get_feeding_periods(start_date, end_date, feed_type)
         count = 0
         for period in feeding_periods:
-            count += self.get_animal_days_for_period(period[0], period[1])
+            count += engine.animal_days(self, period[0], period[1])
 
         return count
 
+    @request_memoized
+    @profiled
     def get_feeding_type_at(self, at_date=date.today()):
         feed_change = self.roomfeedingchange_set.filter(date__lte=at_date).order_by('-date').first()
         if feed_change is None:
@@ -262,98 +363,27 @@ class Room(models.Model):
     def __str__(self):
         return self.group.name + ' - ' + self.name
 
+    @profiled
     def get_feeding_periods(self, start_date, end_date, feed_type):
-        feeding_periods = []
         if isinstance(start_date, str):
             start_date = parse_date(start_date)
         if isinstance(end_date, str):
             end_date = parse_date(end_date)
 
-        feed_change_before_period = self.roomfeedingchange_set.filter(date__lte=start_date).order_by('-date').first()
-        if feed_change_before_period is None:
-            return feeding_periods
-
-        feeding_date = feed_change_before_period.date
-        feeding_change_set = self.roomfeedingchange_set
-        feeding_transitions = feeding_change_set.filter(date__gte=feeding_date, date__lte=end_date).order_by('date')
-
-        start_of_feeding_period = None
-        for transition in feeding_transitions:
-            # We are looking for a start period, and we found one
-            if start_of_feeding_period is None and transition.feed_type == feed_type:
-                start_of_feeding_period = transition.date
-            # We have a start period, looking for an end period
-            elif start_of_feeding_period is not None and transition.feed_type != feed_type:
-                feeding_periods.append([start_of_feeding_period, transition.date])
-                start_of_feeding_period = None
-
-        if start_of_feeding_period is not None:
-            feeding_periods.append([start_of_feeding_period, end_date])
-
-        if len(feeding_periods) > 0:
-            if feeding_periods[0][0] < start_date:
-                feeding_periods[0][0] = start_date
-        return feeding_periods
+        return FeedingPeriodIndex.for_room(self.id).periods_for(start_date, end_date, feed_type.id)
 
     def _compute_occupancy_transitions(self, start_date, end_date):
-        entries = self.__get_entry_list(start_date, end_date)
-        exits = self.__get_exit_list(start_date, end_date)
-        changes = chain(entries, exits)
-        changes = sorted(changes, key=lambda instance: instance.date)
         occupancy = self.get_occupancy_at_date(start_date)
         results = {start_date: occupancy}
-        for change in changes:
-            if change.date != start_date:
-                occupancy += self.__compute_occupance_change(change)
-                results.update({change.date: occupancy})
+        for ledger_row in self.occupancyledger_set.filter(date__gt=start_date, date__lte=end_date).order_by('date'):
+            occupancy = ledger_row.room_count
+            results.update({ledger_row.date: occupancy})
         results.update({end_date: occupancy})
 
         self.transition_start_date = start_date
         self.transition_end_date = end_date
         self.occupancy_transitions = results
 
-    def __get_entry_list(self, start_date=None, end_date=None):
-        self._entry_list = list(self.animalroomentry_set.all())
-
-        return_list = []
-        if start_date is None:
-            if end_date is None:
-                return_list = self._entry_list
-            else:
-                return_list = [obj for obj in self._entry_list if obj.date <= end_date]
-        else:
-            if end_date is None:
-                return_list = [obj for obj in self._entry_list if start_date < obj.date]
-            else:
-                return_list = [obj for obj in self._entry_list if start_date < obj.date <= end_date]
-
-        return return_list
-
-    def __get_exit_list(self, start_date=None, end_date=None):
-        self._exit_list = list(self.animalroomexit_set.all())
-        return_list = []
-        if start_date is None:
-            if end_date is None:
-                return_list = self._exit_list
-            else:
-                return_list = [obj for obj in self._exit_list if obj.date <= end_date]
-        else:
-            if end_date is None:
-                return_list = [obj for obj in self._exit_list if start_date < obj.date]
-            else:
-                return_list = [obj for obj in self._exit_list if start_date < obj.date <= end_date]
-
-        return return_list
-
-    @staticmethod
-    def __compute_occupance_change(change_event):
-        if isinstance(change_event, AnimalRoomEntry):
-            return change_event.number_of_animals
-        elif isinstance(change_event, AnimalRoomExit):
-            return -change_event.number_of_animals
-        else:
-            raise ValueError('Invalid change event')
-
 
 class AnimalRoomEntry(models.Model):
     date = models.DateField()
@@ -361,6 +391,12 @@ class AnimalRoomEntry(models.Model):
     flock = models.ForeignKey(Flock)
     room = models.ForeignKey(Room)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'date']),
+            models.Index(fields=['flock', 'date']),
+        ]
+
     def __str__(self):
         return self.room.__str__() + ' - ' + str(self.number_of_animals)
 
@@ -372,6 +408,218 @@ class AnimalRoomExit(models.Model):
     flock = models.ForeignKey(Flock)
     farm_exit = models.ForeignKey(AnimalFarmExit, null=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'date']),
+            models.Index(fields=['flock', 'date']),
+        ]
+
+
+class OccupancyLedgerManager(models.Manager):
+    use_in_migrations = True
+
+    def rooms_of_flock(self, flock_id, at_date=None):
+        """Get the rooms in which a flock has animals at a date, today by default, in a single query.
+
+        :return: A list of Room, with their group loaded and annotated with flock_count: the number of animals of the
+        flock in the room.
+        """
+        if at_date is None:
+            at_date = date.today()
+        ledger = self.filter(room=OuterRef('pk'), flock_id=flock_id, date__lte=at_date).order_by('-date')
+        rooms = Room.objects.filter(id__in=self.filter(flock_id=flock_id).values('room_id'))
+        rooms = rooms.annotate(flock_count=Subquery(ledger.values('flock_count')[:1],
+                                                    output_field=models.IntegerField()))
+        return list(rooms.filter(flock_count__gt=0).select_related('group').order_by('id'))
+
+    def rebuild(self, room_id, from_date=None):
+        """Replay the animal movements of a room, and store the running counts in the ledger.
+
+        Only the movements on or after from_date are replayed. The counts at the start of the replay are aggregated by
+        the database, so the cost does not depend on the length of the room history.
+
+        :param room_id: The id of the room to rebuild the ledger for.
+        :param from_date: The first date that may have changed. When None, the complete ledger of the room is rebuilt.
+        """
+        apps = self.model._meta.apps
+        entries = apps.get_model('buildings', 'AnimalRoomEntry').objects.filter(room_id=room_id)
+        exits = apps.get_model('buildings', 'AnimalRoomExit').objects.filter(room_id=room_id)
+        rows = self.filter(room_id=room_id)
+
+        flock_counts = {}
+        if from_date is not None:
+            rows = rows.filter(date__gte=from_date)
+            for (flock_id,), count in self.__sum_per_key(entries.filter(date__lt=from_date), ['flock_id']).items():
+                flock_counts.update({flock_id: flock_counts.get(flock_id, 0) + count})
+            for (flock_id,), count in self.__sum_per_key(exits.filter(date__lt=from_date), ['flock_id']).items():
+                flock_counts.update({flock_id: flock_counts.get(flock_id, 0) - count})
+            entries = entries.filter(date__gte=from_date)
+            exits = exits.filter(date__gte=from_date)
+
+        changes = self.__sum_per_key(entries, ['date', 'flock_id'])
+        for key, count in self.__sum_per_key(exits, ['date', 'flock_id']).items():
+            changes.update({key: changes.get(key, 0) - count})
+
+        changes_per_date = {}
+        for (change_date, flock_id), count in changes.items():
+            changes_per_date.setdefault(change_date, []).append((flock_id, count))
+
+        new_rows = []
+        for change_date in sorted(changes_per_date.keys()):
+            day_changes = changes_per_date[change_date]
+            for flock_id, count in day_changes:
+                flock_counts.update({flock_id: flock_counts.get(flock_id, 0) + count})
+
+            room_count = sum(flock_counts.values())
+            for flock_id, count in day_changes:
+                new_rows.append(self.model(room_id=room_id, flock_id=flock_id, date=change_date,
+                                           flock_count=flock_counts[flock_id], room_count=room_count))
+
+        with transaction.atomic():
+            rows.delete()
+            self.bulk_create(new_rows)
+
+    @staticmethod
+    def __sum_per_key(queryset, fields):
+        totals = queryset.order_by().values_list(*fields).annotate(total=Sum('number_of_animals'))
+        return {tuple(row[:-1]): row[-1] for row in totals}
+
+
+class OccupancyLedger(models.Model):
+
+    """Materialized occupancy of the rooms.
+
+    For every day on which animals of a flock enter or leave a room, a row keeps the number of animals of that flock in
+    the room, and the total number of animals in the room, at the end of that day. The occupancy at any date is the
+    last row on or before that date, so it does not need to be computed from all the room entries and exits.
+
+    The rows are maintained by the signal handlers at the end of this module, whenever an AnimalRoomEntry or
+    AnimalRoomExit is saved or deleted.
+    """
+
+    room = models.ForeignKey(Room)
+    flock = models.ForeignKey(Flock)
+    date = models.DateField()
+    flock_count = models.IntegerField()
+    room_count = models.IntegerField()
+
+    objects = OccupancyLedgerManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'date']),
+            models.Index(fields=['room', 'flock', 'date']),
+        ]
+
+
+class OccupancyCheckpointManager(models.Manager):
+
+    def create_due(self, interval=30, until=None):
+        """Create the checkpoints that are due: every interval days after the last checkpoint, up to a date.
+
+        The first checkpoint is created on the date of the first movement. Every checkpoint continues from the state of
+        the previous one, so only the ledger rows since the last checkpoint are loaded.
+
+        :param interval: The number of days between two checkpoints.
+        :param until: The last date a checkpoint may be created for, today by default.
+        :return: The list of created checkpoints.
+        """
+        if until is None:
+            until = date.today()
+        elif isinstance(until, str):
+            until = parse_date(until)
+
+        last_checkpoint = self.order_by('-date').first()
+        if last_checkpoint is None:
+            next_date = OccupancyLedger.objects.aggregate(first_date=Min('date'))['first_date']
+            state = {}
+        else:
+            next_date = last_checkpoint.date + timedelta(days=interval)
+            state = {(entry.room_id, entry.flock_id): entry.flock_count
+                     for entry in last_checkpoint.occupancycheckpointentry_set.all()}
+
+        checkpoint_dates = []
+        while next_date is not None and next_date <= until:
+            checkpoint_dates.append(next_date)
+            next_date += timedelta(days=interval)
+        if not checkpoint_dates:
+            return []
+
+        rows = OccupancyLedger.objects.filter(date__lte=checkpoint_dates[-1])
+        if last_checkpoint is not None:
+            rows = rows.filter(date__gt=last_checkpoint.date)
+        rows = list(rows.order_by('date', 'id').values_list('date', 'room_id', 'flock_id', 'flock_count'))
+
+        checkpoints = []
+        index = 0
+        with transaction.atomic():
+            for checkpoint_date in checkpoint_dates:
+                while index < len(rows) and rows[index][0] <= checkpoint_date:
+                    _, room_id, flock_id, flock_count = rows[index]
+                    state.update({(room_id, flock_id): flock_count})
+                    index += 1
+                state = {key: count for key, count in state.items() if count > 0}
+
+                checkpoint = self.create(date=checkpoint_date)
+                OccupancyCheckpointEntry.objects.bulk_create(
+                    [OccupancyCheckpointEntry(checkpoint=checkpoint, room_id=room_id, flock_id=flock_id,
+                                              flock_count=count) for (room_id, flock_id), count in state.items()])
+                checkpoints.append(checkpoint)
+        return checkpoints
+
+    def invalidate(self, from_date):
+        """Remove the checkpoints from a date on, as a movement on that date changed the state they hold."""
+        self.filter(date__gte=from_date).delete()
+
+    def flock_counts_at(self, at_date, room_id=None):
+        """Get the number of animals of every flock in every room at the end of a date.
+
+        The state is taken from the last checkpoint on or before the date, and only the ledger rows after that
+        checkpoint are replayed.
+
+        :param room_id: Optional room to limit the result to.
+        :return: A dict with the number of animals, keyed by (room_id, flock_id), without empty rooms or flocks.
+        """
+        checkpoint_date = self.filter(date__lte=at_date).aggregate(last_date=Max('date'))['last_date']
+        rows = OccupancyLedger.objects.filter(date__lte=at_date)
+        entries = OccupancyCheckpointEntry.objects.filter(checkpoint__date=checkpoint_date)
+        if room_id is not None:
+            rows = rows.filter(room_id=room_id)
+            entries = entries.filter(room_id=room_id)
+
+        counts = {}
+        if checkpoint_date is not None:
+            rows = rows.filter(date__gt=checkpoint_date)
+            for room, flock, flock_count in entries.values_list('room_id', 'flock_id', 'flock_count'):
+                counts.update({(room, flock): flock_count})
+
+        for room, flock, flock_count in rows.order_by('date', 'id').values_list('room_id', 'flock_id', 'flock_count'):
+            counts.update({(room, flock): flock_count})
+
+        return {key: count for key, count in counts.items() if count > 0}
+
+
+class OccupancyCheckpoint(models.Model):
+
+    """The occupancy of the whole farm at a date, kept every few days.
+
+    The entries of a checkpoint hold the number of animals of every flock in every room at the end of the date, so a
+    "state at date" query starts from the last checkpoint before the date, and only replays the OccupancyLedger rows
+    after it. Checkpoints are created by the create_occupancy_checkpoints management command, and the checkpoints on or
+    after the date of a saved or deleted movement are removed by the signal handlers at the end of this module.
+    """
+
+    date = models.DateField(unique=True)
+
+    objects = OccupancyCheckpointManager()
+
+
+class OccupancyCheckpointEntry(models.Model):
+    checkpoint = models.ForeignKey(OccupancyCheckpoint)
+    room = models.ForeignKey(Room)
+    flock = models.ForeignKey(Flock)
+    flock_count = models.IntegerField()
+
 
 class AnimalRoomTransfer(models.Model):
     room_entry = models.ForeignKey(AnimalRoomEntry)
@@ -401,6 +649,11 @@ class RoomFeedingChange(models.Model):
     feed_type = models.ForeignKey(to=FeedType)
     room = models.ForeignKey(to=Room)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['room', 'date']),
+        ]
+
 
 class SiloFeedEntry(models.Model):
     """
@@ -445,3 +698,237 @@ class SurgeryFromRoom(models.Model):
     before_room = models.ForeignKey(Room, related_name='before_room')
     after_room = models.ForeignKey(Room, related_name='after_room')
     surgery = models.ForeignKey(Surgery)
+
+
+class FeedStockForecastManager(models.Manager):
+
+    def refresh(self, at_date=None):
+        """Compute the feed forecast of every building and feed type, and replace the stored forecasts of the date.
+
+        This is the slow part of the building page, so it is meant to run outside of requests, e.g. from cron through
+        the update_feed_forecasts management command.
+
+        :param at_date: The date of the forecast, today by default.
+        :return: The list of stored forecasts.
+        """
+        if at_date is None:
+            at_date = date.today()
+        elif isinstance(at_date, str):
+            at_date = parse_date(at_date)
+
+        computed_at = timezone.now()
+        feed_types = list(FeedType.objects.all())
+        forecasts = []
+        with memoization_scope():
+            for building in Building.objects.prefetch_related('silo_set'):
+                for feed_type in feed_types:
+                    forecasts.append(self.__compute(building, feed_type, at_date, computed_at))
+
+        with transaction.atomic():
+            self.filter(date=at_date).delete()
+            self.bulk_create(forecasts)
+        return forecasts
+
+    @staticmethod
+    def __compute(building, feed_type, at_date, computed_at):
+        average_consumption = building.get_average_feed_consumption(at_date, feed_type)
+        animal_days = building.get_feed_animal_days(feed_type).animal_days(at_date, at_date + timedelta(days=1))
+        return FeedStockForecast(building=building,
+                                 feed_type=feed_type,
+                                 date=at_date,
+                                 computed_at=computed_at,
+                                 capacity=building.feed_capacity(feed_type),
+                                 remaining=building.get_estimated_remaining_feed(at_date, feed_type),
+                                 average_consumption=average_consumption,
+                                 daily_consumption=average_consumption * animal_days,
+                                 estimated_end_date=building.get_estimated_feed_end_date(at_date, feed_type))
+
+    def for_building(self, building, at_date=None):
+        """Get the forecasts of a building for a date, today by default.
+
+        :return: A dict with the forecasts, keyed by feed type id.
+        """
+        if at_date is None:
+            at_date = date.today()
+        return {forecast.feed_type_id: forecast for forecast in self.filter(building=building, date=at_date)}
+
+    def farm_totals(self, at_date=None):
+        """Get the forecasts of all the buildings for a date, today by default, summed per feed type.
+
+        :return: A dict keyed by feed type id, with the total remaining feed, the earliest estimated end date and the
+        oldest computation time.
+        """
+        if at_date is None:
+            at_date = date.today()
+        totals = self.filter(date=at_date).values('feed_type_id').annotate(remaining=Sum('remaining'),
+                                                                           estimated_end_date=Min('estimated_end_date'),
+                                                                           computed_at=Min('computed_at'))
+        return {total['feed_type_id']: total for total in totals}
+
+
+class FeedStockForecast(models.Model):
+
+    """Precomputed feed stock of a building, for one feed type.
+
+    The forecasts are computed by FeedStockForecastManager.refresh, so pages can show the feed stock without computing
+    the remaining feed and consumption on every request. A forecast is only used on the date it was computed for.
+    """
+
+    building = models.ForeignKey(Building)
+    feed_type = models.ForeignKey(FeedType)
+    date = models.DateField()
+    computed_at = models.DateTimeField()
+    capacity = models.FloatField()
+    remaining = models.FloatField()
+    average_consumption = models.FloatField()
+    daily_consumption = models.FloatField()
+    estimated_end_date = models.DateField(null=True, blank=True)
+
+    objects = FeedStockForecastManager()
+
+    class Meta:
+        unique_together = ('building', 'feed_type', 'date')
+
+
+@receiver(post_init, sender=AnimalRoomEntry)
+@receiver(post_init, sender=AnimalRoomExit)
+def remember_ledger_position(sender, instance, **kwargs):
+    """Remember the room and date a movement had when loaded, so that a move can also update the old position."""
+    instance._ledger_position = (instance.__dict__.get('room_id'), instance.__dict__.get('date'))
+
+
+@receiver(post_save, sender=AnimalRoomEntry)
+@receiver(post_save, sender=AnimalRoomExit)
+def update_ledger_after_save(sender, instance, **kwargs):
+    """Update the occupancy ledger of the room(s) affected by a saved movement."""
+    positions = [getattr(instance, '_ledger_position', (None, None)), (instance.room_id, instance.date)]
+    from_dates = {}
+    for room_id, at_date in positions:
+        if isinstance(at_date, str):
+            at_date = parse_date(at_date)
+        if room_id is None or at_date is None:
+            continue
+        from_dates.update({room_id: min(from_dates.get(room_id, at_date), at_date)})
+
+    for room_id, from_date in from_dates.items():
+        OccupancyLedger.objects.rebuild(room_id, from_date)
+    if from_dates:
+        OccupancyCheckpoint.objects.invalidate(min(from_dates.values()))
+        Room.occupancy_cache.invalidate(*from_dates.keys())
+        RoomGroup.invalidate_occupancy_panels(room_ids=from_dates.keys())
+
+    instance._ledger_position = (instance.room_id, instance.date)
+
+
+@receiver(post_delete, sender=AnimalRoomEntry)
+@receiver(post_delete, sender=AnimalRoomExit)
+def update_ledger_after_delete(sender, instance, **kwargs):
+    """Update the occupancy ledger of the room of a deleted movement."""
+    at_date = instance.date
+    if isinstance(at_date, str):
+        at_date = parse_date(at_date)
+    OccupancyLedger.objects.rebuild(instance.room_id, at_date)
+    OccupancyCheckpoint.objects.invalidate(at_date)
+    Room.occupancy_cache.invalidate(instance.room_id)
+    RoomGroup.invalidate_occupancy_panels(room_ids=[instance.room_id])
+
+
+@receiver(post_init, sender=RoomFeedingChange)
+def remember_feeding_change_room(sender, instance, **kwargs):
+    """Remember the room a feeding change had when loaded, so that moving it also invalidates the old room."""
+    instance._feeding_room_id = instance.__dict__.get('room_id')
+
+
+@receiver(post_save, sender=RoomFeedingChange)
+@receiver(post_delete, sender=RoomFeedingChange)
+def invalidate_feeding_periods(sender, instance, **kwargs):
+    """Drop the cached feeding periods of the room(s) of a saved or deleted feeding change."""
+    for room_id in {getattr(instance, '_feeding_room_id', None), instance.room_id}:
+        if room_id is not None:
+            FeedingPeriodIndex.invalidate(room_id)
+    instance._feeding_room_id = instance.room_id
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+def invalidate_room_feeding_periods(sender, instance, **kwargs):
+    """Drop the cached feeding periods and occupancy of a room, so a new room never sees the values of an old room with
+    its id."""
+    FeedingPeriodIndex.invalidate(instance.id)
+    Room.occupancy_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=AnimalRoomEntry)
+@receiver(post_delete, sender=AnimalRoomEntry)
+@receiver(post_save, sender=AnimalRoomExit)
+@receiver(post_delete, sender=AnimalRoomExit)
+@receiver(post_save, sender=RoomFeedingChange)
+@receiver(post_delete, sender=RoomFeedingChange)
+@receiver(post_save, sender=FeedEntry)
+@receiver(post_delete, sender=FeedEntry)
+@receiver(post_save, sender=SiloFeedEntry)
+@receiver(post_delete, sender=SiloFeedEntry)
+@receiver(post_save, sender=Silo)
+@receiver(post_delete, sender=Silo)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=RoomGroup)
+@receiver(post_delete, sender=RoomGroup)
+@receiver(post_save, sender=Building)
+@receiver(post_delete, sender=Building)
+def invalidate_remaining_feed(sender, instance, **kwargs):
+    """Drop the cached remaining feed of all the buildings.
+
+    The building of a room or a feed entry is not known without queries, and these events are rare compared to the
+    page views, so the values of all the buildings are dropped at once.
+    """
+    Building.remaining_feed_cache.invalidate_all()
+
+
+@receiver(post_init, sender=Room)
+def remember_panel_group(sender, instance, **kwargs):
+    """Remember the group a room had when loaded, so that moving it also invalidates the panel of the old group."""
+    instance._panel_group_id = instance.__dict__.get('group_id')
+
+
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=RoomGroup)
+@receiver(post_delete, sender=RoomGroup)
+@receiver(post_save, sender=Building)
+@receiver(post_delete, sender=Building)
+def invalidate_occupancy_panels(sender, instance, **kwargs):
+    """Drop the cached occupancy panels of the group(s) of a saved or deleted room, or of a saved or deleted group."""
+    if sender is Room:
+        RoomGroup.invalidate_occupancy_panels(group_ids=[getattr(instance, '_panel_group_id', None),
+                                                         instance.group_id])
+        instance._panel_group_id = instance.group_id
+    else:
+        RoomGroup.invalidate_occupancy_panels(group_ids=[instance.id])
+
+
+@receiver(post_save, sender=AnimalRoomEntry)
+@receiver(post_delete, sender=AnimalRoomEntry)
+@receiver(post_save, sender=AnimalRoomExit)
+@receiver(post_delete, sender=AnimalRoomExit)
+@receiver(post_save, sender=RoomFeedingChange)
+@receiver(post_delete, sender=RoomFeedingChange)
+@receiver(post_save, sender=FeedEntry)
+@receiver(post_delete, sender=FeedEntry)
+@receiver(post_save, sender=SiloFeedEntry)
+@receiver(post_delete, sender=SiloFeedEntry)
+@receiver(post_save, sender=Silo)
+@receiver(post_delete, sender=Silo)
+@receiver(post_save, sender=Room)
+@receiver(post_delete, sender=Room)
+@receiver(post_save, sender=RoomGroup)
+@receiver(post_delete, sender=RoomGroup)
+@receiver(post_save, sender=Building)
+@receiver(post_delete, sender=Building)
+def clear_memoized_buildings(sender, instance, **kwargs):
+    """Forget the occupancy, feeding and feed values memoized in the request after a saved or deleted event.
+
+    Only these models are listened to: a post_delete receiver for every model would stop Django from deleting the
+    ledger rows, snapshots and forecasts in bulk.
+    """
+    clear_memoized()
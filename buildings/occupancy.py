@@ -0,0 +1,236 @@
+import operator
+from bisect import bisect_right
+from functools import reduce
+
+from django.db.models import Subquery, OuterRef, IntegerField, Q
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+
+from .models import RoomGroup, Room, OccupancyLedger
+from .feeding_periods import FeedingPeriodIndex
+
+
+class OccupancySnapshot:
+
+    """Occupancy of all the rooms and room groups of a building at a certain date.
+
+    The snapshot is loaded with a constant number of queries: one for the room groups, and one for the rooms together
+    with their occupancy from the OccupancyLedger. The snapshots of several buildings can be loaded together with
+    OccupancySnapshot.for_buildings, with the same two queries. Group totals are summed in memory, so templates and
+    template tags can ask for the occupancy of any room or group of the building without hitting the database again.
+    """
+
+    def __init__(self, building, at_date, groups=None, rooms=None):
+        """Constructor.
+
+        :param building: The building (or any other RoomGroup) for which the snapshot is created.
+        :param at_date: The date for which the occupancy is computed.
+        :param groups: The groups below the building, ordered by id, when they are already loaded.
+        :param rooms: The rooms of the building, ordered by id and annotated with occupancy_at_date, when they are
+        already loaded.
+        """
+        self.building = building
+        self.at_date = at_date
+        self.groups = {building.id: building}
+        self.child_groups = {}
+        self.child_rooms = {}
+        self.room_occupancy = {}
+        self.group_occupancy = {}
+        if groups is None:
+            groups = building.get_descendant_groups().exclude(id=building.id).order_by('id')
+        self.__add_groups(groups)
+        if rooms is None:
+            rooms = self.rooms_with_occupancy(at_date).filter(group_id__in=self.groups.keys())
+        self.__add_rooms(rooms)
+        self.__sum_groups(building.id)
+
+    @classmethod
+    def for_buildings(cls, buildings, at_date):
+        """Get the snapshots of several buildings, loaded with two queries in total.
+
+        :return: A dict with the snapshot of every building, keyed by building id.
+        """
+        buildings = {building.id: building for building in buildings}
+        if not buildings:
+            return {}
+        groups = {building_id: [] for building_id in buildings}
+        building_of_group = {building_id: building_id for building_id in buildings}
+        in_buildings = reduce(operator.or_, [Q(path__startswith=building.path) for building in buildings.values()])
+        for group in RoomGroup.objects.filter(in_buildings).order_by('id'):
+            building_id = next((group_id for group_id in group.ancestor_ids if group_id in buildings), None)
+            if building_id is not None:
+                groups[building_id].append(group)
+                building_of_group.update({group.id: building_id})
+
+        rooms = {building_id: [] for building_id in buildings}
+        for room in cls.rooms_with_occupancy(at_date).filter(group_id__in=building_of_group.keys()):
+            rooms[building_of_group[room.group_id]].append(room)
+
+        return {building_id: cls(building, at_date, groups[building_id], rooms[building_id])
+                for building_id, building in buildings.items()}
+
+    @staticmethod
+    def rooms_with_occupancy(at_date):
+        """Get all the rooms, ordered by id and annotated with their occupancy_at_date from the OccupancyLedger."""
+        ledger = OccupancyLedger.objects.filter(room=OuterRef('pk'), date__lte=at_date).order_by('-date')
+        return Room.objects.order_by('id').annotate(
+            occupancy_at_date=Coalesce(Subquery(ledger.values('room_count')[:1], output_field=IntegerField()), 0))
+
+    def occupancy_of(self, room_or_group):
+        """Get the occupancy of a room or room group that belongs to the building."""
+        if isinstance(room_or_group, Room):
+            return self.room_occupancy.get(room_or_group.id, 0)
+        return self.group_occupancy.get(room_or_group.id, 0)
+
+    def rooms_of(self, group):
+        """Get the rooms directly inside a group, in the same order as group.room_set.all()."""
+        return self.child_rooms.get(group.id, [])
+
+    def groups_of(self, group):
+        """Get the room groups directly inside a group, in the same order as group.roomgroup_set.all()."""
+        return self.child_groups.get(group.id, [])
+
+    @property
+    def occupancy(self):
+        """The occupancy of the building."""
+        return self.group_occupancy[self.building.id]
+
+    @property
+    def animal_capacity(self):
+        """The total capacity of the rooms of the building."""
+        return sum([room.capacity for rooms in self.child_rooms.values() for room in rooms])
+
+    @property
+    def number_of_rooms(self):
+        return len(self.room_occupancy)
+
+    def __add_groups(self, groups):
+        for group in groups:
+            self.groups.update({group.id: group})
+            self.child_groups.setdefault(group.group_id, []).append(group)
+
+    def __add_rooms(self, rooms):
+        for room in rooms:
+            room.group = self.groups[room.group_id]
+            self.child_rooms.setdefault(room.group_id, []).append(room)
+            self.room_occupancy.update({room.id: room.occupancy_at_date})
+
+    def __sum_groups(self, group_id):
+        total = sum([self.room_occupancy[room.id] for room in self.child_rooms.get(group_id, [])])
+        for child in self.child_groups.get(group_id, []):
+            total += self.__sum_groups(child.id)
+        self.group_occupancy.update({group_id: total})
+        return total
+
+
+class AnimalDaysEngine:
+
+    """Computes animal days for many rooms and periods, from a single load of the OccupancyLedger.
+
+    For every room the ledger gives a step function: the occupancy changes only on the dates with movements. The engine
+    keeps, per room, the sorted change dates, the occupancy after each change and the cumulative animal days up to each
+    change. The animal days of any period are then the difference of two cumulative values, found with a binary search,
+    without going back to the database.
+
+    The animal days of a period count the occupancy of every day from start_date up to, but not including, end_date.
+    """
+
+    def __init__(self, rooms):
+        """Constructor.
+
+        :param rooms: The rooms, or room ids, to load the occupancy for.
+        """
+        room_ids = [self.__room_id(room) for room in rooms]
+        self.ordinals = {room_id: [] for room_id in room_ids}
+        self.counts = {room_id: [] for room_id in room_ids}
+        self.cumulative = {room_id: [] for room_id in room_ids}
+        rows = OccupancyLedger.objects.filter(room_id__in=room_ids).order_by('room_id', 'date')
+        for room_id, change_date, room_count in rows.values_list('room_id', 'date', 'room_count'):
+            self.__add_change(room_id, change_date.toordinal(), room_count)
+
+    def occupancy_at(self, room, at_date):
+        """Get the occupancy of a room at the end of a date."""
+        room_id = self.__room_id(room)
+        index = bisect_right(self.ordinals[room_id], self.__ordinal(at_date)) - 1
+        if index < 0:
+            return 0
+        return self.counts[room_id][index]
+
+    def animal_days(self, room, start_date, end_date):
+        """Get the animal days of a room in the period [start_date, end_date)."""
+        room_id = self.__room_id(room)
+        return self.__animal_days_before(room_id, self.__ordinal(end_date)) - \
+            self.__animal_days_before(room_id, self.__ordinal(start_date))
+
+    def animal_days_for_intervals(self, intervals):
+        """Get the animal days for a list of (room, start_date, end_date) intervals.
+
+        :return: A list with the animal days of each interval, in the same order.
+        """
+        return [self.animal_days(room, start_date, end_date) for room, start_date, end_date in intervals]
+
+    def __add_change(self, room_id, ordinal, count):
+        ordinals = self.ordinals[room_id]
+        if ordinals and ordinals[-1] == ordinal:
+            return  # One ledger row per flock moved on that day, all with the same room count.
+
+        cumulative = 0
+        if ordinals:
+            cumulative = self.cumulative[room_id][-1] + self.counts[room_id][-1] * (ordinal - ordinals[-1])
+        ordinals.append(ordinal)
+        self.counts[room_id].append(count)
+        self.cumulative[room_id].append(cumulative)
+
+    def __animal_days_before(self, room_id, ordinal):
+        """Get the animal days of a room from the first movement until the day before the given date."""
+        ordinals = self.ordinals[room_id]
+        index = bisect_right(ordinals, ordinal - 1) - 1
+        if index < 0:
+            return 0
+        return self.cumulative[room_id][index] + self.counts[room_id][index] * (ordinal - ordinals[index])
+
+    @staticmethod
+    def __ordinal(a_date):
+        if isinstance(a_date, str):
+            a_date = parse_date(a_date)
+        return a_date.toordinal()
+
+    @staticmethod
+    def __room_id(room):
+        if isinstance(room, Room):
+            return room.id
+        return room
+
+
+class FeedAnimalDays:
+
+    """Animal days of all the rooms of a group, counted only while the rooms were fed with a certain feed type.
+
+    The rooms, their occupancy (through an AnimalDaysEngine) and their feeding periods (through the cached
+    FeedingPeriodIndex) are loaded once. Afterwards the animal days of any number of periods are computed in memory,
+    with the same result as RoomGroup.animal_days_for_feed_type.
+    """
+
+    def __init__(self, group, feed_type):
+        """Constructor.
+
+        :param group: The room group, usually a Building.
+        :param feed_type: The feed type.
+        """
+        self.feed_type_id = feed_type.id
+        self.room_ids = list(group.get_all_rooms().values_list('id', flat=True))
+        self.engine = AnimalDaysEngine(self.room_ids)
+        self.feeding_periods = FeedingPeriodIndex.for_rooms(self.room_ids)
+
+    def animal_days(self, start_date, end_date):
+        """Get the animal days fed with the feed type in the period [start_date, end_date)."""
+        if isinstance(start_date, str):
+            start_date = parse_date(start_date)
+        if isinstance(end_date, str):
+            end_date = parse_date(end_date)
+
+        total = 0
+        for room_id in self.room_ids:
+            for period in self.feeding_periods[room_id].periods_for(start_date, end_date, self.feed_type_id):
+                total += self.engine.animal_days(room_id, period[0], period[1])
+        return total
@@ -1,46 +1,86 @@
 from django import template
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+from django.utils.translation import get_language
 from datetime import date
 
+from buildings.models import RoomGroup
+
 register = template.Library()
 
 
 @register.inclusion_tag('buildings/tags/progressbar.html')
-def room_occupancy_bar(room):
+def room_occupancy_bar(room, snapshot=None):
     """Template tag for the progress bar that shows room occupancy.
 
     :param room: The room
+    :param snapshot: Optional OccupancySnapshot to take the occupancy from, instead of querying it for this room.
     :return: A dictionary used in the progressbar template.
     """
+    if snapshot is None:
+        occupancy = room.occupancy
+    else:
+        occupancy = snapshot.occupancy_of(room)
+
     return {'name': room.name,
-            'occupancy': room.occupancy,
+            'occupancy': occupancy,
             'capacity': room.capacity,
-            'overcapacity': room.occupancy - room.capacity}
+            'overcapacity': occupancy - room.capacity}
 
 
-@register.inclusion_tag('buildings/tags/room_group_occupancy.html')
-def room_group_occupancy(group):
+@register.simple_tag
+def room_group_occupancy(group, snapshot=None, at_date=None):
     """Template tag for the table for progress-bars for a room groupd.
 
+    The table is kept in the cache per group, date and language, until a movement, room or group in the group changes.
+    The snapshot is only used when the table is not in the cache, so a lazy snapshot is not loaded when all the tables
+    of a page are.
+
     :param group: The room group.
-    :return: A dict for the room-group used in the template.
+    :param snapshot: Optional OccupancySnapshot of the building, used to get the rooms and their occupancy.
+    :param at_date: The date of the occupancy. Defaults to the date of the snapshot, or today without snapshot.
+    :return: The html of the table.
     """
-    return {'group': group}
+    if at_date is None:
+        at_date = date.today() if snapshot is None else snapshot.at_date
+
+    def render():
+        if snapshot is None:
+            rooms = group.room_set.all()
+        else:
+            rooms = snapshot.rooms_of(group)
+        return render_to_string('buildings/tags/room_group_occupancy.html',
+                                {'group': group, 'rooms': rooms, 'snapshot': snapshot})
+
+    return mark_safe(RoomGroup.occupancy_panel_cache.get(group.id, render, at_date, get_language()))
 
 
 @register.inclusion_tag('buildings/tags/feed_progressbar.html')
-def feed_remains(feed_type, building):
+def feed_remains(feed_type, building, forecast=None):
     """Template tag for the progress bar for feed availability.
 
     :param feed_type: The feed type for which information is desired.
     :param building: The building.
+    :param forecast: Optional FeedStockForecast of the building and feed type. When it is for today, its values are
+    shown instead of computing them.
     :return: A dict used in the template, with the usage/remaining information.
     """
-    remaining = building.get_estimated_remaining_feed(at_date=date.today(), feed_type=feed_type)
-    consumption = building.get_average_feed_consumption(at_date=date.today(), feed_type=feed_type)
+    if forecast is not None and forecast.date == date.today():
+        return {'name': feed_type.name,
+                'capacity': forecast.capacity,
+                'remaining': forecast.remaining,
+                'consumption': forecast.average_consumption,
+                'remaining_after_consumption': forecast.remaining - forecast.average_consumption,
+                'computed_at': forecast.computed_at
+                }
+
+    # Called with the same arguments as the feed end date estimation, so the memoized values are shared.
+    remaining = building.get_estimated_remaining_feed(date.today(), feed_type)
+    consumption = building.get_average_feed_consumption(date.today(), feed_type)
     capacity = building.feed_capacity(feed_type)
     return {'name': feed_type.name,
             'capacity': capacity,
             'remaining': remaining,
             'consumption': consumption,
             'remaining_after_consumption': remaining - consumption
-            }
\ No newline at end of file
+            }
@@ -1,11 +1,21 @@
 from django.test import TestCase
+from django.core.management import call_command
+from django.core.cache import cache
+from django.db import connection
 from datetime import date
+from io import StringIO
 from django.contrib.auth.models import User
 from django.shortcuts import reverse
+from django.utils import timezone
 
-from .models import Flock, Room, RoomGroup, Building, FeedType, SiloFeedEntry, FeedEntry
+from Suinos.memoization import memoization_scope
+from .models import Flock, Room, RoomGroup, Building, FeedType, SiloFeedEntry, FeedEntry, OccupancyLedger
+from .models import FeedStockForecast, OccupancyCheckpoint
 # Create your tests here.
 from .views import BuildingDetailView
+from .occupancy import AnimalDaysEngine, OccupancySnapshot
+from .feeding_periods import FeedingPeriodIndex
+from .templatetags.building_occupancy import feed_remains
 
 
 class RoomTestCase(TestCase):
@@ -119,6 +129,176 @@ class RoomTestCase(TestCase):
         self.room.roomfeedingchange_set.create(feed_type=self.feed_type, date='2017-01-01')
         self.assertEqual(90, self.room.get_animal_days_for_feeding_period('2017-01-01', '2017-01-10', self.feed_type))
 
+    def test_feeding_periods_from_cache(self):
+        self.room.roomfeedingchange_set.create(feed_type=self.feed_type, date='2017-01-01')
+        self.room.roomfeedingchange_set.create(feed_type=self.feed_type2, date='2017-02-01')
+        expected = [[date(2017, 1, 15), date(2017, 2, 1)]]
+        self.assertEqual(expected, self.room.get_feeding_periods('2017-01-15', '2017-04-30', self.feed_type))
+        with self.assertNumQueries(0):
+            self.assertEqual(expected, self.room.get_feeding_periods('2017-01-15', '2017-04-30', self.feed_type))
+
+    def test_feeding_periods_after_changes(self):
+        self.room.roomfeedingchange_set.create(feed_type=self.feed_type, date='2017-01-01')
+        self.assertEqual([[date(2017, 1, 1), date(2017, 4, 30)]],
+                         self.room.get_feeding_periods('2017-01-01', '2017-04-30', self.feed_type))
+        change = self.room.roomfeedingchange_set.create(feed_type=self.feed_type2, date='2017-02-01')
+        self.assertEqual([[date(2017, 1, 1), date(2017, 2, 1)]],
+                         self.room.get_feeding_periods('2017-01-01', '2017-04-30', self.feed_type))
+        change.delete()
+        self.assertEqual([[date(2017, 1, 1), date(2017, 4, 30)]],
+                         self.room.get_feeding_periods('2017-01-01', '2017-04-30', self.feed_type))
+
+    def test_feeding_periods_for_rooms(self):
+        other_room = Room.objects.create(name='Other', capacity=10, group=self.room.group)
+        self.room.roomfeedingchange_set.create(feed_type=self.feed_type, date='2017-01-01')
+        other_room.roomfeedingchange_set.create(feed_type=self.feed_type2, date='2017-01-05')
+        self.room.get_feeding_periods('2017-01-01', '2017-04-30', self.feed_type)  # Cached for this room.
+        with self.assertNumQueries(1):
+            indexes = FeedingPeriodIndex.for_rooms([self.room.id, other_room.id])
+        self.assertEqual(self.feed_type.id, indexes[self.room.id].feed_type_id_at(date(2017, 1, 2)))
+        self.assertEqual(self.feed_type2.id, indexes[other_room.id].feed_type_id_at(date(2017, 1, 5)))
+        with self.assertNumQueries(0):
+            FeedingPeriodIndex.for_rooms([self.room.id, other_room.id])
+
+    def test_feeding_periods_before_first_change(self):
+        self.room.roomfeedingchange_set.create(feed_type=self.feed_type, date='2017-01-10')
+        self.assertEqual([], self.room.get_feeding_periods('2017-01-01', '2017-04-30', self.feed_type))
+
+
+class OccupancyLedgerTestCase(TestCase):
+
+    def setUp(self):
+        self.flock1 = Flock(entry_date='2017-01-01', entry_weight=220, number_of_animals=10)
+        self.flock1.save()
+        self.flock2 = Flock(entry_date='2017-01-02', entry_weight=220, number_of_animals=5)
+        self.flock2.save()
+        self.building = Building(name='TheBigBuilding')
+        self.building.save()
+        self.room1 = Room(name='Room1', capacity=20, group=self.building)
+        self.room1.save()
+        self.room2 = Room(name='Room2', capacity=20, group=self.building)
+        self.room2.save()
+        self.entry1 = self.room1.animalroomentry_set.create(number_of_animals=10, flock=self.flock1, date='2017-01-01')
+        self.entry2 = self.room1.animalroomentry_set.create(number_of_animals=5, flock=self.flock2, date='2017-01-02')
+        self.exit1 = self.room1.animalroomexit_set.create(number_of_animals=2, flock=self.flock1, date='2017-01-05')
+
+    def test_ledger_rows(self):
+        rows = OccupancyLedger.objects.filter(room=self.room1).order_by('date')
+        self.assertEqual([(date(2017, 1, 1), 10, 10), (date(2017, 1, 2), 5, 15), (date(2017, 1, 5), 8, 13)],
+                         [(row.date, row.flock_count, row.room_count) for row in rows])
+
+    def test_flocks_present(self):
+        self.assertEqual({self.flock1: 10}, self.room1.get_flocks_present_at('2017-01-01'))
+        self.assertEqual({self.flock1: 8, self.flock2: 5}, self.room1.get_flocks_present_at('2017-01-05'))
+        self.assertEqual(8, self.room1.get_animals_for_flock(self.flock1.id, '2017-01-05'))
+        self.assertEqual(5, self.room1.get_animals_for_flock(self.flock2.id, '2017-01-05'))
+
+    def test_checkpoints(self):
+        checkpoints = OccupancyCheckpoint.objects.create_due(interval=3, until='2017-01-08')
+        self.assertEqual([date(2017, 1, 1), date(2017, 1, 4), date(2017, 1, 7)], [obj.date for obj in checkpoints])
+        self.assertEqual([], OccupancyCheckpoint.objects.create_due(interval=3, until='2017-01-09'))
+        self.assertEqual({(self.room1.id, self.flock1.id): 10, (self.room1.id, self.flock2.id): 5},
+                         OccupancyCheckpoint.objects.flock_counts_at('2017-01-04'))
+
+        with self.assertNumQueries(4):
+            # Last checkpoint, its entries, the ledger rows after it, and the flocks.
+            self.assertEqual({self.flock1: 8, self.flock2: 5}, self.room1.get_flocks_present_at('2017-01-05'))
+        self.assertEqual({self.flock1: 8, self.flock2: 5}, self.room1.get_flocks_present_at('2017-01-08'))
+        self.assertEqual({}, self.room2.get_flocks_present_at('2017-01-08'))
+
+    def test_checkpoints_invalidated_by_movements(self):
+        OccupancyCheckpoint.objects.create_due(interval=3, until='2017-01-08')
+        self.room1.animalroomexit_set.create(number_of_animals=5, flock=self.flock2, date='2017-01-03')
+        self.assertEqual([date(2017, 1, 1)], [obj.date for obj in OccupancyCheckpoint.objects.all()])
+        self.assertEqual({self.flock1: 8}, self.room1.get_flocks_present_at('2017-01-08'))
+
+        OccupancyCheckpoint.objects.create_due(interval=3, until='2017-01-08')
+        self.assertEqual({(self.room1.id, self.flock1.id): 8},
+                         OccupancyCheckpoint.objects.flock_counts_at('2017-01-07'))
+
+    def test_update_entry_date(self):
+        self.entry1.date = '2017-01-03'
+        self.entry1.save()
+        self.assertEqual(0, self.room1.get_occupancy_at_date('2017-01-01'))
+        self.assertEqual(5, self.room1.get_occupancy_at_date('2017-01-02'))
+        self.assertEqual(15, self.room1.get_occupancy_at_date('2017-01-03'))
+        self.assertEqual(13, self.room1.get_occupancy_at_date('2017-01-05'))
+
+    def test_move_entry_to_other_room(self):
+        entry = self.room1.animalroomentry_set.get(id=self.entry2.id)
+        entry.room = self.room2
+        entry.save()
+        self.assertEqual(8, self.room1.get_occupancy_at_date('2017-01-05'))
+        self.assertEqual(5, self.room2.get_occupancy_at_date('2017-01-05'))
+
+    def test_delete_exit(self):
+        self.exit1.delete()
+        self.assertEqual(15, self.room1.get_occupancy_at_date('2017-01-05'))
+
+    def test_delete_flock(self):
+        self.flock2.delete()
+        self.assertEqual(8, self.room1.get_occupancy_at_date('2017-01-05'))
+        self.assertEqual({self.flock1: 8}, self.room1.get_flocks_present_at('2017-01-05'))
+
+    def test_occupancy_cached_until_movement(self):
+        self.assertEqual(13, self.room1.get_occupancy_at_date('2017-01-05'))
+        with self.assertNumQueries(0):
+            self.assertEqual(13, Room(id=self.room1.id).get_occupancy_at_date('2017-01-05'))
+        self.room1.animalroomexit_set.create(number_of_animals=3, flock=self.flock2, date='2017-01-04')
+        self.assertEqual(10, self.room1.get_occupancy_at_date('2017-01-05'))
+
+    def test_rebuild(self):
+        OccupancyLedger.objects.filter(room=self.room1).delete()
+        OccupancyLedger.objects.rebuild(self.room1.id)
+        self.assertEqual(15, self.room1.get_occupancy_at_date('2017-01-02'))
+        self.assertEqual(13, self.room1.get_occupancy_at_date('2017-01-05'))
+
+
+class AnimalDaysEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.flock = Flock(entry_date='2017-01-01', entry_weight=220, number_of_animals=20)
+        self.flock.save()
+        self.building = Building(name='TheBigBuilding')
+        self.building.save()
+        self.room1 = Room(name='Room1', capacity=10, group=self.building)
+        self.room1.save()
+        self.room2 = Room(name='Room2', capacity=10, group=self.building)
+        self.room2.save()
+        self.room3 = Room(name='Room3', capacity=10, group=self.building)
+        self.room3.save()
+        self.room1.animalroomentry_set.create(number_of_animals=10, flock=self.flock, date='2017-01-01')
+        self.room1.animalroomexit_set.create(number_of_animals=1, flock=self.flock, date='2017-01-03')
+        self.room1.animalroomexit_set.create(number_of_animals=1, flock=self.flock, date='2017-01-05')
+        self.room2.animalroomentry_set.create(number_of_animals=10, flock=self.flock, date='2017-01-02')
+        self.room2.animalroomexit_set.create(number_of_animals=10, flock=self.flock, date='2017-01-04')
+
+    def test_single_load(self):
+        with self.assertNumQueries(1):
+            engine = AnimalDaysEngine([self.room1, self.room2, self.room3])
+        with self.assertNumQueries(0):
+            self.assertEqual(54, engine.animal_days(self.room1, date(2016, 12, 1), date(2017, 1, 7)))
+            self.assertEqual(20, engine.animal_days(self.room2, date(2016, 12, 1), date(2017, 1, 7)))
+            self.assertEqual(0, engine.animal_days(self.room3, date(2016, 12, 1), date(2017, 1, 7)))
+
+    def test_matches_occupancy_transitions(self):
+        engine = AnimalDaysEngine([self.room1, self.room2])
+        intervals = [(room, date(2017, 1, start), date(2017, 1, end))
+                     for room in [self.room1, self.room2] for start in range(1, 8) for end in range(start, 9)]
+        expected = []
+        for room, start_date, end_date in intervals:
+            changes = room.get_occupancy_transitions(start_date, end_date)
+            dates = sorted(changes.keys())
+            expected.append(sum([changes[first] * (second - first).days for first, second in zip(dates, dates[1:])]))
+
+        self.assertEqual(expected, engine.animal_days_for_intervals(intervals))
+
+    def test_occupancy_at(self):
+        engine = AnimalDaysEngine([self.room1.id])
+        self.assertEqual(0, engine.occupancy_at(self.room1.id, '2016-12-31'))
+        self.assertEqual(10, engine.occupancy_at(self.room1.id, '2017-01-02'))
+        self.assertEqual(8, engine.occupancy_at(self.room1.id, '2017-02-01'))
+
 
 class BuildingFeedingTestCase(TestCase):
     def setUp(self):
@@ -189,10 +369,32 @@ class BuildingFeedingTestCase(TestCase):
         self.assertEqual(300, self.building.animal_days_for_feed_type('2017-01-01', '2017-01-11', self.feed_type1))
         self.assertEqual(0, self.building.animal_days_for_feed_type('2017-01-01', '2017-01-11', self.feed_type2))
 
+    def test_average_feed_consumption_skips_deliveries_without_animals(self):
+        # Nothing was fed with feed type 2 between the first two deliveries, only from the second one on.
+        feed_entry = FeedEntry.objects.create(date='2017-01-10', weight=5000, feed_type=self.feed_type2)
+        SiloFeedEntry.objects.create(silo=self.silo2, feed_entry=feed_entry)
+        self.room4.roomfeedingchange_set.create(feed_type=self.feed_type2, date='2017-01-10')
+        self.room4.animalroomentry_set.create(number_of_animals=10, date='2017-01-10', flock=self.flock)
+        feed_entry = FeedEntry.objects.create(date='2017-01-20', weight=5000, feed_type=self.feed_type2)
+        SiloFeedEntry.objects.create(silo=self.silo2, feed_entry=feed_entry, remaining=4000)
+
+        self.assertEqual(0, Building.objects.get(id=self.building.id).get_average_feed_consumption('2017-01-15',
+                                                                                                   self.feed_type2))
+        # 1000 kg over 100 animal days, the interval without animals does not count.
+        self.assertEqual(10, Building.objects.get(id=self.building.id).get_average_feed_consumption('2017-01-21',
+                                                                                                    self.feed_type2))
+
     def test_feed_consumption_single_day(self):
         self.assertEqual(30, self.building.animal_days_for_feed_type('2017-01-05', '2017-01-06', self.feed_type1))
         self.assertEqual(0, self.building.animal_days_for_feed_type('2017-01-05', '2017-01-06', self.feed_type2))
 
+    def test_delivery_timeline(self):
+        with self.assertNumQueries(1):
+            timeline = list(self.building.get_delivery_timeline(self.feed_type1))
+            self.assertEqual([date(2017, 1, 1), date(2017, 1, 15)], [entry.date for entry in timeline])
+            self.assertEqual([10000, 10000], [entry.weight for entry in timeline])
+        self.assertEqual([], list(self.building.get_delivery_timeline(self.feed_type1, end_date='2016-12-31')))
+
     def test_last_feed_entries(self):
         actual = self.building.get_last_feed_entries('2017-01-17', self.feed_type1)
         expected = self.silo1_feed_entries[1]
@@ -206,6 +408,15 @@ class BuildingFeedingTestCase(TestCase):
         expected = 20000
         self.assertEqual(expected, actual)
 
+    def test_feed_estimation_cached_until_feed_entry(self):
+        self.assertEqual(20000, self.building.get_estimated_remaining_feed('2017-01-21', self.feed_type2))
+        with self.assertNumQueries(0):
+            self.assertEqual(20000, self.building.get_estimated_remaining_feed('2017-01-21', self.feed_type2))
+
+        feed_entry = FeedEntry.objects.create(date='2017-01-20', weight=5000, feed_type=self.feed_type2)
+        SiloFeedEntry.objects.create(silo=self.silo2, feed_entry=feed_entry)
+        self.assertEqual(5000, self.building.get_estimated_remaining_feed('2017-01-21', self.feed_type2))
+
     def test_feed_etimation_without_consumption(self):
         actual = self.building.get_estimated_remaining_feed('2017-01-21', self.feed_type2)
         expected = 20000
@@ -216,6 +427,75 @@ class BuildingFeedingTestCase(TestCase):
         expected = date(2017, 1, 28)
         self.assertEqual(expected, actual)
 
+    def test_feed_estimation_computed_once(self):
+        with memoization_scope():
+            self.building.get_estimated_feed_end_date('2017-01-21', self.feed_type1)
+            other_instance = Building.objects.get(id=self.building.id)
+            with self.assertNumQueries(0):
+                # The remaining feed comes from the cache, consumption and animal days are memoized in the scope.
+                self.assertEqual(date(2017, 1, 28), other_instance.get_estimated_feed_end_date('2017-01-21',
+                                                                                               self.feed_type1))
+            with self.assertNumQueries(0):
+                self.assertEqual(10000 / 420, other_instance.get_average_feed_consumption(date(2017, 1, 21),
+                                                                                          self.feed_type1))
+
+    def test_feed_animal_days(self):
+        animal_days = self.building.get_feed_animal_days(self.feed_type1)
+        for start, end in [('2017-01-01', '2017-01-11'), ('2017-01-05', '2017-01-06'), ('2016-12-01', '2017-02-01')]:
+            self.assertEqual(self.building.animal_days_for_feed_type(start, end, self.feed_type1),
+                             animal_days.animal_days(start, end))
+
+    def test_feed_stock_forecast(self):
+        FeedStockForecast.objects.refresh('2017-01-21')
+        forecasts = FeedStockForecast.objects.for_building(self.building, date(2017, 1, 21))
+        self.assertEqual({self.feed_type1.id, self.feed_type2.id}, set(forecasts.keys()))
+
+        forecast = forecasts[self.feed_type1.id]
+        self.assertEqual(10000, forecast.capacity)
+        self.assertEqual(self.building.get_estimated_remaining_feed('2017-01-21', self.feed_type1), forecast.remaining)
+        self.assertEqual(10000 / 420, forecast.average_consumption)
+        self.assertEqual(10000 / 420 * 30, forecast.daily_consumption)
+        self.assertEqual(date(2017, 1, 28), forecast.estimated_end_date)
+        self.assertIsNone(forecasts[self.feed_type2.id].estimated_end_date)
+
+        totals = FeedStockForecast.objects.farm_totals(date(2017, 1, 21))
+        self.assertEqual(forecast.remaining, totals[self.feed_type1.id]['remaining'])
+        self.assertEqual({}, FeedStockForecast.objects.for_building(self.building, date(2017, 1, 22)))
+
+    def test_feed_stock_forecast_refresh_keeps_other_dates(self):
+        FeedStockForecast.objects.refresh('2017-01-21')
+        FeedStockForecast.objects.refresh('2017-01-22')
+        FeedStockForecast.objects.refresh('2017-01-22')
+        self.assertEqual(2, len(FeedStockForecast.objects.for_building(self.building, date(2017, 1, 21))))
+        self.assertEqual(2, len(FeedStockForecast.objects.for_building(self.building, date(2017, 1, 22))))
+        self.assertEqual(4, FeedStockForecast.objects.count())
+
+    def test_explain_queries_command(self):
+        out = StringIO()
+        call_command('explain_queries', repeat=1, stdout=out)
+        plans = out.getvalue()
+        self.assertIn('Room entries until today', plans)
+        self.assertIn('Active treatments of a flock', plans)
+        if connection.vendor == 'sqlite':
+            self.assertIn('buildings_a_room_id_ff6729_idx', plans)
+
+    def test_feed_stock_forecast_command(self):
+        out = StringIO()
+        call_command('update_feed_forecasts', date='2017-01-21', stdout=out)
+        self.assertIn('Stored 2 feed stock forecasts.', out.getvalue())
+        call_command('update_feed_forecasts', date='2017-01-21', stdout=out)
+        self.assertEqual(2, FeedStockForecast.objects.count())
+
+    def test_feed_remains_from_forecast(self):
+        forecast = FeedStockForecast(building=self.building, feed_type=self.feed_type1, date=date.today(),
+                                     computed_at=timezone.now(), capacity=10000, remaining=4000,
+                                     average_consumption=20, daily_consumption=600, estimated_end_date=None)
+        with self.assertNumQueries(0):
+            context = feed_remains(self.feed_type1, self.building, forecast)
+        self.assertEqual(4000, context['remaining'])
+        self.assertEqual(3980, context['remaining_after_consumption'])
+        self.assertEqual(forecast.computed_at, context['computed_at'])
+
     def test_feed_end_date_estimation_without_consumption(self):
         actual = self.building.get_estimated_feed_end_date('2017-01-21', self.feed_type2)
         self.assertIsNone(actual)
@@ -278,6 +558,73 @@ class BuildingLayoutInformation(TestCase):
     def test_occupancy(self):
         self.assertEqual(10, self.building.occupancy)
 
+    def test_paths(self):
+        sub_group = RoomGroup(group=self.room_group, name='SubGroup')
+        sub_group.save()
+        self.assertEqual('/%d/' % self.building.id, self.building.path)
+        self.assertEqual('/%d/%d/%d/' % (self.building.id, self.room_group.id, sub_group.id), sub_group.path)
+        self.assertEqual([self.building.id, self.room_group.id], sub_group.ancestor_ids)
+
+    def test_move_group_updates_sub_groups(self):
+        sub_group = RoomGroup(group=self.room_group, name='SubGroup')
+        sub_group.save()
+        other_building = Building(name='OtherBuilding')
+        other_building.save()
+        self.room_group.group = other_building
+        self.room_group.save()
+        sub_group.refresh_from_db()
+        self.assertEqual('/%d/%d/%d/' % (other_building.id, self.room_group.id, sub_group.id), sub_group.path)
+        self.assertEqual(2, self.building.number_of_rooms)
+        self.assertEqual(1, other_building.number_of_rooms)
+
+    def test_nested_rooms_in_single_query(self):
+        sub_group = RoomGroup(group=self.room_group, name='SubGroup')
+        sub_group.save()
+        Room(group=sub_group, name='Room 4', capacity=5).save()
+        with self.assertNumQueries(1):
+            self.assertEqual(4, self.building.number_of_rooms)
+        with self.assertNumQueries(1):
+            self.assertEqual(35, self.building.animal_capacity)
+
+    def test_occupancy_snapshot(self):
+        self.room3.animalroomentry_set.create(number_of_animals=5, date='2017-01-02', flock=self.flock)
+        with self.assertNumQueries(2):
+            snapshot = self.building.occupancy_snapshot('2017-01-02')
+        with self.assertNumQueries(0):
+            self.assertEqual(15, snapshot.occupancy_of(self.building))
+            self.assertEqual(5, snapshot.occupancy_of(self.room_group))
+            self.assertEqual(10, snapshot.occupancy_of(self.room1))
+            self.assertEqual(0, snapshot.occupancy_of(self.room2))
+            self.assertEqual([self.room1, self.room2], snapshot.rooms_of(self.building))
+            self.assertEqual([self.room_group], snapshot.groups_of(self.building))
+
+    def test_occupancy_snapshots_for_buildings(self):
+        other_building = Building(name='OtherBuilding')
+        other_building.save()
+        other_room = Room.objects.create(group=other_building, name='Room 4', capacity=20)
+        other_room.animalroomentry_set.create(number_of_animals=15, date='2017-01-01', flock=self.flock)
+        with self.assertNumQueries(2):
+            snapshots = OccupancySnapshot.for_buildings([self.building, other_building], date(2017, 1, 2))
+        with self.assertNumQueries(0):
+            self.assertEqual(10, snapshots[self.building.id].occupancy)
+            self.assertEqual(30, snapshots[self.building.id].animal_capacity)
+            self.assertEqual(3, snapshots[self.building.id].number_of_rooms)
+            self.assertEqual([self.room_group], snapshots[self.building.id].groups_of(self.building))
+            self.assertEqual(15, snapshots[other_building.id].occupancy)
+            self.assertEqual([other_room], snapshots[other_building.id].rooms_of(other_building))
+
+        with self.assertNumQueries(2):
+            snapshots = OccupancySnapshot.for_buildings([other_building], date(2017, 1, 2))
+        self.assertEqual([other_building.id], list(snapshots))
+        self.assertEqual(15, snapshots[other_building.id].occupancy)
+        with self.assertNumQueries(0):
+            self.assertEqual({}, OccupancySnapshot.for_buildings([], date(2017, 1, 2)))
+
+    def test_occupancy_snapshot_before_entries(self):
+        snapshot = self.building.occupancy_snapshot('2016-12-31')
+        self.assertEqual(0, snapshot.occupancy_of(self.building))
+        self.assertEqual(0, snapshot.occupancy_of(self.room1))
+
 
 class BuildingDetailViewTest(TestCase):
     def setUp(self):
@@ -340,4 +687,43 @@ class BuildingDetailViewTest(TestCase):
     def test_request(self):
         self.setupRequest()
         response = self.client.get(reverse('buildings:index'))
-        self.assertEquals(302, response.status_code)
\ No newline at end of file
+        self.assertEquals(302, response.status_code)
+
+    def test_request_detail(self):
+        self.setupRequest()
+        response = self.client.get(reverse('buildings:building_detail', kwargs={'building_id': self.building.id}))
+        self.assertEquals(200, response.status_code)
+        self.assertEqual([self.room_group], response.context['room_groups'])
+        self.assertEqual(10, response.context['occupancy_snapshot'].occupancy_of(self.room_group))
+
+    def test_occupancy_panels_cached(self):
+        self.setupRequest()
+        url = reverse('buildings:building_detail', kwargs={'building_id': self.building.id})
+        cache.clear()
+        with self.assertNumQueries(19):
+            self.assertContains(self.client.get(url), 'Room 3 - 10/10')
+        # The panels come from the cache, without the occupancy of the rooms.
+        with self.assertNumQueries(14):
+            self.assertContains(self.client.get(url), 'Room 3 - 10/10')
+
+        # A movement in a room of the group only renders the panels of the group and the groups above it again.
+        self.room3.animalroomexit_set.create(number_of_animals=4, flock=self.flock, date='2017-02-01')
+        response = self.client.get(url)
+        self.assertContains(response, 'Room 3 - 6/10')
+        self.assertContains(response, 'Room 1 - 10/10')
+
+    def test_occupancy_panels_invalidated_by_room_changes(self):
+        self.setupRequest()
+        url = reverse('buildings:building_detail', kwargs={'building_id': self.building.id})
+        self.client.get(url)
+
+        self.room3.name = 'Big 3'
+        self.room3.save()
+        self.assertContains(self.client.get(url), 'Big 3 - 10/10')
+
+        self.room2.group = self.room_group
+        self.room2.save()
+        response = self.client.get(url)
+        self.assertEqual(['Room 1'], [room.name for room in response.context['occupancy_snapshot'].rooms_of(
+            self.building)])
+        self.assertContains(response, 'Room 2 - 10/10', count=1)
@@ -1,12 +1,24 @@
+from datetime import date
+
 from django.shortcuts import render, get_object_or_404, HttpResponseRedirect, reverse
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import TemplateView
-from .models import Building, Room, FeedType
+from .models import Building, Room, FeedType, FeedStockForecast
+from .occupancy import OccupancySnapshot
 
 
 def index(request):
-    buildings = Building.objects.all()
+    buildings = list(Building.objects.all())
     if len(buildings) == 1:
         return HttpResponseRedirect(reverse('buildings:building_detail', kwargs={'building_id': buildings[0].id}))
+
+    snapshots = OccupancySnapshot.for_buildings(buildings, date.today())
+    for building in buildings:
+        building.snapshot = snapshots[building.id]
+        building.ungrouped_rooms = building.snapshot.rooms_of(building)
+        building.room_groups = building.snapshot.groups_of(building)
+        for room_group in building.room_groups:
+            room_group.rooms = building.snapshot.rooms_of(room_group)
     return render(request, 'buildings/index.html', {'buildings': buildings})
 
 
@@ -34,7 +46,14 @@ class BuildingDetailView(TemplateView):
         """
         context_data = super().get_context_data(**kwargs)
         building = get_object_or_404(Building, id=self.kwargs['building_id'])
-        feed_types = FeedType.objects.all()
+        feed_types = list(FeedType.objects.all())
+        forecasts = FeedStockForecast.objects.for_building(building)
+        for feed_type in feed_types:
+            feed_type.forecast = forecasts.get(feed_type.id)
+        # The occupancy panels are cached, the snapshot is only loaded when one of them has to be rendered.
+        occupancy_snapshot = SimpleLazyObject(building.occupancy_snapshot)
         context_data.update({'building': building, 'feed_types': feed_types})
+        context_data.update({'occupancy_snapshot': occupancy_snapshot, 'occupancy_date': date.today(),
+                             'room_groups': list(building.roomgroup_set.order_by('id'))})
         return context_data
 
@@ -0,0 +1,290 @@
+import json
+import statistics
+import time
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.shortcuts import reverse
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from buildings.models import Building, Room, OccupancyLedger
+from feeding.models import FeedType
+from flocks.models import Flock
+from medications.models import Medication
+
+
+class BenchmarkSuite:
+
+    """Benchmarks of the hot paths of the application: the dashboard, building and flock pages, the occupancy and feed
+    estimations, and every step of the farm wizards.
+
+    Every benchmark is run a number of times, measuring the wall time and the number of queries of each run. The first
+    run is reported separately, as it also fills the caches. The whole suite runs inside a transaction that is rolled
+    back at the end, so the wizards can be submitted without changing the data that is benchmarked. It uses its own
+    local memory cache, emptied before and after the suite and after every rolled back wizard run, so the values
+    computed from rolled back data are never used, and the configured cache is left untouched.
+
+    The results are plain dicts, that can be written as JSON and compared with the results of another commit.
+    """
+
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'benchmark'}}
+
+    def __init__(self, repeat=5, at_date=None):
+        """Constructor.
+
+        :param repeat: Number of runs of every benchmark.
+        :param at_date: Date used for the estimations and the wizards, today by default.
+        """
+        self.repeat = repeat
+        self.at_date = at_date or date.today()
+        self.results = []
+        self.client = Client()
+
+    def run(self):
+        """Run all the benchmarks.
+
+        :return: A dict with information about the run and the dataset, and the list of results.
+        """
+        self.results = []
+        with override_settings(ALLOWED_HOSTS=['testserver'], CACHES=self.caches):
+            cache.clear()
+            try:
+                with transaction.atomic():
+                    self.client.force_login(User.objects.create_user(username='benchmark-%d' % time.time()))
+                    self.benchmark_views()
+                    self.benchmark_models()
+                    self.benchmark_wizards()
+                    transaction.set_rollback(True)
+            finally:
+                cache.clear()
+
+        return {
+            'created_at': timezone.now().isoformat(),
+            'at_date': self.at_date.isoformat(),
+            'repeat': self.repeat,
+            'database': connection.vendor,
+            'dataset': {
+                'buildings': Building.objects.count(),
+                'rooms': Room.objects.count(),
+                'flocks': Flock.objects.count(),
+                'ledger_rows': OccupancyLedger.objects.count(),
+            },
+            'results': self.results,
+        }
+
+    def benchmark_views(self):
+        self.measure('view.farm_index', self.get_page(reverse('farm:index')))
+        building = Building.objects.order_by('id').first()
+        if building is not None:
+            url = reverse('buildings:building_detail', kwargs={'building_id': building.id})
+            self.measure('view.building_detail', self.get_page(url))
+        flock = Flock.objects.with_animal_counts().present().order_by('id').first() or Flock.objects.last()
+        if flock is not None:
+            self.measure('view.flock_detail', self.get_page(reverse('flocks:detail', kwargs={'flock_id': flock.id})))
+
+    def benchmark_models(self):
+        room = Room.objects.filter(is_separation=False).order_by('id').first()
+        if room is not None:
+            start_date = self.at_date - timedelta(days=365)
+            self.measure('model.room_animal_days_for_period',
+                         lambda: room.get_animal_days_for_period(start_date, self.at_date))
+
+        building = Building.objects.order_by('id').first()
+        feed_type = FeedType.objects.order_by('id').first()
+        if building is not None and feed_type is not None:
+            def estimated_feed_end_date():
+                # A new instance on every run, so the memoized values of the building are not reused.
+                Building.objects.get(id=building.id).get_estimated_feed_end_date(self.at_date, feed_type)
+            self.measure('model.building_estimated_feed_end_date', estimated_feed_end_date)
+
+    def benchmark_wizards(self):
+        occupied_room = self.__occupied_room()
+        empty_room = self.__empty_room()
+        medication = Medication.objects.order_by('id').first()
+        at_date = self.at_date.isoformat()
+
+        if empty_room is not None:
+            self.measure_flow('wizard.new_animal_entry', reverse('farm:new_animal_entry'),
+                              'register_new_animal_entry', [
+                                  ('flock_information', {'date': at_date, 'weight': '200', 'number_of_animals': '10',
+                                                         'rooms': [empty_room.id]}),
+                                  ('building_information', self.formset_data(
+                                      [{'room': empty_room.id, 'number_of_animals': '10'}])),
+                              ])
+
+        if occupied_room is None:
+            return
+
+        self.measure_flow('wizard.animal_death', reverse('farm:animal_death'), 'register_new_animal_death', [
+            ('death_information', {'date': at_date, 'room': occupied_room.id, 'weight': '50', 'reason': 'Benchmark'}),
+            ('overview', {}),
+        ])
+        self.measure_flow('wizard.animal_exit', reverse('farm:animal_exit'), 'register_new_animal_exit', [
+            ('general_information', {'date': at_date, 'weight': '110', 'number_of_animals': '1',
+                                     'rooms': [occupied_room.id]}),
+            ('building_information', self.formset_data([{'room': occupied_room.id, 'number_of_animals': '1'}])),
+            ('overview', {}),
+        ])
+        if empty_room is not None:
+            self.measure_flow('wizard.transfer', reverse('farm:new_transfer'), 'register_animal_transfer_wizard', [
+                ('generic', {'date': at_date, 'number_of_animals': '1', 'rooms': [occupied_room.id]}),
+                ('detailed', self.formset_data([{'room': occupied_room.id, 'number_of_animals': '1'}])),
+                ('destination', {'room': empty_room.id}),
+            ])
+        if medication is not None:
+            self.measure_flow('wizard.new_treatment', reverse('farm:new_treatment'), 'start_new_treatment', [
+                ('room_symptoms_information', {'date': at_date, 'room': occupied_room.id, 'symptoms': 'Benchmark'}),
+                ('medication_choice_information', {'medication': medication.id, 'override': ''}),
+                ('dosage_information', {'dosage': '10.0', 'confirm_application': 'True', 'separate': '',
+                                        'destination_room': ''}),
+                ('overview', {}),
+            ])
+
+    def measure(self, name, function):
+        """Run a function self.repeat times, and store its wall times and query counts."""
+        timings = []
+        queries = []
+        for i in range(self.repeat):
+            elapsed, number_of_queries, result = self.__measure_once(function)
+            timings.append(elapsed)
+            queries.append(number_of_queries)
+        self.results.append(self.__result(name, timings, queries))
+
+    def measure_flow(self, name, url, prefix, steps):
+        """Run a wizard self.repeat times, and store the wall times and query counts of every step.
+
+        The first step is the GET of the wizard, the others post the data of one step. A run is only valid when every
+        step moves the wizard forward, and the last step redirects; otherwise the results are marked as failed. Every
+        run is rolled back and the cache is emptied after it, so all the runs start from the same data and an empty
+        cache.
+
+        :param name: Name of the wizard, used as prefix for the names of the results.
+        :param url: The url of the wizard.
+        :param prefix: The prefix of the wizard, used in the name of its current_step field.
+        :param steps: List of (step name, form data) tuples.
+        """
+        names = ['get'] + [step for step, data in steps]
+        timings = {step: [] for step in names}
+        queries = {step: [] for step in names}
+        failed = set()
+        for i in range(self.repeat):
+            requests = [('get', lambda: self.client.get(url), 200)]
+            for number, (step, data) in enumerate(steps):
+                expected = 302 if number == len(steps) - 1 else 200
+                requests.append((step, self.post_step(url, prefix, step, data), expected))
+
+            with transaction.atomic():
+                for step, function, expected_status in requests:
+                    elapsed, number_of_queries, response = self.__measure_once(function)
+                    timings[step].append(elapsed)
+                    queries[step].append(number_of_queries)
+                    if response.status_code != expected_status or self.__has_form_errors(response):
+                        failed.add(step)
+                transaction.set_rollback(True)
+            cache.clear()
+
+        for step in names:
+            result = self.__result('%s.%s' % (name, step), timings[step], queries[step])
+            result.update({'ok': step not in failed})
+            self.results.append(result)
+
+    def get_page(self, url):
+        """Get a function that requests a page, and fails if it is not rendered."""
+        def get():
+            response = self.client.get(url)
+            if response.status_code != 200:
+                raise AssertionError('%s returned status %d' % (url, response.status_code))
+            return response
+        return get
+
+    def post_step(self, url, prefix, step, data):
+        """Get a function that posts the data of one wizard step."""
+        post_data = {'%s-current_step' % prefix: step}
+        post_data.update({'%s-%s' % (step, key): value for key, value in data.items()})
+        return lambda: self.client.post(url, post_data)
+
+    @staticmethod
+    def formset_data(forms):
+        """Get the data of a formset, without prefix, with the given list of form data dicts."""
+        data = {'TOTAL_FORMS': len(forms), 'INITIAL_FORMS': len(forms), 'MIN_NUM_FORMS': 0, 'MAX_NUM_FORMS': 1000}
+        for number, form in enumerate(forms):
+            data.update({'%d-%s' % (number, key): value for key, value in form.items()})
+        return data
+
+    def __occupied_room(self):
+        """Get a normal room, with animals of only one flock, from which the wizards can take one animal."""
+        for room in Room.objects.filter(is_separation=False).order_by('id'):
+            flocks = room.get_flocks_present_at(self.at_date)
+            if len(flocks) == 1 and next(iter(flocks.values())) > self.repeat * 3:
+                return room
+        return None
+
+    def __empty_room(self):
+        for room in Room.objects.filter(is_separation=False).order_by('id'):
+            if room.get_occupancy_at_date(self.at_date) == 0:
+                return room
+        return None
+
+    @staticmethod
+    def __measure_once(function):
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            result = function()
+            elapsed = time.perf_counter() - start
+        return elapsed * 1000, len(context.captured_queries), result
+
+    @staticmethod
+    def __has_form_errors(response):
+        if response.context is None or 'form' not in response.context:
+            return False
+        form = response.context['form']
+        if hasattr(form, 'non_form_errors') and form.non_form_errors():
+            return True
+        return any(form.errors)
+
+    @staticmethod
+    def __result(name, timings, queries):
+        return {
+            'name': name,
+            'runs': len(timings),
+            'wall_time_ms': {
+                'first': round(timings[0], 3),
+                'min': round(min(timings), 3),
+                'median': round(statistics.median(timings), 3),
+                'max': round(max(timings), 3),
+            },
+            'queries': {
+                'first': queries[0],
+                'min': min(queries),
+                'max': max(queries),
+            },
+        }
+
+
+def compare_results(old, new):
+    """Compare the results of two benchmark runs.
+
+    :param old: The results of the reference run, as returned by BenchmarkSuite.run.
+    :param new: The results of the new run.
+    :return: A list of (name, old median ms, new median ms, old max queries, new max queries) tuples, for the
+    benchmarks in the new run. The old values are None for new benchmarks.
+    """
+    old_results = {result['name']: result for result in old['results']}
+    comparison = []
+    for result in new['results']:
+        old_result = old_results.get(result['name'])
+        comparison.append((result['name'],
+                           old_result['wall_time_ms']['median'] if old_result else None,
+                           result['wall_time_ms']['median'],
+                           old_result['queries']['max'] if old_result else None,
+                           result['queries']['max']))
+    return comparison
+
+
+def load_results(path):
+    with open(path) as results_file:
+        return json.load(results_file)
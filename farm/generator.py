@@ -0,0 +1,326 @@
+import random
+from datetime import date, timedelta
+
+from django.db import transaction
+
+from buildings.models import Building, RoomGroup, Room, Silo, AnimalRoomEntry, AnimalRoomExit, AnimalRoomTransfer
+from buildings.models import DeathInRoom, AnimalSeparatedFromRoom, RoomFeedingChange, SiloFeedEntry, TreatmentInRoom
+from feeding.models import FeedType, FeedEntry
+from flocks.models import Flock, AnimalDeath, AnimalFarmExit, AnimalFlockExit, AnimalSeparation
+from medications.models import Medication, MedicationEntry, Treatment, MedicationApplication
+
+
+FEED_TYPES = [
+    ('Starter', 0, 42),
+    ('Grower', 42, 84),
+    ('Finisher', 84, 200),
+]
+
+MEDICATIONS = [
+    ('Amoxicillin', 0, 200, 0.1, 14),
+    ('Tylosin', 0, 200, 0.2, 7),
+]
+
+DEATH_CAUSES = ['Respiratory disease', 'Tail biting', 'Lameness', 'Unknown']
+SEPARATION_REASONS = ['Sick', 'Injured', 'Too small']
+
+
+class FarmGenerator:
+
+    """Generator of a synthetic farm, for load and benchmark testing.
+
+    The generator creates buildings with nested room groups, rooms, a separation room and one silo per feed type, and
+    fills them with some years of flocks: entries, feeding changes, transfers, deaths, separations, treatments and
+    exits, together with the feed deliveries of every silo. All random choices come from a single random.Random with a
+    fixed seed, so the same options always generate the same farm.
+
+    Every flock is planned first, keeping track of the animals per room, so the plan never moves animals that are not
+    there. The planned events of all the flocks are then saved in date order, through the models, so the occupancy
+    ledger and the other signal handlers see the same sequence of saves as in the real application.
+    """
+
+    def __init__(self, seed=0, years=3, buildings=2, groups_per_building=2, group_depth=2, rooms_per_group=4,
+                 room_capacity=40, flock_interval=14, rooms_per_flock=4, delivery_interval=14, end_date=None):
+        """Constructor.
+
+        :param seed: Seed of the random generator.
+        :param years: Number of years of history, ending at end_date.
+        :param buildings: Number of buildings.
+        :param groups_per_building: Number of room groups inside every group, at every level.
+        :param group_depth: Number of levels of room groups below a building. The rooms are in the lowest level.
+        :param rooms_per_group: Number of rooms in every group of the lowest level.
+        :param room_capacity: Capacity of the (non separation) rooms.
+        :param flock_interval: Number of days between the arrival of two flocks.
+        :param rooms_per_flock: Maximum number of rooms a new flock is placed in.
+        :param delivery_interval: Average number of days between two feed deliveries of a silo.
+        :param end_date: Last date of the generated history, today by default.
+        """
+        self.random = random.Random(seed)
+        self.years = years
+        self.number_of_buildings = buildings
+        self.groups_per_building = groups_per_building
+        self.group_depth = group_depth
+        self.rooms_per_group = rooms_per_group
+        self.room_capacity = room_capacity
+        self.flock_interval = flock_interval
+        self.rooms_per_flock = rooms_per_flock
+        self.delivery_interval = delivery_interval
+        self.end_date = end_date or date.today()
+        self.start_date = self.end_date - timedelta(days=365 * years)
+
+        self.feed_types = []
+        self.medications = []
+        self.rooms = []
+        self.room_buildings = {}
+        self.separation_rooms = {}
+        self.silos = []
+        self.room_free_at = {}
+        self.events = []
+        self.counts = {}
+
+    def generate(self):
+        """Generate the farm.
+
+        :return: A dict with the number of objects created per kind.
+        """
+        with transaction.atomic():
+            self.__create_feed_types()
+            self.__create_medications()
+            for number in range(1, self.number_of_buildings + 1):
+                self.__create_building(number)
+
+            self.__plan_feed_deliveries()
+            flock_date = self.start_date
+            while flock_date <= self.end_date:
+                self.__plan_flock(flock_date)
+                flock_date += timedelta(days=self.flock_interval)
+
+            self.events.sort(key=lambda event: (event[0], event[1]))
+            for at_date, sequence, handler, args in self.events:
+                handler(at_date, *args)
+
+        return self.counts
+
+    def __count(self, kind, number=1):
+        self.counts.update({kind: self.counts.get(kind, 0) + number})
+
+    def __add_event(self, at_date, handler, *args):
+        if at_date <= self.end_date:
+            self.events.append((at_date, len(self.events), handler, args))
+
+    def __create_feed_types(self):
+        for name, start_age, stop_age in FEED_TYPES:
+            feed_type, created = FeedType.objects.get_or_create(
+                name=name, defaults={'start_feeding_age': start_age, 'stop_feeding_age': stop_age})
+            self.feed_types.append(feed_type)
+
+    def __create_medications(self):
+        for name, age_start, age_stop, dosage, grace_period in MEDICATIONS:
+            medication, created = Medication.objects.get_or_create(
+                name=name, defaults={'recommended_age_start': age_start, 'recommended_age_stop': age_stop,
+                                     'dosage_per_kg': dosage, 'grace_period_days': grace_period,
+                                     'instructions': 'Generated medication.'})
+            if created:  # The stock of an existing medication was already entered by an earlier run.
+                MedicationEntry.objects.create(date=self.start_date, medication=medication, quantity=100000,
+                                               expiration_date=self.end_date + timedelta(days=365))
+            self.medications.append(medication)
+
+    def __create_building(self, number):
+        building = Building(name='Building %d' % number)
+        building.save()
+        self.__count('buildings')
+        self.__create_groups(building, building, str(number), self.group_depth)
+
+        separation_room = Room(name='Separation %d' % number, capacity=self.room_capacity // 4 or 1,
+                               group=building, is_separation=True)
+        separation_room.save()
+        self.separation_rooms.update({building.id: separation_room})
+        self.__count('rooms')
+
+        for feed_type in self.feed_types:
+            silo = Silo(name='%s %d' % (feed_type.name, number), capacity=self.room_capacity * 250,
+                        feed_type=feed_type, building=building)
+            silo.save()
+            self.silos.append(silo)
+            self.__count('silos')
+
+    def __create_groups(self, building, parent, label, depth):
+        if depth == 0:
+            for number in range(1, self.rooms_per_group + 1):
+                room = Room(name='Room %s.%d' % (label, number), capacity=self.room_capacity, group=parent)
+                room.save()
+                self.room_buildings.update({room.id: building.id})
+                self.rooms.append(room)
+                self.room_free_at.update({room.id: self.start_date})
+                self.__count('rooms')
+            return
+
+        for number in range(1, self.groups_per_building + 1):
+            group = RoomGroup(name='Group %s.%d' % (label, number), group=parent)
+            group.save()
+            self.__count('room_groups')
+            self.__create_groups(building, group, '%s.%d' % (label, number), depth - 1)
+
+    def __plan_feed_deliveries(self):
+        for silo in self.silos:
+            delivery_date = self.start_date + timedelta(days=self.random.randint(0, self.delivery_interval))
+            while delivery_date <= self.end_date:
+                remaining = round(silo.capacity * self.random.uniform(0.0, 0.15))
+                weight = round(silo.capacity * self.random.uniform(0.6, 0.85))
+                self.__add_event(delivery_date, self.__save_feed_delivery, silo, weight, remaining)
+                jitter = self.delivery_interval // 4
+                delivery_date += timedelta(days=self.delivery_interval + self.random.randint(-jitter, jitter))
+
+    def __plan_flock(self, entry_date):
+        stay = self.random.randint(110, 130)
+        end_date = entry_date + timedelta(days=stay)
+        free_rooms = [room for room in self.rooms if self.room_free_at[room.id] <= entry_date]
+        if not free_rooms:
+            return
+
+        rooms = self.random.sample(free_rooms, min(len(free_rooms), self.random.randint(1, self.rooms_per_flock)))
+        for room in rooms:
+            self.room_free_at.update({room.id: end_date + timedelta(days=7)})
+        counts = {room: room.capacity - self.random.randint(0, room.capacity // 10) for room in rooms}
+        number_of_animals = sum(counts.values())
+        flock = Flock(entry_date=entry_date, number_of_animals=number_of_animals,
+                      entry_weight=round(number_of_animals * self.random.uniform(18.0, 25.0), 1))
+        self.__add_event(entry_date, self.__save_flock, flock, dict(counts))
+
+        for feed_type in self.feed_types:
+            for room in rooms:
+                self.__add_event(entry_date + timedelta(days=feed_type.start_feeding_age),
+                                 self.__save_feeding_change, room, feed_type)
+
+        actions = []
+        transfer_day = self.random.randint(30, 60)
+        transfer_date = entry_date + timedelta(days=transfer_day)
+        destinations = [room for room in self.rooms if self.room_free_at[room.id] <= transfer_date]
+        if destinations and self.random.random() < 0.5:
+            actions.append((transfer_day, 'transfer', self.random.choice(destinations)))
+        for i in range(self.__binomial(number_of_animals, 0.03)):
+            actions.append((self.random.randint(1, stay - 8), 'death', None))
+        for i in range(self.__binomial(number_of_animals, 0.02)):
+            actions.append((self.random.randint(1, stay - 8), 'separation', None))
+        if self.random.random() < 0.4:
+            actions.append((self.random.randint(5, stay - 30), 'treatment', self.random.choice(self.medications)))
+        actions.sort(key=lambda action: action[0])
+
+        separated = {}
+        for day, kind, subject in actions:
+            at_date = entry_date + timedelta(days=day)
+            if kind == 'transfer':
+                source = max(counts, key=lambda room: counts[room])
+                self.room_free_at.update({subject.id: end_date + timedelta(days=7)})
+                counts.update({subject: counts.pop(source)})
+                self.__add_event(at_date, self.__save_transfer, flock, source, subject, counts[subject])
+                for feed_type in self.feed_types:
+                    if feed_type.start_feeding_age > day:
+                        self.__add_event(entry_date + timedelta(days=feed_type.start_feeding_age),
+                                         self.__save_feeding_change, subject, feed_type)
+                    elif feed_type is self.__feed_type_at(day):
+                        self.__add_event(at_date, self.__save_feeding_change, subject, feed_type)
+                continue
+
+            room = self.random.choice([room for room in counts if counts[room] > 1] or list(counts))
+            if kind == 'death':
+                counts.update({room: counts[room] - 1})
+                self.__add_event(at_date, self.__save_death, flock, room, self.random.uniform(20.0, 110.0))
+            elif kind == 'separation':
+                separation_room = self.separation_rooms[self.room_buildings[room.id]]
+                counts.update({room: counts[room] - 1})
+                separated.update({separation_room: separated.get(separation_room, 0) + 1})
+                self.__add_event(at_date, self.__save_separation, flock, room, separation_room)
+            else:
+                self.__add_event(at_date, self.__save_treatment, flock, room, subject,
+                                 at_date + timedelta(days=self.random.randint(5, 10)))
+
+        first_exit = {room: count // 2 for room, count in counts.items() if count // 2 > 0}
+        for room, count in first_exit.items():
+            counts.update({room: counts[room] - count})
+        for room, count in separated.items():
+            counts.update({room: counts.get(room, 0) + count})
+        last_exit = {room: count for room, count in counts.items() if count > 0}
+        for exit_date, room_counts in [(end_date - timedelta(days=7), first_exit), (end_date, last_exit)]:
+            if room_counts:
+                weight_per_animal = self.random.uniform(105.0, 125.0)
+                self.__add_event(exit_date, self.__save_exit, flock, room_counts,
+                                 round(sum(room_counts.values()) * weight_per_animal, 1))
+
+    def __feed_type_at(self, age):
+        current = None
+        for feed_type in self.feed_types:
+            if feed_type.start_feeding_age <= age:
+                current = feed_type
+        return current
+
+    def __binomial(self, number, probability):
+        return sum(1 for i in range(number) if self.random.random() < probability)
+
+    def __save_feed_delivery(self, at_date, silo, weight, remaining):
+        feed_entry = FeedEntry(date=at_date, weight=weight, feed_type=silo.feed_type)
+        feed_entry.save()
+        SiloFeedEntry(feed_entry=feed_entry, silo=silo, remaining=remaining).save()
+        self.__count('feed_entries')
+
+    def __save_flock(self, at_date, flock, counts):
+        flock.save()
+        self.__count('flocks')
+        for room, count in counts.items():
+            AnimalRoomEntry(date=at_date, number_of_animals=count, flock=flock, room=room).save()
+            self.__count('room_entries')
+
+    def __save_feeding_change(self, at_date, room, feed_type):
+        RoomFeedingChange(date=at_date, feed_type=feed_type, room=room).save()
+        self.__count('feeding_changes')
+
+    def __save_transfer(self, at_date, flock, source, destination, number_of_animals):
+        room_exit = AnimalRoomExit(date=at_date, room=source, flock=flock,
+                                   number_of_animals=number_of_animals)
+        room_exit.save()
+        room_entry = AnimalRoomEntry(date=at_date, room=destination, flock=flock,
+                                     number_of_animals=number_of_animals)
+        room_entry.save()
+        AnimalRoomTransfer(room_entry=room_entry, room_exit=room_exit).save()
+        self.__count('transfers')
+
+    def __save_death(self, at_date, flock, room, weight):
+        death = AnimalDeath(date=at_date, flock=flock, weight=round(weight, 1),
+                            cause=self.random.choice(DEATH_CAUSES))
+        death.save()
+        DeathInRoom(death=death, room=room).save()
+        AnimalRoomExit(date=at_date, room=room, flock=flock, number_of_animals=1).save()
+        self.__count('deaths')
+
+    def __save_separation(self, at_date, flock, room, separation_room):
+        separation = AnimalSeparation(date=at_date, flock=flock,
+                                      reason=self.random.choice(SEPARATION_REASONS))
+        separation.save()
+        AnimalSeparatedFromRoom(separation=separation, room=room, destination=separation_room).save()
+        AnimalRoomExit(date=at_date, room=room, flock=flock, number_of_animals=1).save()
+        AnimalRoomEntry(date=at_date, room=separation_room, flock=flock, number_of_animals=1).save()
+        self.__count('separations')
+
+    def __save_treatment(self, at_date, flock, room, medication, stop_date):
+        if stop_date > self.end_date:
+            stop_date = None
+        treatment = Treatment(start_date=at_date, stop_date=stop_date, medication=medication, flock=flock,
+                              comments='')
+        treatment.save()
+        TreatmentInRoom(treatment=treatment, start_room=room, current_room=room).save()
+        application_date = at_date
+        while application_date <= (stop_date or self.end_date):
+            MedicationApplication(date=application_date, dosage=round(self.random.uniform(5.0, 15.0), 1),
+                                  treatment=treatment).save()
+            application_date += timedelta(days=1)
+        self.__count('treatments')
+
+    def __save_exit(self, at_date, flock, room_counts, weight):
+        farm_exit = AnimalFarmExit(date=at_date, destination='Slaughterhouse')
+        farm_exit.save()
+        AnimalFlockExit(number_of_animals=sum(room_counts.values()), weight=weight, flock=flock,
+                        farm_exit=farm_exit).save()
+        for room, count in room_counts.items():
+            AnimalRoomExit(date=at_date, room=room, flock=flock, number_of_animals=count,
+                           farm_exit=farm_exit).save()
+        self.__count('exits')
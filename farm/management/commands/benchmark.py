@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from farm.benchmark import BenchmarkSuite, compare_results, load_results
+
+
+class Command(BaseCommand):
+
+    """Run the benchmark suite against the current database.
+
+    Meant to be run on a database filled by generate_farm, with the same seed and options for every commit that is
+    measured. The results are written as JSON, and can be compared with the results of an earlier run.
+    """
+
+    help = 'Measure the wall time and number of queries of the pages, estimations and wizards of the farm.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=5, help='Number of runs of every benchmark.')
+        parser.add_argument('--date', type=parse_date, default=None,
+                            help='Date used for the estimations and the wizards (YYYY-MM-DD), today by default.')
+        parser.add_argument('--output', default=None, help='File to write the JSON results to, stdout by default.')
+        parser.add_argument('--compare', default=None, help='JSON results of an earlier run to compare with.')
+
+    def handle(self, *args, **options):
+        results = BenchmarkSuite(repeat=options['repeat'], at_date=options['date']).run()
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+        else:
+            self.stdout.write(json.dumps(results, indent=2))
+
+        failed = [result['name'] for result in results['results'] if not result.get('ok', True)]
+        for name in failed:
+            self.stderr.write('Wizard step did not complete: %s' % name)
+
+        if options['compare']:
+            self.stdout.write('%-50s %12s %12s %8s %8s %8s' % ('Benchmark', 'Old ms', 'New ms', 'Change', 'Old q',
+                                                               'New q'))
+            for name, old_time, new_time, old_queries, new_queries in compare_results(load_results(options['compare']),
+                                                                                       results):
+                change = '-' if not old_time else '%+.1f%%' % ((new_time - old_time) / old_time * 100)
+                self.stdout.write('%-50s %12s %12.3f %8s %8s %8d' % (name,
+                                                                     '-' if old_time is None else '%.3f' % old_time,
+                                                                     new_time, change,
+                                                                     '-' if old_queries is None else old_queries,
+                                                                     new_queries))
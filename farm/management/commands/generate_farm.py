@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from farm.generator import FarmGenerator
+
+
+class Command(BaseCommand):
+
+    """Fill the database with a synthetic farm.
+
+    Meant for load and benchmark testing: the same seed and options always generate the same farm, so measurements of
+    the occupancy, feed forecast and KPI code can be compared between runs. The data is added to the existing data, so
+    it is best run on an empty database.
+    """
+
+    help = 'Generate a synthetic farm with some years of flocks, for load and benchmark testing.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random generator.')
+        parser.add_argument('--years', type=int, default=3, help='Number of years of history.')
+        parser.add_argument('--buildings', type=int, default=2, help='Number of buildings.')
+        parser.add_argument('--groups-per-building', type=int, default=2,
+                            help='Number of room groups inside every group, at every level.')
+        parser.add_argument('--group-depth', type=int, default=2,
+                            help='Number of levels of room groups below a building.')
+        parser.add_argument('--rooms-per-group', type=int, default=4,
+                            help='Number of rooms in every group of the lowest level.')
+        parser.add_argument('--room-capacity', type=int, default=40, help='Capacity of the rooms.')
+        parser.add_argument('--flock-interval', type=int, default=14, help='Days between the arrival of two flocks.')
+        parser.add_argument('--rooms-per-flock', type=int, default=4,
+                            help='Maximum number of rooms a new flock is placed in.')
+        parser.add_argument('--delivery-interval', type=int, default=14,
+                            help='Average days between two feed deliveries of a silo.')
+        parser.add_argument('--end-date', type=parse_date, default=None,
+                            help='Last date of the history (YYYY-MM-DD), today by default.')
+
+    def handle(self, *args, **options):
+        generator = FarmGenerator(seed=options['seed'], years=options['years'], buildings=options['buildings'],
+                                  groups_per_building=options['groups_per_building'],
+                                  group_depth=options['group_depth'], rooms_per_group=options['rooms_per_group'],
+                                  room_capacity=options['room_capacity'], flock_interval=options['flock_interval'],
+                                  rooms_per_flock=options['rooms_per_flock'],
+                                  delivery_interval=options['delivery_interval'], end_date=options['end_date'])
+        counts = generator.generate()
+        for kind in sorted(counts.keys()):
+            self.stdout.write('%s: %d' % (kind.replace('_', ' ').capitalize(), counts[kind]))
@@ -0,0 +1,32 @@
+import argparse
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+from Suinos.profiling import Profile
+
+
+class Command(BaseCommand):
+
+    """Run another management command with the domain calculations profiled.
+
+    Usage::
+
+        python manage.py profile_command benchmark --repeat 1 --json profile.json
+    """
+
+    help = 'Run a management command and report the time and queries of the Room, Building and Flock calculations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', default=None, help='File to write the JSON report to.')
+        parser.add_argument('command', help='The management command to profile.')
+        parser.add_argument('arguments', nargs=argparse.REMAINDER, help='The arguments of the command.')
+
+    def handle(self, *args, **options):
+        with Profile(options['command']) as profile:
+            call_command(options['command'], *options['arguments'], stdout=self.stdout, stderr=self.stderr)
+
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                output.write(profile.report_json())
+        self.stdout.write(profile.report_text())
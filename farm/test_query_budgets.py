@@ -0,0 +1,117 @@
+from datetime import date, timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.shortcuts import reverse
+from django.test import TestCase
+
+from buildings.models import Building, Room, RoomGroup, AnimalRoomEntry
+from flocks.models import Flock
+from Suinos.testing import QueryBudgetMixin
+
+from .generator import FarmGenerator
+
+
+class ViewQueryBudgetTest(QueryBudgetMixin, TestCase):
+
+    """Upper bounds on the number of queries of the main pages, for a generated farm of a fixed size.
+
+    The budgets are measured with an empty cache, so they also cover the queries that fill it.
+    """
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='NormalUser', email='none@noprovider.test', password='Password')
+        self.client.login(username='NormalUser', password='Password')
+        self.generate_farm(seed=1)
+        self.building = Building.objects.order_by('id').first()
+        self.room = self.building.get_all_rooms().filter(is_separation=False).order_by('id').first()
+        self.flock = Flock.objects.with_animal_counts().present().order_by('id').first()
+
+    @staticmethod
+    def generate_farm(seed):
+        FarmGenerator(seed=seed, years=1, buildings=2, rooms_per_group=2, room_capacity=20).generate()
+
+    def get(self, url):
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEquals(200, response.status_code)
+        return response
+
+    def add_rooms(self, building, number_of_rooms=4):
+        """Add rooms with animals of a new flock to every group of a building."""
+        flock = Flock.objects.create(entry_date=date.today() - timedelta(days=10), entry_weight=2000,
+                                     number_of_animals=number_of_rooms * 10)
+        for group in building.get_descendant_groups().exclude(id=building.id):
+            for number in range(number_of_rooms):
+                room = Room.objects.create(name='Extra %d' % number, capacity=10, group=group)
+                AnimalRoomEntry.objects.create(date=flock.entry_date, number_of_animals=10, flock=flock, room=room)
+
+    def test_farm_index(self):
+        with self.assertMaxQueries(75):
+            self.get(reverse('farm:index'))
+
+    def test_buildings_index(self):
+        with self.assertMaxQueries(6):
+            self.get(reverse('buildings:index'))
+
+    def test_building_detail(self):
+        with self.assertMaxQueries(25):
+            self.get(reverse('buildings:building_detail', kwargs={'building_id': self.building.id}))
+
+    def test_room_detail(self):
+        with self.assertMaxQueries(20):
+            self.get(reverse('buildings:room_detail', kwargs={'room_id': self.room.id}))
+
+    def test_flocks_index(self):
+        with self.assertMaxQueries(7):
+            self.get(reverse('flocks:index'))
+
+    def test_flock_detail(self):
+        with self.assertMaxQueries(15):
+            self.get(reverse('flocks:detail', kwargs={'flock_id': self.flock.id}))
+
+    def test_farm_index_does_not_grow(self):
+        self.assertQueriesDoNotGrow(lambda: self.get(reverse('farm:index')), lambda: self.generate_farm(seed=2))
+
+    def test_buildings_index_does_not_grow(self):
+        self.assertQueriesDoNotGrow(lambda: self.get(reverse('buildings:index')), lambda: self.generate_farm(seed=2))
+
+    def test_building_detail_does_not_grow(self):
+        url = reverse('buildings:building_detail', kwargs={'building_id': self.building.id})
+        self.assertQueriesDoNotGrow(lambda: self.get(url), lambda: self.add_rooms(self.building))
+
+    def test_flocks_index_does_not_grow(self):
+        self.assertQueriesDoNotGrow(lambda: self.get(reverse('flocks:index')), lambda: self.generate_farm(seed=2))
+
+    def test_flock_detail_does_not_grow(self):
+        url = reverse('flocks:detail', kwargs={'flock_id': self.flock.id})
+        self.assertQueriesDoNotGrow(lambda: self.get(url), lambda: self.generate_farm(seed=2))
+
+
+class QueryBudgetMixinTest(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        for number in range(3):
+            RoomGroup.objects.create(name='Group %d' % number)
+
+    def test_max_queries(self):
+        with self.assertMaxQueries(1):
+            list(RoomGroup.objects.all())
+
+    def test_max_queries_failure_shows_repeated_queries(self):
+        with self.assertRaises(AssertionError) as context:
+            with self.assertMaxQueries(2):
+                for group_id in RoomGroup.objects.values_list('id', flat=True):
+                    RoomGroup.objects.get(id=group_id)
+        self.assertIn('4 queries executed, the budget is 2.', str(context.exception))
+        self.assertIn('3x SELECT', str(context.exception))
+
+    def test_queries_grow(self):
+        def select_one_by_one():
+            for group_id in RoomGroup.objects.values_list('id', flat=True):
+                RoomGroup.objects.get(id=group_id)
+
+        with self.assertRaises(AssertionError) as context:
+            self.assertQueriesDoNotGrow(select_one_by_one, lambda: RoomGroup.objects.create(name='Extra'))
+        self.assertIn('grew from 4 to 5', str(context.exception))
+        self.assertIn('3x -> 4x SELECT', str(context.exception))
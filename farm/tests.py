@@ -1,17 +1,27 @@
 from datetime import date
+import json
+import os
+import tempfile
+from io import StringIO
 from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db.models import Min
 from django.test import TestCase
 from django.forms import formset_factory
 from django.shortcuts import reverse
 from django.contrib.auth.models import User
-from buildings.models import Building, Room, SiloFeedEntry
+from buildings.models import Building, Room, RoomGroup, SiloFeedEntry, OccupancyLedger, FeedStockForecast
 from flocks.models import Flock, AnimalSeparation
 from feeding.models import FeedType, FeedEntry
-from medications.models import Medication, Treatment, MedicationApplication
+from medications.models import Medication, MedicationEntry, Treatment, MedicationApplication
 
+from .benchmark import BenchmarkSuite, compare_results
+from .generator import FarmGenerator
 from .forms import AnimalDeathForm, AnimalSeparationForm, AnimalSeparationDistinctionForm, GroupExitForm
 from .forms import AnimalExitRoomFormset, AnimalExitRoomForm, FeedEntryForm, AnimalEntryForm
 from .models import AnimalEntry, NewTreatment
+from .widgets import RoomSelectionWidget
 
 
 class FarmTestClass(TestCase):
@@ -892,6 +902,29 @@ class TestNewTreatmentWizard(FarmTestClass):
         self.assertEquals(1, self.mocked_model.save.call_count)
 
 
+class RoomSelectionWidgetTest(FarmTestClass):
+
+    def test_room_tree(self):
+        group = RoomGroup(name='Group', group=self.building)
+        group.save()
+        sub_group = RoomGroup(name='SubGroup', group=group)
+        sub_group.save()
+        nested_room = Room(name='Nested', capacity=5, group=sub_group)
+        nested_room.save()
+        widget = RoomSelectionWidget()
+        widget.choices = AnimalEntryForm.base_fields['rooms'].choices
+        with self.assertNumQueries(2):
+            widget.create_room_tree([str(nested_room.id)])
+
+        self.assertEqual([self.building.id], list(widget.room_groups.keys()))
+        building_info = widget.room_groups[self.building.id]
+        self.assertEqual([self.normal_room1, self.normal_room2], building_info.rooms)
+        sub_group_info = building_info.groups[group.id].groups[sub_group.id]
+        self.assertEqual([nested_room], sub_group_info.rooms)
+        self.assertFalse(sub_group_info.collapsed)
+        self.assertTrue(building_info.groups[group.id].collapsed)
+
+
 class TestFarmIndexView(FarmTestClass):
 
     def setUp(self):
@@ -903,6 +936,17 @@ class TestFarmIndexView(FarmTestClass):
         response = self.client.get(reverse('farm:index'))
         self.assertEquals(200, response.status_code)
 
+    def test_feed_forecasts_not_computed_yet(self):
+        FarmGenerator(seed=1, years=1, buildings=2, rooms_per_group=1).generate()
+        response = self.client.get(reverse('farm:index'))
+        self.assertEqual([None], list({feed.forecast for feed in response.context['feed_types']}))
+        self.assertContains(response, 'Forecast not computed yet')
+
+        FeedStockForecast.objects.refresh()
+        response = self.client.get(reverse('farm:index'))
+        self.assertNotIn(None, [feed.forecast for feed in response.context['feed_types']])
+        self.assertNotContains(response, 'Forecast not computed yet')
+
 
 class TestSingleExitWizard(FarmTestClass):
     def setUp(self):
@@ -1011,3 +1055,91 @@ class TestTransferWizard(FarmTestClass):
 
         response = self.client.post(reverse('farm:new_transfer'), data)
         self.assertEquals(302, response.status_code)
+
+
+class GenerateFarmCommandTest(TestCase):
+    options = {'seed': 3, 'years': 1, 'buildings': 1, 'groups_per_building': 2, 'group_depth': 2,
+               'rooms_per_group': 2, 'room_capacity': 10, 'end_date': date(2017, 6, 30)}
+
+    def test_generate_farm(self):
+        out = StringIO()
+        call_command('generate_farm', stdout=out, **self.options)
+        self.assertIn('Flocks: ', out.getvalue())
+        self.assertEquals(1, Building.objects.count())
+        self.assertEquals(7, RoomGroup.objects.count())
+        self.assertEquals(9, Room.objects.count())
+        self.assertEquals(3, FeedType.objects.count())
+        self.assertTrue(FeedEntry.objects.exists())
+        self.assertTrue(Flock.objects.exists())
+        self.assertTrue(Flock.objects.with_animal_counts().departed().exists())
+
+    def test_occupancy_matches_flocks(self):
+        call_command('generate_farm', stdout=StringIO(), **self.options)
+        self.assertIsNone(OccupancyLedger.objects.filter(flock_count__lt=0).aggregate(Min('id'))['id__min'])
+        for flock in Flock.objects.with_animal_counts():
+            rooms = OccupancyLedger.objects.rooms_of_flock(flock.id, date(2017, 6, 30))
+            at_farm = sum(room.flock_count for room in rooms)
+            self.assertEquals(flock.living_animal_count, at_farm)
+
+    def test_same_seed_same_farm(self):
+        first = StringIO()
+        second = StringIO()
+        call_command('generate_farm', stdout=first, **self.options)
+        call_command('generate_farm', stdout=second, **self.options)
+        self.assertEquals(first.getvalue(), second.getvalue())
+        # The medications of the first run are reused, with their stock.
+        self.assertEquals(Medication.objects.count(), MedicationEntry.objects.count())
+
+
+class BenchmarkSuiteTest(TestCase):
+    def setUp(self):
+        call_command('generate_farm', stdout=StringIO(), seed=3, years=1, buildings=1, rooms_per_group=2,
+                     room_capacity=20, end_date=date(2017, 6, 30))
+
+    def test_run(self):
+        results = BenchmarkSuite(repeat=2, at_date=date(2017, 6, 30)).run()
+        names = [result['name'] for result in results['results']]
+        self.assertIn('view.farm_index', names)
+        self.assertIn('model.building_estimated_feed_end_date', names)
+        self.assertIn('wizard.new_treatment.overview', names)
+        for result in results['results']:
+            self.assertEquals(2, result['runs'])
+            self.assertTrue(result.get('ok', True), result['name'])
+        self.assertEquals(1, results['dataset']['buildings'])
+
+    def test_wizards_rolled_back(self):
+        number_of_flocks = Flock.objects.count()
+        BenchmarkSuite(repeat=1, at_date=date(2017, 6, 30)).run()
+        self.assertEquals(number_of_flocks, Flock.objects.count())
+
+    def test_configured_cache_untouched(self):
+        cache.set('farm.tests.benchmark', 'kept')
+        BenchmarkSuite(repeat=1, at_date=date(2017, 6, 30)).run()
+        self.assertEqual('kept', cache.get('farm.tests.benchmark'))
+
+    def test_compare_results(self):
+        old = {'results': [self.__result('view.farm_index', 10.0, 20), self.__result('view.removed', 1.0, 1)]}
+        new = {'results': [self.__result('view.farm_index', 5.0, 12), self.__result('view.added', 2.0, 3)]}
+        self.assertEqual([('view.farm_index', 10.0, 5.0, 20, 12), ('view.added', None, 2.0, None, 3)],
+                         compare_results(old, new))
+
+    def test_command_compare(self):
+        handle, baseline = tempfile.mkstemp(suffix='.json')
+        os.close(handle)
+        self.addCleanup(os.remove, baseline)
+        with open(baseline, 'w') as baseline_file:
+            json.dump({'results': [self.__result('view.farm_index', 1000000.0, 1000)]}, baseline_file)
+
+        out = StringIO()
+        call_command('benchmark', repeat=1, date=date(2017, 6, 30), output=os.devnull, compare=baseline, stdout=out,
+                     stderr=StringIO())
+        lines = {line.split()[0]: line.split() for line in out.getvalue().splitlines()}
+        self.assertEqual('1000000.000', lines['view.farm_index'][1])
+        self.assertEqual('-100.0%', lines['view.farm_index'][3])
+        self.assertEqual('1000', lines['view.farm_index'][4])
+        self.assertLess(int(lines['view.farm_index'][5]), 1000)
+        self.assertEqual(['-', '-'], [lines['view.building_detail'][1], lines['view.building_detail'][3]])
+
+    @staticmethod
+    def __result(name, median, max_queries):
+        return {'name': name, 'wall_time_ms': {'median': median}, 'queries': {'max': max_queries}}
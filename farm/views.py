@@ -7,8 +7,8 @@ from django.utils.translation import ugettext as _
 from feeding.models import FeedType
 from flocks.models import Flock, AnimalSeparation, AnimalDeath, AnimalFarmExit
 from flocks.kpis import NumberOfAnimalsKpi, DeathPercentageKpi, SeparationsKpi, GrowRateKpi, InTreatmentKpi
-from buildings.models import Room
-from medications.models import Treatment
+from flocks.kpis import KpiContext
+from buildings.models import Room, FeedStockForecast
 
 from .forms import AnimalSeparationForm, AnimalSeparationUpdateForm
 from .forms import FeedTransitionForm, FeedEntryForm
@@ -22,37 +22,51 @@ class FarmIndexView(TemplateView):
 
     def __init__(self):
         super().__init__()
-        self.current_flocks = Flock.objects.present_at_farm()
-        self.active_separations = [obj for obj in AnimalSeparation.objects.all() if obj.active]
-        self.number_of_living_animals = sum([obj.number_of_living_animals for obj in self.current_flocks])
+        self.kpi_context = KpiContext()
+        self.current_flocks = self.kpi_context.flocks
+        self.active_separations = self.kpi_context.active_separations
+        self.number_of_living_animals = self.kpi_context.number_of_living_animals
         self.farm_capacity = sum([room.capacity for room in Room.objects.all()])
 
     def get_context_data(self, **kwargs):
         context = super(FarmIndexView, self).get_context_data(**kwargs)
         context['flocks'] = self.current_flocks
-        context['separations'] = [obj for obj in AnimalSeparation.objects.all() if obj.active]
-        context['feed_types'] = FeedType.objects.all()
+        context['separations'] = self.active_separations
+        context['feed_types'] = self.get_feed_types()
         context['kpis'] = self.generate_kpi_data()
-        context['treatments'] = [obj for obj in Treatment.objects.all() if obj.is_active is True]
+        context['treatments'] = self.kpi_context.active_treatments
         context['warnings'] = self.generate_warnings()
         return context
 
+    @staticmethod
+    def get_feed_types():
+        """Get the feed types, with the totals of today's feed stock forecasts as their forecast.
+
+        The forecast is None when update_feed_forecasts did not store the forecasts of the feed type yet; the page
+        does not compute them.
+        """
+        feed_types = list(FeedType.objects.all())
+        totals = FeedStockForecast.objects.farm_totals()
+        for feed_type in feed_types:
+            feed_type.forecast = totals.get(feed_type.id)
+        return feed_types
+
     def generate_kpi_data(self):
         """Generate all the desired KPIs."""
         kpi_list = []
-        kpi_list.extend(self.generate_flock_kpis())
+        kpi_list.extend(self.generate_flock_kpis(self.kpi_context))
         return kpi_list
 
     @staticmethod
-    def generate_flock_kpis():
-        """Generate KPIs with flock related information."""
+    def generate_flock_kpis(kpi_context):
+        """Generate KPIs with flock related information, all computed from the same KpiContext."""
         kpi_list = []
 
-        kpi_list.append(NumberOfAnimalsKpi())
-        kpi_list.append(DeathPercentageKpi())
-        kpi_list.append(SeparationsKpi())
+        kpi_list.append(NumberOfAnimalsKpi(context=kpi_context))
+        kpi_list.append(DeathPercentageKpi(context=kpi_context))
+        kpi_list.append(SeparationsKpi(context=kpi_context))
         kpi_list.append(GrowRateKpi())
-        kpi_list.append(InTreatmentKpi())
+        kpi_list.append(InTreatmentKpi(context=kpi_context))
         return kpi_list
 
     def generate_warnings(self):
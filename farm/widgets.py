@@ -20,35 +20,45 @@ class RoomSelectionWidget(ChoiceWidget):
         self.room_groups = None
 
     def create_room_tree(self, value):
-        choices = self.choices.queryset.all()
+        choices = self.choices.queryset.select_related('group')
         if value is None:
             value = []
 
+        rooms = list(choices)
+        ancestor_ids = set()
+        for room in rooms:
+            ancestor_ids.update(room.group.ancestor_ids)
+        groups = {group.id: group for group in RoomGroup.objects.filter(id__in=ancestor_ids)}
+        groups.update({room.group.id: room.group for room in rooms})
+
         room_groups = {}
-        for room in choices:
-            group_info = room_groups.get(room.group.id, self.GroupData(room.group.name))
+        group_nodes = {}
+        for room in rooms:
+            group_info = self.__get_group_node(room.group_id, groups, group_nodes, room_groups)
             group_info.rooms.append(room)
             if str(room.id) in value:
                 group_info.collapsed = False
-            room_groups.update({room.group.id: group_info})
-
-        changed = True
-        while changed:
-            changed = False
-            keys = list(room_groups.keys())
-            for group_id in keys:
-                group = RoomGroup.objects.get(id=group_id)
-                if group.group is not None:
-                    changed = True
-                    group_info = room_groups.get(group.group.id, self.GroupData(group.group.name))
-                    group_info.groups.update({group_id: room_groups.get(group_id, None)})
-                    room_groups.update({group.group.id: group_info})
-                    room_groups.pop(group_id)
 
         for key, group in room_groups.items():
             group.collapsed = False
         self.room_groups = room_groups
 
+    def __get_group_node(self, group_id, groups, group_nodes, room_groups):
+        """Get the GroupData for a group, creating it and linking it to its parent group when needed."""
+        group_info = group_nodes.get(group_id, None)
+        if group_info is not None:
+            return group_info
+
+        group = groups[group_id]
+        group_info = self.GroupData(group.name)
+        group_nodes.update({group_id: group_info})
+        if group.group_id is None:
+            room_groups.update({group_id: group_info})
+        else:
+            parent_info = self.__get_group_node(group.group_id, groups, group_nodes, room_groups)
+            parent_info.groups.update({group_id: group_info})
+        return group_info
+
     def get_context(self, name, value, attrs):
         context = super().get_context(name, value, attrs)
         self.create_room_tree(value)
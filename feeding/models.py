@@ -62,4 +62,9 @@ class FeedEntry(models.Model):
     weight = models.FloatField()
     feed_type = models.ForeignKey(to=FeedType)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['feed_type', 'date']),
+        ]
+
 
@@ -0,0 +1,44 @@
+from buildings.models import OccupancyLedger
+
+from .kpis import NumberOfAnimalsKpi, EstimatedWeightKpi, ExitDateKpi, CurrentFeedTypeKpi, DeathPercentageKpi
+from .kpis import SeparationsKpi
+
+
+class FlockDetail:
+
+    """All the information the flock detail page shows about a flock, loaded with a fixed number of queries.
+
+    The flock should come from Flock.objects.with_animal_counts(), so its living animals, deaths and separations do not
+    need more queries. The deaths, separations and exits are loaded with the objects they refer to, and the rooms of
+    the flock, with the number of its animals in each, come from the OccupancyLedger in one query. The template and
+    the KPIs both use the loaded data.
+    """
+
+    def __init__(self, flock):
+        """Constructor.
+
+        :param flock: The flock, preferably annotated with its animal counts.
+        """
+        self.flock = flock
+        self.deaths = list(flock.animaldeath_set.order_by('date', 'id'))
+        self.separations = list(flock.animalseparation_set.select_related('death', 'exit__farm_exit')
+                                .order_by('date', 'id'))
+        self.exits = list(flock.animalflockexit_set.select_related('farm_exit').order_by('farm_exit__date', 'id'))
+        self.rooms = OccupancyLedger.objects.rooms_of_flock(flock.id)
+
+    @property
+    def current_rooms(self):
+        """The rooms of the flock, as dicts with the name of the room and the number of animals of the flock in it."""
+        return [{'name': str(room), 'occupancy': room.flock_count} for room in self.rooms]
+
+    def create_kpis(self):
+        """Create the KPIs of the flock."""
+        kpi_list = []
+        if self.flock.number_of_living_animals > 0:
+            kpi_list.append(NumberOfAnimalsKpi(self.flock))
+            kpi_list.append(EstimatedWeightKpi(self.flock))
+            kpi_list.append(ExitDateKpi(self.flock))
+            kpi_list.append(CurrentFeedTypeKpi(self.flock, rooms=self.rooms))
+        kpi_list.append(DeathPercentageKpi(self.flock))
+        kpi_list.append(SeparationsKpi(self.flock))
+        return kpi_list
@@ -0,0 +1,68 @@
+from bisect import bisect_left
+from collections import defaultdict
+
+from django.core.cache import cache
+
+
+class GrowRateModel:
+
+    """The grow rates of the animals that left the farm, kept in the cache.
+
+    For every farm exit date the model keeps the number of animals that left and the sum of their grow rates, weighted
+    by the number of animals, together with the totals from that date on. The average grow rate of the exits since any
+    date is then found with a binary search. The model is loaded with one query, stored in the cache, and invalidated
+    whenever a Flock, AnimalFarmExit or AnimalFlockExit is saved or deleted.
+    """
+
+    cache_key = 'flocks.grow_rate_model'
+    timeout = 24 * 60 * 60
+
+    def __init__(self, exits):
+        """Constructor.
+
+        :param exits: A list of (date, number_of_animals, weighted_grow_rate) tuples, one per date, sorted by date.
+        """
+        self.dates = [exit_date for exit_date, _, _ in exits]
+        self.animals_from = [0] * (len(exits) + 1)
+        self.growth_from = [0.0] * (len(exits) + 1)
+        for index in reversed(range(len(exits))):
+            self.animals_from[index] = self.animals_from[index + 1] + exits[index][1]
+            self.growth_from[index] = self.growth_from[index + 1] + exits[index][2]
+
+    @classmethod
+    def current(cls):
+        """Get the model, from the cache when available."""
+        exits = cache.get(cls.cache_key)
+        if exits is None:
+            exits = cls.__load_exits()
+            cache.set(cls.cache_key, exits, cls.timeout)
+        return cls(exits)
+
+    @classmethod
+    def invalidate(cls):
+        """Remove the model from the cache."""
+        cache.delete(cls.cache_key)
+
+    def grow_rate_since(self, start_date):
+        """Get the average grow rate of the animals that left the farm on or after a date.
+
+        :return: The grow rate in kg/day, weighted by the number of animals of every exit, or None without exits.
+        """
+        index = bisect_left(self.dates, start_date)
+        if self.animals_from[index] == 0:
+            return None
+        return self.growth_from[index] / self.animals_from[index]
+
+    @staticmethod
+    def __load_exits():
+        """Load all the flock exits, joined with their flock and farm exit, and sum them per date."""
+        from .models import AnimalFlockExit
+        rows = AnimalFlockExit.objects.values_list('farm_exit__date', 'number_of_animals', 'weight',
+                                                   'flock__entry_date', 'flock__entry_weight',
+                                                   'flock__number_of_animals')
+        per_date = defaultdict(lambda: [0, 0.0])
+        for exit_date, number_of_animals, weight, entry_date, entry_weight, flock_animals in rows:
+            grow_rate = (weight / number_of_animals - entry_weight / flock_animals) / (exit_date - entry_date).days
+            per_date[exit_date][0] += number_of_animals
+            per_date[exit_date][1] += grow_rate * number_of_animals
+        return [(exit_date, totals[0], totals[1]) for exit_date, totals in sorted(per_date.items())]
@@ -1,9 +1,47 @@
 from datetime import date, timedelta
 from django.utils.formats import date_format
 from django.urls import reverse, reverse_lazy
+from django.utils.functional import cached_property
 from ui_objects.models import Kpi, InfoKpi
-from .models import Flock, AnimalFlockExit
+from .models import Flock, AnimalFlockExit, AnimalSeparation, KpiSnapshot
 from feeding.models import FeedType
+from medications.models import Treatment
+
+
+class KpiContext:
+
+    """The state of the farm that the farm level KPIs are computed from.
+
+    Every part is loaded the first time it is used and then kept, so all the KPIs of a page that share a context, and
+    the page itself, use one load of the farm state instead of each querying the farm again. When the KPIs of today were
+    already rolled up into a KpiSnapshot, the KPIs read that snapshot instead.
+    """
+
+    @cached_property
+    def snapshot(self):
+        """The farm level KpiSnapshot of today, or None when it was not rolled up (yet)."""
+        return KpiSnapshot.objects.filter(date=date.today(), flock__isnull=True).first()
+
+    @cached_property
+    def flocks(self):
+        """The flocks present at the farm, annotated with their animal counts."""
+        return list(Flock.objects.present_at_farm())
+
+    @cached_property
+    def active_separations(self):
+        """The separations of animals that did not die or leave the farm yet."""
+        separations = AnimalSeparation.objects.filter(death__isnull=True, exit__isnull=True)
+        return list(separations.select_related('flock').order_by('id'))
+
+    @cached_property
+    def active_treatments(self):
+        """The treatments that did not stop yet."""
+        treatments = Treatment.objects.filter(stop_date__isnull=True)
+        return list(treatments.select_related('flock', 'medication').order_by('id'))
+
+    @property
+    def number_of_living_animals(self):
+        return sum([flock.number_of_living_animals for flock in self.flocks])
 
 
 class NumberOfAnimalsKpi(InfoKpi):
@@ -19,21 +57,25 @@ class NumberOfAnimalsKpi(InfoKpi):
     action = '#'
     action_name = 'Details'
 
-    def __init__(self, flock=None):
+    def __init__(self, flock=None, context=None):
         """Constructor.
 
         When a flock is provided, a KPI is created with only information for that flock. If no flock is supplied, the
-        information is collected from all the flocks currently in the farm.
+        information is collected from all the flocks currently in the farm, as loaded by the given KpiContext.
         """
         super().__init__()
         if flock is None:
-            self.__setup_farm_level()
+            self.__setup_farm_level(context or KpiContext())
         elif isinstance(flock, Flock):
             self.value = flock.number_of_living_animals
 
-    def __setup_farm_level(self):
+    def __setup_farm_level(self, context):
         """Set's the KPI information up on Farm Level."""
-        flocks_on_farm = Flock.objects.present_at_farm()
+        if context.snapshot is not None:
+            self.value = context.snapshot.living_animals
+            return
+
+        flocks_on_farm = context.flocks
         count = 0
         for flock in flocks_on_farm:
             count += flock.number_of_living_animals
@@ -50,28 +92,32 @@ class DeathPercentageKpi(Kpi):
     action_name = 'Details'
     action = '#'
 
-    def __init__(self, flock=None):
+    def __init__(self, flock=None, context=None):
         """Constructor.
 
         When a flock is provided, a KPI is created with only information for that flock. If no flock is supplied, the
-        information is collected from all the flocks currently in the farm.
+        information is collected from all the flocks currently in the farm, as loaded by the given KpiContext.
         """
         super().__init__()
         if flock is None:
-            self.__setup_farm_level()
+            self.__setup_farm_level(context or KpiContext())
         elif isinstance(flock, Flock):
             self.float_value = flock.death_percentage
         self.__setup_color()
         self.value = "{:.2f}%".format(self.float_value)
 
-    def __setup_farm_level(self):
+    def __setup_farm_level(self, context):
         """Set's the KPI information up on Farm Level."""
-        flocks_on_farm = Flock.objects.present_at_farm()
+        if context.snapshot is not None:
+            self.float_value = context.snapshot.death_percentage
+            return
+
+        flocks_on_farm = context.flocks
         entry_count = 0
         death_count = 0
         for flock in flocks_on_farm:
             entry_count += flock.number_of_animals
-            death_count += flock.animaldeath_set.count()
+            death_count += flock.number_of_deaths
         self.float_value = death_count * 100 / entry_count
 
     def __setup_color(self):
@@ -92,23 +138,27 @@ class SeparationsKpi(Kpi):
     action_name = 'Details'
     action = '#'
 
-    def __init__(self, flock=None):
+    def __init__(self, flock=None, context=None):
         """Constructor.
 
         When a flock is provided, a KPI is created with only information for that flock. If no flock is supplied, the
-        information is collected from all the flocks currently in the farm.
+        information is collected from all the flocks currently in the farm, as loaded by the given KpiContext.
         """
         super().__init__()
         if flock is None:
-            self.__setup_farm_level()
+            self.__setup_farm_level(context or KpiContext())
         elif isinstance(flock, Flock):
             self.float_value = flock.separated_animals * 100 / flock.number_of_animals
         self.__setup_color()
         self.value = "{:.2f}%".format(self.float_value)
 
-    def __setup_farm_level(self):
+    def __setup_farm_level(self, context):
         """Set's the KPI information up on Farm Level."""
-        flocks_on_farm = Flock.objects.present_at_farm()
+        if context.snapshot is not None:
+            self.float_value = context.snapshot.separation_percentage
+            return
+
+        flocks_on_farm = context.flocks
         entry_count = 0
         separation_count = 0
         for flock in flocks_on_farm:
@@ -129,8 +179,8 @@ class GrowRateKpi(Kpi):
 
     """Kpi for the GrowRate in the past 12 months.
 
-    This KPI is based on historical data only. It considers all the animal exits in the past 365 days,
-    and computes a weighted average of the grow rate in this period.
+    This KPI is based on historical data only. It considers all the animal exits in the past 365 days (or another
+    window), and computes a weighted average of the grow rate in this period, in a single database aggregate.
     """
 
     icon = 'line-chart'
@@ -138,21 +188,28 @@ class GrowRateKpi(Kpi):
     action_name = 'Details'
     action = '#'
 
-    def __init__(self):
-        """Constructor."""
+    def __init__(self, window_days=365, per_flock=False):
+        """Constructor.
+
+        :param window_days: The number of days before today from which the exits are considered.
+        :param per_flock: When True, the grow rate of every flock in the window is also computed, as a list of dicts
+        with the flock id, number_of_animals and grow_rate, in per_flock_grow_rates.
+        """
         super().__init__()
-        considering_from = date.today() - timedelta(days=365)
-        flocks_exited_past_year = AnimalFlockExit.objects.filter(
-            flock__animalflockexit__farm_exit__date__gt=considering_from)
-        if flocks_exited_past_year.count() == 0:
+        considering_from = date.today() - timedelta(days=window_days)
+        exits_in_window = AnimalFlockExit.objects.filter(farm_exit__date__gt=considering_from)
+        grow_rate = exits_in_window.grow_rate()
+        if grow_rate is None:
             self.value = 'Unknown'
             self.float_value = 0
         else:
-            number_of_animals = sum([obj.number_of_animals for obj in flocks_exited_past_year])
-            weighted_grow_rate = sum([obj.grow_rate * obj.number_of_animals for obj in flocks_exited_past_year])
-            self.float_value = weighted_grow_rate / number_of_animals
+            self.float_value = grow_rate
             self.value = "{:.2f} kg/day".format(self.float_value)
 
+        self.per_flock_grow_rates = None
+        if per_flock:
+            self.per_flock_grow_rates = exits_in_window.grow_rate_per_flock()
+
         self.__setup_color()
 
     def __setup_color(self):
@@ -169,19 +226,23 @@ class InTreatmentKpi(Kpi):
     description = 'Ongoing treatments'
     action_name = 'Details'
 
-    def __init__(self):
+    def __init__(self, context=None):
         self.float_value = 0.0
-        self.__setup_farm_level()
+        self.__setup_farm_level(context or KpiContext())
         self.__setup_color()
 
-    def __setup_farm_level(self):
+    def __setup_farm_level(self, context):
         """Set's the KPI information up on Farm Level."""
-        flocks_on_farm = Flock.objects.present_at_farm()
-        count = 0
-        t_count = 0
-        for flock in flocks_on_farm:
-            count += flock.number_of_living_animals
-            t_count += len([obj for obj in flock.treatment_set.all() if obj.is_active is True])
+        if context.snapshot is not None:
+            count = context.snapshot.living_animals
+            t_count = context.snapshot.active_treatments
+        else:
+            flocks_on_farm = context.flocks
+            count = 0
+            t_count = 0
+            for flock in flocks_on_farm:
+                count += flock.number_of_living_animals
+                t_count += flock.number_of_active_treatments
 
         self.float_value = float(t_count) / count
         self.float_value = 100 * self.float_value
@@ -258,8 +319,16 @@ class CurrentFeedTypeKpi(Kpi):
     description = 'Current feed type'
     action_name = 'Register feeding transition'
 
-    def __init__(self, flock):
+    def __init__(self, flock, rooms=None):
+        """Constructor.
+
+        :param flock: The flock.
+        :param rooms: Optional list of the rooms the flock has animals in, e.g. from OccupancyLedger.rooms_of_flock.
+        When not given, they are loaded with OccupancyLedger.rooms_of_flock.
+        """
         self.flock = flock
+        self.rooms = rooms
+        self.feed_types = FeedType.objects.in_bulk()
         used_types = self.__get_actual_feeding_types()
         recommended = self.__get_recommended_type()
         if used_types.get(recommended, 0) > 0:
@@ -272,13 +341,20 @@ class CurrentFeedTypeKpi(Kpi):
             self.color = 'red'
 
     def __get_actual_feeding_types(self):
+        """Count the rooms of the flock per feed type, with the feeding periods of all the rooms loaded at once."""
+        from buildings.feeding_periods import FeedingPeriodIndex
+        from buildings.models import OccupancyLedger
+        rooms = self.rooms
+        if rooms is None:
+            rooms = OccupancyLedger.objects.rooms_of_flock(self.flock.id) if self.flock.pk is not None else []
+
+        rooms = [room for room in rooms if not room.is_separation]
+        indexes = FeedingPeriodIndex.for_rooms([room.id for room in rooms])
+        today = date.today()
         feed_types = {}
-        room_entries = self.flock.animalroomentry_set.all()
-        for entry in room_entries:
-            room = entry.room
-            if room.get_animals_for_flock(flock_id=self.flock.id) > 0 and not room.is_separation:
-                feed_type = room.get_feeding_type_at()
-                feed_types.update({feed_type: feed_types.get(feed_type, 0) + 1})
+        for room in rooms:
+            feed_type = self.feed_types.get(indexes[room.id].feed_type_id_at(today))
+            feed_types.update({feed_type: feed_types.get(feed_type, 0) + 1})
         return feed_types
 
     def __get_recommended_type(self):
@@ -287,7 +363,7 @@ class CurrentFeedTypeKpi(Kpi):
         time_to_exit = date.today() - self.flock.expected_exit_date
         time_to_exit = time_to_exit.days
 
-        for feed_type in FeedType.objects.all():
+        for feed_type in self.feed_types.values():
             start = feed_type.start_feeding_age
             stop = feed_type.stop_feeding_age
             if (time_since_entry >= start >= 0) or (start < 0 and time_to_exit >= start):
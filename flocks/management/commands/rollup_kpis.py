@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.utils.dateparse import parse_date
+
+from flocks.models import KpiSnapshot
+
+
+class Command(BaseCommand):
+
+    """Add the daily KPI snapshots since the last rollup.
+
+    Meant to be run periodically, e.g. daily from cron, so the dashboard reads the KPIs of the day from the snapshots.
+    """
+
+    help = 'Add the daily KPI snapshots of the farm and its flocks, since the last rollup.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--until', type=parse_date, default=None,
+                            help='Last date to add snapshots for (YYYY-MM-DD), today by default.')
+        parser.add_argument('--rebuild-from', type=parse_date, default=None,
+                            help='Remove the snapshots from this date (YYYY-MM-DD) on before the rollup.')
+
+    def handle(self, *args, **options):
+        if options['rebuild_from'] is not None:
+            KpiSnapshot.objects.invalidate(options['rebuild_from'])
+        snapshots = KpiSnapshot.objects.rollup(options['until'])
+        self.stdout.write('Stored %d KPI snapshots.' % len(snapshots))
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-18 08:39
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('flocks', '0015_auto_20170624_1312'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KpiSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True)),
+                ('number_of_animals', models.IntegerField()),
+                ('living_animals', models.IntegerField()),
+                ('deaths', models.IntegerField()),
+                ('exited_animals', models.IntegerField()),
+                ('separations', models.IntegerField()),
+                ('active_treatments', models.IntegerField()),
+                ('death_percentage', models.FloatField()),
+                ('separation_percentage', models.FloatField()),
+                ('grow_rate', models.FloatField(blank=True, null=True)),
+                ('flock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='flocks.Flock')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='kpisnapshot',
+            unique_together=set([('date', 'flock')]),
+        ),
+    ]
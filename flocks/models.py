@@ -1,38 +1,96 @@
 from django.db import models
-from django.db.models import Sum
+from django.db.models import Sum, Count, Max, Min, F, Q, Func, OuterRef, Subquery, ExpressionWrapper
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
 from django.utils.dateparse import parse_date
 
+from Suinos.caching import AggregateCache
+from Suinos.memoization import request_memoized, clear_memoized
+from Suinos.profiling import profiled
+
+from .grow_rate import GrowRateModel
+
+from collections import Counter, defaultdict
 from math import ceil
 import datetime
 
 
-class CurrentFlocksManager(models.Manager):
+class DaysBetween(Func):
+
+    """Database expression for the number of days from a start date to an end date."""
+
+    template = '(%(expressions)s)'
+    arg_joiner = ' - '
+
+    def __init__(self, end, start, **extra):
+        super().__init__(end, start, output_field=models.FloatField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        return super().as_sql(compiler, connection, template='(julianday(%(expressions)s))',
+                              arg_joiner=') - julianday(')
+
+    def as_mysql(self, compiler, connection):
+        return super().as_sql(compiler, connection, template='DATEDIFF(%(expressions)s)', arg_joiner=', ')
+
+
+class FlockQuerySet(models.QuerySet):
+
+    def with_animal_counts(self):
+        """Annotate the flocks with the number of their animals that died, left, were separated or are in treatment.
+
+        Every count comes from a correlated subquery, so the counts of all the flocks are loaded with the flocks, in a
+        single query, and the joins do not multiply each other. The annotations are:
+
+        - death_count: number of AnimalDeath of the flock.
+        - exit_count: number of animals in the AnimalFlockExit of the flock.
+        - separation_count: number of AnimalSeparation of the flock.
+        - active_treatment_count: number of Treatment of the flock that did not stop yet.
+        - living_animal_count: number_of_animals - exit_count - death_count.
+        """
+        from medications.models import Treatment
+        deaths = AnimalDeath.objects.filter(flock=OuterRef('pk')).order_by().values('flock')
+        exits = AnimalFlockExit.objects.filter(flock=OuterRef('pk')).order_by().values('flock')
+        separations = AnimalSeparation.objects.filter(flock=OuterRef('pk')).order_by().values('flock')
+        treatments = Treatment.objects.filter(flock=OuterRef('pk'), stop_date__isnull=True).order_by().values('flock')
+
+        return self.annotate(
+            death_count=self.__subquery_total(deaths.annotate(total=Count('id'))),
+            exit_count=self.__subquery_total(exits.annotate(total=Sum('number_of_animals'))),
+            separation_count=self.__subquery_total(separations.annotate(total=Count('id'))),
+            active_treatment_count=self.__subquery_total(treatments.annotate(total=Count('id'))),
+        ).annotate(living_animal_count=F('number_of_animals') - F('exit_count') - F('death_count'))
+
+    def with_exit_statistics(self):
+        """Annotate the flocks with the totals of their exits.
+
+        - exit_weight: total weight of the animals that left the farm.
+        - exit_growth: sum of the grow rates of the animals that left the farm.
+        """
+        exits = AnimalFlockExit.objects.filter(flock=OuterRef('pk')).order_by().values('flock')
+        weights = exits.annotate(total=Sum('weight')).values('total')
+        growth = exits.annotate(total=Sum(AnimalFlockExitQuerySet.weighted_grow_rate_expression())).values('total')
+        return self.annotate(exit_weight=Coalesce(Subquery(weights, output_field=models.FloatField()), 0.0),
+                             exit_growth=Subquery(growth, output_field=models.FloatField()))
+
+    def present(self):
+        """Filter the flocks that still have living animals at the farm. Requires with_animal_counts."""
+        return self.filter(living_animal_count__gt=0)
+
+    def departed(self):
+        """Filter the flocks that have no living animals at the farm anymore. Requires with_animal_counts."""
+        return self.filter(living_animal_count__lte=0)
+
+    @staticmethod
+    def __subquery_total(queryset):
+        return Coalesce(Subquery(queryset.values('total'), output_field=models.IntegerField()), 0)
+
+
+class CurrentFlocksManager(models.Manager.from_queryset(FlockQuerySet)):
     def present_at_farm(self):
-        result_list = []
-        from django.db import connection
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT f.id,\n"
-                           "  f.entry_date,\n"
-                           "  f.entry_weight,\n"
-                           "  f.number_of_animals,\n"
-                           "  f.number_of_animals - coalesce(e.exits,0) - coalesce(d.deaths,0) AS \"animal_count\"\n"
-                           "FROM flocks_flock AS f\n"
-                           "  LEFT JOIN\n"
-                           "  (SELECT\n"
-                           "     flock_id,\n"
-                           "     SUM(number_of_animals) AS \"exits\"\n"
-                           "   FROM flocks_animalflockexit GROUP BY flock_id)\n"
-                           "    AS e ON e.flock_id == f.id\n"
-                           "  LEFT JOIN\n"
-                           "  (SELECT\n"
-                           "     flock_id,\n"
-                           "     count(DISTINCT id) AS \"deaths\"\n"
-                           "   FROM flocks_animaldeath GROUP BY flock_id) AS d ON d.flock_id == f.id\n"
-                           "WHERE animal_count > 0\n")
-            for row in cursor.fetchall():
-                p = self.model(id=row[0], entry_date=row[1], entry_weight=row[2], number_of_animals=row[3])
-                result_list.append(p)
-            return result_list
+        """Get the flocks that still have living animals at the farm, annotated as in FlockQuerySet.with_animal_counts.
+        """
+        return self.get_queryset().with_animal_counts().present().order_by('id')
 
 
 class Flock(models.Model):
@@ -42,16 +100,18 @@ class Flock(models.Model):
     number_of_animals = models.IntegerField()
     objects = CurrentFlocksManager()
     # alive = CurrentFlocksManager()
+    living_animals_cache = AggregateCache('flocks.living_animals')
 
     @property
     def flock_name(self):
         return '%d_%d' % (self.entry_date.year, self.id)
 
     @property
+    @request_memoized
+    @profiled
     def expected_exit_date(self):
         date_year_before = self.entry_date - datetime.timedelta(days=365)
-        exits = AnimalFlockExit.objects.filter(farm_exit__date__gte=date_year_before)
-        grow_rate = self.__compute_grow_rate_for_exits_set(exits)
+        grow_rate = GrowRateModel.current().grow_rate_since(date_year_before)
         if grow_rate is None:
             grow_rate = 0.850
 
@@ -60,7 +120,22 @@ class Flock(models.Model):
         return date
 
     @property
+    @request_memoized
+    @profiled
     def number_of_living_animals(self):
+        """The number of animals of the flock still at the farm.
+
+        Taken from the living_animal_count annotation when the flock was loaded with it, otherwise kept in the cache
+        until an exit or death of the flock is saved or deleted.
+        """
+        if hasattr(self, 'living_animal_count'):
+            return self.living_animal_count
+        if self.pk is None:
+            return self.__count_living_animals()
+
+        return self.living_animals_cache.get(self.id, self.__count_living_animals)
+
+    def __count_living_animals(self):
         number_of_gone_animals = 0
 
         for exits in self.animalflockexit_set.all():
@@ -74,12 +149,24 @@ class Flock(models.Model):
         return self.entry_weight / self.number_of_animals
 
     @property
+    @profiled
     def computed_daily_growth(self):
-        exits_set = self.animalflockexit_set.all()
+        if hasattr(self, 'exit_growth') and hasattr(self, 'exit_count'):
+            if not self.exit_count:
+                return None
+            return self.exit_growth / self.exit_count
+
+        exits_set = self.animalflockexit_set.select_related('farm_exit')
         return self.__compute_grow_rate_for_exits_set(exits_set)
 
     @property
+    @profiled
     def average_exit_weight(self):
+        if hasattr(self, 'exit_weight') and hasattr(self, 'exit_count'):
+            if not self.exit_count:
+                return 0
+            return self.exit_weight / self.exit_count
+
         exits_set = self.animalflockexit_set.all()
         weight = sum([obj.weight for obj in exits_set])
         animals = sum([obj.number_of_animals for obj in exits_set])
@@ -89,7 +176,23 @@ class Flock(models.Model):
             return 0
 
     @property
+    def number_of_deaths(self):
+        if hasattr(self, 'death_count'):
+            return self.death_count
+        return self.animaldeath_set.count()
+
+    @property
+    def number_of_active_treatments(self):
+        if hasattr(self, 'active_treatment_count'):
+            return self.active_treatment_count
+        return len([obj for obj in self.treatment_set.all() if obj.is_active is True])
+
+    @property
+    @profiled
     def separated_animals(self):
+        if hasattr(self, 'separation_count'):
+            return self.separation_count
+
         separation_set = self.animalseparation_set.all()
         active_separations = len([obj for obj in separation_set])
         return active_separations
@@ -98,12 +201,13 @@ class Flock(models.Model):
     def estimated_avg_weight(self):
         return self.estimated_average_weight_at_date(datetime.date.today())
 
+    @request_memoized
+    @profiled
     def estimated_average_weight_at_date(self, at_date):
         if isinstance(at_date, str):
             at_date = parse_date(at_date)
         date_year_before = self.entry_date - datetime.timedelta(days=365)
-        exits = AnimalFlockExit.objects.filter(farm_exit__date__gte=date_year_before)
-        grow_rate = self.__compute_grow_rate_for_exits_set(exits)
+        grow_rate = GrowRateModel.current().grow_rate_since(date_year_before)
         if grow_rate is None:
             grow_rate = 0.850
 
@@ -125,7 +229,7 @@ class Flock(models.Model):
 
     @property
     def death_percentage(self):
-        return (self.animaldeath_set.count() / self.number_of_animals) * 100
+        return (self.number_of_deaths / self.number_of_animals) * 100
 
     def __str__(self):
         return self.flock_name
@@ -158,11 +262,52 @@ class AnimalFarmExit(models.Model):
         return self.animalflockexit_set.all().aggregate(Sum('weight'))
 
 
+class AnimalFlockExitQuerySet(models.QuerySet):
+
+    def with_weighted_grow_rate(self):
+        """Annotate the exits with weighted_grow_rate: their grow_rate times their number_of_animals."""
+        return self.annotate(weighted_grow_rate=self.weighted_grow_rate_expression())
+
+    def grow_rate(self):
+        """Get the average grow rate of the exits, weighted by their number of animals, in a single query.
+
+        :return: The grow rate in kg/day, or None when there are no exits.
+        """
+        totals = self.aggregate(growth=Sum(self.weighted_grow_rate_expression()), animals=Sum('number_of_animals'))
+        if not totals['animals']:
+            return None
+        return totals['growth'] / totals['animals']
+
+    def grow_rate_per_flock(self):
+        """Get the average grow rate of the exits of every flock, in a single query.
+
+        :return: A list of dicts with the flock id, number_of_animals and grow_rate, ordered by flock.
+        """
+        totals = self.order_by().values('flock').annotate(
+            growth=Sum(self.weighted_grow_rate_expression()), animals=Sum('number_of_animals')).order_by('flock')
+        return [{'flock': total['flock'],
+                 'number_of_animals': total['animals'],
+                 'grow_rate': total['growth'] / total['animals']}
+                for total in totals if total['animals']]
+
+    @staticmethod
+    def weighted_grow_rate_expression():
+        """The grow rate of an exit times its number of animals, computed by the database.
+
+        It is the weight gained by the animals since the flock entry, divided by the days between the flock entry and
+        the farm exit.
+        """
+        gained_weight = F('weight') - F('number_of_animals') * F('flock__entry_weight') / F('flock__number_of_animals')
+        return ExpressionWrapper(gained_weight / DaysBetween('farm_exit__date', 'flock__entry_date'),
+                                 output_field=models.FloatField())
+
+
 class AnimalFlockExit(models.Model):
     weight = models.FloatField()
     number_of_animals = models.IntegerField()
     flock = models.ForeignKey(Flock)
     farm_exit = models.ForeignKey(AnimalFarmExit)
+    objects = AnimalFlockExitQuerySet.as_manager()
 
     @property
     def grow_rate(self):
@@ -193,3 +338,285 @@ class AnimalSeparation(models.Model):
 
     def __str__(self):
         return 'Animal separation: ' + str(self.flock) + ' on ' + str(self.date) + ' with reason ' + self.reason
+
+
+class KpiSnapshotManager(models.Manager):
+
+    def rollup(self, until=None):
+        """Add the daily snapshots from the day after the last snapshot up to a date, today by default.
+
+        The counts of every flock continue from the rows of the last snapshot, so only the events after it are loaded,
+        and the cost of a rollup depends on the days and events since the previous rollup, not on the farm history.
+
+        :param until: The last date to create snapshots for.
+        :return: The list of created snapshots.
+        """
+        until = self.__as_date(until) or datetime.date.today()
+        last_date = self.aggregate(last_date=Max('date'))['last_date']
+        if last_date is None:
+            first_date = Flock.objects.aggregate(first_date=Min('entry_date'))['first_date']
+            previous = []
+        else:
+            first_date = last_date + datetime.timedelta(days=1)
+            previous = self.filter(date=last_date, flock__isnull=False, living_animals__gt=0)
+        if first_date is None or first_date > until:
+            return []
+
+        counts = {snapshot.flock_id: self.__counts_of(snapshot) for snapshot in previous}
+        flocks = Flock.objects.filter(Q(id__in=counts.keys()) | Q(entry_date__range=(first_date, until)))
+        flocks = {flock.id: flock for flock in flocks}
+        entering = defaultdict(list)
+        for flock in flocks.values():
+            if flock.id not in counts:
+                entering[flock.entry_date].append(flock.id)
+
+        events = self.__load_events(first_date, until)
+        exits = self.__load_exit_growth(first_date - datetime.timedelta(days=365), until)
+        window_start, window_end = 0, 0
+        window = Counter()
+
+        snapshots = []
+        day = first_date
+        while day <= until:
+            for flock_id in entering[day]:
+                counts.update({flock_id: Counter()})
+            for flock_id, flock_events in events[day].items():
+                if flock_id in counts:
+                    counts[flock_id].update(flock_events)
+
+            while window_end < len(exits) and exits[window_end][0] <= day:
+                window.update(exits[window_end][1])
+                window_end += 1
+            while window_start < window_end and exits[window_start][0] <= day - datetime.timedelta(days=365):
+                window.subtract(exits[window_start][1])
+                window_start += 1
+
+            flock_snapshots = [self.__flock_snapshot(day, flocks[flock_id], flock_counts)
+                               for flock_id, flock_counts in counts.items()]
+            snapshots.extend(flock_snapshots)
+            snapshots.append(self.__farm_snapshot(day, flock_snapshots, window))
+            counts = {snapshot.flock_id: counts[snapshot.flock_id]
+                      for snapshot in flock_snapshots if snapshot.living_animals > 0}
+            day += datetime.timedelta(days=1)
+
+        self.bulk_create(snapshots)
+        return snapshots
+
+    def invalidate(self, from_date):
+        """Remove the snapshots from a date on, so the next rollup computes them again."""
+        from_date = self.__as_date(from_date)
+        if from_date is not None:
+            self.filter(date__gte=from_date).delete()
+
+    def series(self, field, flock=None, start_date=None, end_date=None):
+        """Get the daily values of a snapshot field, for the farm or for one flock.
+
+        :param field: The name of the field, e.g. 'death_percentage'.
+        :param flock: The flock, or None for the farm level values.
+        :return: A list of (date, value) tuples, ordered by date.
+        """
+        snapshots = self.filter(flock=flock)
+        if start_date is not None:
+            snapshots = snapshots.filter(date__gte=start_date)
+        if end_date is not None:
+            snapshots = snapshots.filter(date__lte=end_date)
+        return list(snapshots.order_by('date').values_list('date', field))
+
+    @staticmethod
+    def __load_events(first_date, until):
+        """Load the changes of the flock counts in [first_date, until], per date and flock."""
+        from medications.models import Treatment
+        events = defaultdict(lambda: defaultdict(Counter))
+        period = (first_date, until)
+        sources = [
+            ('deaths', 1, AnimalDeath.objects.filter(date__range=period).values_list('flock_id', 'date')),
+            ('separations', 1, AnimalSeparation.objects.filter(date__range=period).values_list('flock_id', 'date')),
+            ('active_treatments', 1,
+             Treatment.objects.filter(start_date__range=period).values_list('flock_id', 'start_date')),
+            ('active_treatments', -1,
+             Treatment.objects.filter(stop_date__range=period).values_list('flock_id', 'stop_date')),
+        ]
+        for name, sign, rows in sources:
+            for flock_id, day, number in rows.order_by().annotate(number=Count('id')):
+                events[day][flock_id][name] += sign * number
+
+        flock_exits = AnimalFlockExit.objects.filter(farm_exit__date__range=period).select_related('flock', 'farm_exit')
+        for flock_exit in flock_exits:
+            events[flock_exit.date][flock_exit.flock_id].update(KpiSnapshotManager.__exit_counts(flock_exit))
+        return events
+
+    @staticmethod
+    def __load_exit_growth(first_date, until):
+        """Load the exits in (first_date, until], as a list of (date, counts) tuples ordered by date."""
+        flock_exits = AnimalFlockExit.objects.filter(farm_exit__date__gt=first_date, farm_exit__date__lte=until)
+        flock_exits = flock_exits.select_related('flock', 'farm_exit').order_by('farm_exit__date')
+        return [(flock_exit.date, KpiSnapshotManager.__exit_counts(flock_exit)) for flock_exit in flock_exits]
+
+    @staticmethod
+    def __exit_counts(flock_exit):
+        return Counter({'exited_animals': flock_exit.number_of_animals,
+                        'growth': flock_exit.grow_rate * flock_exit.number_of_animals})
+
+    @staticmethod
+    def __counts_of(snapshot):
+        return Counter({'deaths': snapshot.deaths,
+                        'exited_animals': snapshot.exited_animals,
+                        'separations': snapshot.separations,
+                        'active_treatments': snapshot.active_treatments,
+                        'growth': (snapshot.grow_rate or 0) * snapshot.exited_animals})
+
+    def __flock_snapshot(self, day, flock, counts):
+        grow_rate = None
+        if counts['exited_animals'] > 0:
+            grow_rate = counts['growth'] / counts['exited_animals']
+
+        return self.model(date=day,
+                          flock=flock,
+                          number_of_animals=flock.number_of_animals,
+                          living_animals=flock.number_of_animals - counts['exited_animals'] - counts['deaths'],
+                          deaths=counts['deaths'],
+                          exited_animals=counts['exited_animals'],
+                          separations=counts['separations'],
+                          active_treatments=counts['active_treatments'],
+                          death_percentage=counts['deaths'] * 100 / flock.number_of_animals,
+                          separation_percentage=counts['separations'] * 100 / flock.number_of_animals,
+                          grow_rate=grow_rate)
+
+    def __farm_snapshot(self, day, flock_snapshots, window):
+        """Sum the snapshots of the flocks present at the farm, as the farm level KPIs do."""
+        present = [snapshot for snapshot in flock_snapshots if snapshot.living_animals > 0]
+        snapshot = self.model(date=day, flock=None, death_percentage=0, separation_percentage=0, grow_rate=None)
+        for field in ['number_of_animals', 'living_animals', 'deaths', 'exited_animals', 'separations',
+                      'active_treatments']:
+            setattr(snapshot, field, sum([getattr(flock_snapshot, field) for flock_snapshot in present]))
+
+        if snapshot.number_of_animals > 0:
+            snapshot.death_percentage = snapshot.deaths * 100 / snapshot.number_of_animals
+            snapshot.separation_percentage = snapshot.separations * 100 / snapshot.number_of_animals
+        if window['exited_animals'] > 0:
+            snapshot.grow_rate = window['growth'] / window['exited_animals']
+        return snapshot
+
+    @staticmethod
+    def __as_date(a_date):
+        if isinstance(a_date, str):
+            return parse_date(a_date)
+        return a_date
+
+
+class KpiSnapshot(models.Model):
+
+    """The KPI values of one day, for the farm or for one flock.
+
+    The rows are added by KpiSnapshotManager.rollup, e.g. from the rollup_kpis management command, so the dashboard can
+    read the values of today and charts can read their history. A row with flock None holds the farm level values,
+    summed over the flocks present at the farm, and the grow rate of the exits of the past 365 days.
+
+    Registering, changing or deleting an event removes the snapshots from the date of the event on, through the signal
+    handlers at the end of this module, and the next rollup computes them again.
+    """
+
+    date = models.DateField(db_index=True)
+    flock = models.ForeignKey(Flock, null=True, blank=True)
+    number_of_animals = models.IntegerField()
+    living_animals = models.IntegerField()
+    deaths = models.IntegerField()
+    exited_animals = models.IntegerField()
+    separations = models.IntegerField()
+    active_treatments = models.IntegerField()
+    death_percentage = models.FloatField()
+    separation_percentage = models.FloatField()
+    grow_rate = models.FloatField(null=True, blank=True)
+
+    objects = KpiSnapshotManager()
+
+    class Meta:
+        unique_together = ('date', 'flock')
+
+
+SNAPSHOT_DATE_FIELDS = ('entry_date', 'date', 'start_date', 'stop_date')
+
+
+@receiver(post_init, sender=Flock)
+@receiver(post_init, sender=AnimalDeath)
+@receiver(post_init, sender=AnimalFarmExit)
+@receiver(post_init, sender=AnimalSeparation)
+@receiver(post_init, sender='medications.Treatment')
+def remember_snapshot_dates(sender, instance, **kwargs):
+    """Remember the dates an event had when loaded, so that moving it also invalidates the snapshots of the old date."""
+    instance._snapshot_dates = [instance.__dict__.get(field) for field in SNAPSHOT_DATE_FIELDS]
+
+
+@receiver(post_save, sender=Flock)
+@receiver(post_delete, sender=Flock)
+@receiver(post_save, sender=AnimalDeath)
+@receiver(post_delete, sender=AnimalDeath)
+@receiver(post_save, sender=AnimalFarmExit)
+@receiver(post_delete, sender=AnimalFarmExit)
+@receiver(post_save, sender=AnimalSeparation)
+@receiver(post_delete, sender=AnimalSeparation)
+@receiver(post_save, sender='medications.Treatment')
+@receiver(post_delete, sender='medications.Treatment')
+def invalidate_snapshots(sender, instance, **kwargs):
+    """Remove the KPI snapshots from the earliest old or new date of a saved or deleted event on."""
+    dates = getattr(instance, '_snapshot_dates', []) + [getattr(instance, field, None)
+                                                         for field in SNAPSHOT_DATE_FIELDS]
+    dates = [parse_date(a_date) if isinstance(a_date, str) else a_date for a_date in dates if a_date is not None]
+    if dates:
+        KpiSnapshot.objects.invalidate(min(dates))
+    instance._snapshot_dates = [getattr(instance, field, None) for field in SNAPSHOT_DATE_FIELDS]
+
+
+@receiver(post_save, sender=AnimalFlockExit)
+@receiver(post_delete, sender=AnimalFlockExit)
+def invalidate_exit_snapshots(sender, instance, **kwargs):
+    """Remove the KPI snapshots from the date of the farm exit of a saved or deleted flock exit on."""
+    KpiSnapshot.objects.invalidate(instance.farm_exit.date)
+
+
+@receiver(post_save, sender=Flock)
+@receiver(post_delete, sender=Flock)
+@receiver(post_save, sender=AnimalFarmExit)
+@receiver(post_delete, sender=AnimalFarmExit)
+@receiver(post_save, sender=AnimalFlockExit)
+@receiver(post_delete, sender=AnimalFlockExit)
+def invalidate_grow_rate_model(sender, instance, **kwargs):
+    """Drop the cached grow rate model, as a saved or deleted flock or exit may change the grow rates."""
+    GrowRateModel.invalidate()
+
+
+@receiver(post_init, sender=AnimalDeath)
+@receiver(post_init, sender=AnimalFlockExit)
+def remember_living_animals_flock(sender, instance, **kwargs):
+    """Remember the flock a death or exit had when loaded, so that moving it also invalidates the old flock."""
+    instance._living_animals_flock_id = instance.__dict__.get('flock_id')
+
+
+@receiver(post_save, sender=Flock)
+@receiver(post_delete, sender=Flock)
+@receiver(post_save, sender=AnimalDeath)
+@receiver(post_delete, sender=AnimalDeath)
+@receiver(post_save, sender=AnimalFlockExit)
+@receiver(post_delete, sender=AnimalFlockExit)
+def invalidate_living_animals(sender, instance, **kwargs):
+    """Drop the cached number of living animals of the flock(s) of a saved or deleted flock, death or exit."""
+    if sender is Flock:
+        Flock.living_animals_cache.invalidate(instance.id)
+        return
+
+    flock_ids = {getattr(instance, '_living_animals_flock_id', None), instance.flock_id} - {None}
+    Flock.living_animals_cache.invalidate(*flock_ids)
+    instance._living_animals_flock_id = instance.flock_id
+
+
+@receiver(post_save, sender=Flock)
+@receiver(post_delete, sender=Flock)
+@receiver(post_save, sender=AnimalDeath)
+@receiver(post_delete, sender=AnimalDeath)
+@receiver(post_save, sender=AnimalFarmExit)
+@receiver(post_delete, sender=AnimalFarmExit)
+@receiver(post_save, sender=AnimalFlockExit)
+@receiver(post_delete, sender=AnimalFlockExit)
+def clear_memoized_flocks(sender, instance, **kwargs):
+    """Forget the living animals, exit dates and weights memoized in the request after a saved or deleted event."""
+    clear_memoized()
@@ -1,11 +1,19 @@
 import datetime
 from unittest import mock
 
+from django.contrib.auth.models import User
+from django.shortcuts import reverse
 from django.utils import timezone
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils.formats import date_format
-from .models import Flock, AnimalFarmExit, CurrentFlocksManager
+from .models import Flock, AnimalFarmExit, AnimalFlockExit, CurrentFlocksManager, KpiSnapshot
+from .grow_rate import GrowRateModel
+from feeding.models import FeedType
+from medications.models import Medication
+from buildings.models import Building, Room
 from .kpis import NumberOfAnimalsKpi, DeathPercentageKpi, SeparationsKpi, ExitDateKpi, CurrentFeedTypeKpi
+from .kpis import InTreatmentKpi, KpiContext, GrowRateKpi
 
 
 class FlockTests(TestCase):
@@ -56,12 +64,63 @@ class FlockTests(TestCase):
 
         self.assertEqual(0, self.flock1.number_of_living_animals)
 
+    def test_flock_number_of_living_animals_cached_until_death(self):
+        self.assertEqual(130, self.flock1.number_of_living_animals)
+        with self.assertNumQueries(0):
+            self.assertEqual(130, Flock(id=self.flock1.id).number_of_living_animals)
+        death = self.flock1.animaldeath_set.create(date=datetime.date(2017, 1, 10), weight=26.00)
+        self.assertEqual(129, self.flock1.number_of_living_animals)
+
+        other_flock = Flock.objects.create(entry_date=datetime.date(2017, 1, 1), entry_weight=200, number_of_animals=10)
+        self.assertEqual(10, other_flock.number_of_living_animals)
+        death.flock = other_flock
+        death.save()
+        self.assertEqual(130, self.flock1.number_of_living_animals)
+        self.assertEqual(9, other_flock.number_of_living_animals)
+
     def test_flock_number_of_living_animals_after_multiple_deaths(self):
         exit_date = datetime.date(2017, 1, 10)
         self.flock1.animaldeath_set.create(date=exit_date, weight=26.00)
         self.flock1.animaldeath_set.create(date=exit_date, weight=26.00)
         self.assertEqual(128, self.flock1.number_of_living_animals)
 
+    def test_present_at_farm(self):
+        farm_animal_exit = AnimalFarmExit(date=datetime.date(2017, 1, 10))
+        farm_animal_exit.save()
+        self.flock1.animalflockexit_set.create(farm_exit=farm_animal_exit, number_of_animals=10, weight=700)
+        self.flock1.animalflockexit_set.create(farm_exit=farm_animal_exit, number_of_animals=5, weight=350)
+        death = self.flock1.animaldeath_set.create(date=datetime.date(2017, 1, 10), weight=26.00)
+        self.flock1.animalseparation_set.create(date=datetime.date(2017, 1, 5), reason='Sick', death=death)
+        gone_flock = Flock(entry_date=datetime.date(2017, 1, 1), entry_weight=40.00, number_of_animals=1)
+        gone_flock.save()
+        gone_flock.animaldeath_set.create(date=datetime.date(2017, 1, 10), weight=26.00)
+
+        with self.assertNumQueries(1):
+            flocks = list(Flock.objects.present_at_farm())
+            self.assertEqual([self.flock1], flocks)
+            self.assertEqual(114, flocks[0].number_of_living_animals)
+            self.assertEqual(1, flocks[0].number_of_deaths)
+            self.assertEqual(1, flocks[0].separated_animals)
+            self.assertEqual(0, flocks[0].number_of_active_treatments)
+        self.assertEqual(self.flock1.number_of_living_animals, flocks[0].number_of_living_animals)
+
+    def test_grow_rate_model(self):
+        farm_animal_exit = AnimalFarmExit(date=datetime.date(2017, 4, 11))
+        farm_animal_exit.save()
+        self.flock1.animalflockexit_set.create(farm_exit=farm_animal_exit, number_of_animals=10, weight=1100)
+        self.assertAlmostEqual(0.9, GrowRateModel.current().grow_rate_since(datetime.date(2017, 1, 1)))
+        self.assertIsNone(GrowRateModel.current().grow_rate_since(datetime.date(2017, 4, 12)))
+
+        flock = Flock(entry_date=datetime.date(2017, 2, 1), entry_weight=200.00, number_of_animals=10)
+        flock.save()
+        flock.expected_exit_date
+        with self.assertNumQueries(0):
+            self.assertEqual(datetime.date(2017, 5, 18), flock.expected_exit_date)
+            self.assertAlmostEqual(20 + 0.9 * 10, flock.estimated_average_weight_at_date('2017-02-11'))
+
+        self.flock1.animalflockexit_set.create(farm_exit=farm_animal_exit, number_of_animals=10, weight=1300)
+        self.assertAlmostEqual(1.0, GrowRateModel.current().grow_rate_since(datetime.date(2017, 1, 1)))
+
     def test_flock_average_grow_single_exit(self):
         exit_date = self.flock1.entry_date + datetime.timedelta(days=100)
         farm_animal_exit = AnimalFarmExit(date=exit_date)
@@ -112,6 +171,66 @@ class FlockTests(TestCase):
         self.assertEqual(None, flock.computed_daily_growth)
 
 
+class KpiSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.flock = Flock(entry_date=datetime.date(2017, 1, 1), entry_weight=2600.00, number_of_animals=100)
+        self.flock.save()
+        self.flock.animalseparation_set.create(date=datetime.date(2017, 1, 2), reason='Sick')
+        self.flock.animaldeath_set.create(date=datetime.date(2017, 1, 3), weight=26.00)
+        medication = Medication(name='Med', recommended_age_start=0, recommended_age_stop=100, dosage_per_kg=1,
+                                grace_period_days=5, instructions='None')
+        medication.save()
+        self.flock.treatment_set.create(start_date=datetime.date(2017, 1, 2), stop_date=datetime.date(2017, 1, 4),
+                                        medication=medication)
+        farm_exit = AnimalFarmExit(date=datetime.date(2017, 1, 5))
+        farm_exit.save()
+        self.flock.animalflockexit_set.create(farm_exit=farm_exit, number_of_animals=10, weight=500)
+
+    def test_rollup(self):
+        self.assertEqual(10, len(KpiSnapshot.objects.rollup('2017-01-05')))
+        living = KpiSnapshot.objects.series('living_animals', start_date='2017-01-02')
+        self.assertEqual([(datetime.date(2017, 1, 2), 100), (datetime.date(2017, 1, 3), 99),
+                          (datetime.date(2017, 1, 4), 99), (datetime.date(2017, 1, 5), 89)], living)
+        self.assertEqual([0, 1, 1, 0, 0],
+                         [value for _, value in KpiSnapshot.objects.series('active_treatments', flock=self.flock)])
+
+        snapshot = KpiSnapshot.objects.get(date=datetime.date(2017, 1, 5), flock=None)
+        self.assertEqual(1, snapshot.death_percentage)
+        self.assertEqual(1, snapshot.separation_percentage)
+        self.assertAlmostEqual(6.0, snapshot.grow_rate)
+
+    def test_incremental_rollup(self):
+        KpiSnapshot.objects.rollup('2017-01-03')
+        self.assertEqual(4, len(KpiSnapshot.objects.rollup('2017-01-05')))
+        self.assertEqual([], KpiSnapshot.objects.rollup('2017-01-05'))
+        incremental = KpiSnapshot.objects.series('living_animals', flock=self.flock)
+
+        KpiSnapshot.objects.invalidate('2017-01-01')
+        KpiSnapshot.objects.rollup('2017-01-05')
+        self.assertEqual(incremental, KpiSnapshot.objects.series('living_animals', flock=self.flock))
+
+    def test_invalidated_by_events(self):
+        KpiSnapshot.objects.rollup('2017-01-05')
+        self.flock.animaldeath_set.create(date=datetime.date(2017, 1, 4), weight=26.00)
+        self.assertEqual(datetime.date(2017, 1, 3), KpiSnapshot.objects.order_by('date').last().date)
+        KpiSnapshot.objects.rollup('2017-01-05')
+        self.assertEqual(88, KpiSnapshot.objects.get(date=datetime.date(2017, 1, 5), flock=None).living_animals)
+
+        treatment = self.flock.treatment_set.get()
+        treatment.stop_date = None
+        treatment.save()
+        self.assertEqual(datetime.date(2017, 1, 1), KpiSnapshot.objects.order_by('date').last().date)
+
+    def test_kpis_read_snapshot(self):
+        KpiSnapshot.objects.create(date=datetime.date.today(), number_of_animals=100, living_animals=42, deaths=3,
+                                   exited_animals=55, separations=1, active_treatments=0, death_percentage=3.0,
+                                   separation_percentage=1.0)
+        context = KpiContext()
+        self.assertEqual(42, NumberOfAnimalsKpi(context=context).value)
+        self.assertEqual('3.00%', DeathPercentageKpi(context=context).value)
+
+
 class SeparationTests(TestCase):
 
     def setUp(self):
@@ -164,6 +283,66 @@ class LivingAnimalsKpiTest(TestCase):
         self.assertEquals(40, kpi.value)
 
 
+class KpiContextTest(TestCase):
+
+    @mock.patch.object(CurrentFlocksManager, 'present_at_farm')
+    def test_farm_loaded_once(self, manager_mock):
+        flock1 = mock.create_autospec(Flock)
+        flock1.number_of_animals = 100
+        flock1.number_of_living_animals = 90
+        flock1.number_of_deaths = 2
+        flock1.separated_animals = 1
+        flock1.number_of_active_treatments = 9
+        manager_mock.return_value = [flock1]
+        context = KpiContext()
+        kpis = [NumberOfAnimalsKpi(context=context), DeathPercentageKpi(context=context),
+                SeparationsKpi(context=context), InTreatmentKpi(context=context)]
+        manager_mock.assert_called_once_with()
+        self.assertEqual([90, '2.00%', '1.00%', '9'], [kpi.value for kpi in kpis])
+        self.assertEqual(90, context.number_of_living_animals)
+
+
+class GrowRateKpiTest(TestCase):
+
+    def setUp(self):
+        today = datetime.date.today()
+        self.flock1 = Flock(entry_date=today - datetime.timedelta(days=200), entry_weight=200, number_of_animals=10)
+        self.flock1.save()
+        self.flock2 = Flock(entry_date=today - datetime.timedelta(days=150), entry_weight=300, number_of_animals=10)
+        self.flock2.save()
+        old_exit = AnimalFarmExit(date=today - datetime.timedelta(days=400))
+        old_exit.save()
+        recent_exit1 = AnimalFarmExit(date=today - datetime.timedelta(days=100))
+        recent_exit1.save()
+        recent_exit2 = AnimalFarmExit(date=today - datetime.timedelta(days=50))
+        recent_exit2.save()
+        self.flock1.animalflockexit_set.create(farm_exit=old_exit, number_of_animals=1, weight=500)
+        self.flock1.animalflockexit_set.create(farm_exit=recent_exit1, number_of_animals=5, weight=600)
+        self.flock1.animalflockexit_set.create(farm_exit=recent_exit2, number_of_animals=4, weight=600)
+        self.flock2.animalflockexit_set.create(farm_exit=recent_exit2, number_of_animals=10, weight=1300)
+
+    def test_grow_rate(self):
+        considering_from = datetime.date.today() - datetime.timedelta(days=365)
+        exits = [obj for obj in AnimalFlockExit.objects.all() if obj.date > considering_from]
+        expected = sum([obj.grow_rate * obj.number_of_animals for obj in exits]) / 19
+        with self.assertNumQueries(1):
+            kpi = GrowRateKpi()
+        self.assertAlmostEqual(expected, kpi.float_value)
+        self.assertEqual('{:.2f} kg/day'.format(expected), kpi.value)
+        self.assertIsNone(kpi.per_flock_grow_rates)
+
+    def test_window(self):
+        kpi = GrowRateKpi(window_days=10)
+        self.assertEqual('Unknown', kpi.value)
+        self.assertAlmostEqual((4 * 130 / 150 + 10 * 1.0) / 14, GrowRateKpi(window_days=75).float_value)
+
+    def test_per_flock(self):
+        kpi = GrowRateKpi(per_flock=True)
+        self.assertEqual([self.flock1.id, self.flock2.id], [total['flock'] for total in kpi.per_flock_grow_rates])
+        self.assertEqual([9, 10], [total['number_of_animals'] for total in kpi.per_flock_grow_rates])
+        self.assertAlmostEqual(self.flock2.computed_daily_growth, kpi.per_flock_grow_rates[1]['grow_rate'])
+
+
 class DeathPercentageKpiTest(TestCase):
     def test_single_flock(self):
         number_of_animals_mock = mock.PropertyMock(return_value=0.561)
@@ -188,9 +367,9 @@ class DeathPercentageKpiTest(TestCase):
         flock1 = mock.create_autospec(Flock)
         flock2 = mock.create_autospec(Flock)
         flock1.number_of_animals = 100
-        flock1.animaldeath_set.count = mock.MagicMock(return_value=1)
+        flock1.number_of_deaths = 1
         flock2.number_of_animals = 100
-        flock2.animaldeath_set.count = mock.MagicMock(return_value=2)
+        flock2.number_of_deaths = 2
         manager_mock.return_value = [flock1, flock2]
         kpi = DeathPercentageKpi()
         self.assertEquals('1.50%', kpi.value)
@@ -284,3 +463,115 @@ class FeedTypeKpiTest(TestCase):
         exit_date_mock.return_value = datetime.date.today() + datetime.timedelta(days=10)
         flock = Flock()
         kpi = CurrentFeedTypeKpi(flock)
+
+
+class FlockIndexViewTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='NormalUser', email='none@noprovider.test', password='Password')
+        self.client.login(username='NormalUser', password='Password')
+        self.current_flock = Flock(entry_date=datetime.date(2017, 3, 1), entry_weight=400, number_of_animals=20)
+        self.current_flock.save()
+        farm_exit = AnimalFarmExit(date=datetime.date(2017, 5, 1))
+        farm_exit.save()
+        self.old_flocks = []
+        for day in range(1, 11):
+            flock = Flock(entry_date=datetime.date(2016, 1, day), entry_weight=200, number_of_animals=10)
+            flock.save()
+            flock.animalflockexit_set.create(farm_exit=farm_exit, number_of_animals=10, weight=1100)
+            self.old_flocks.append(flock)
+
+    def test_index(self):
+        response = self.client.get(reverse('flocks:index'))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([self.current_flock], list(response.context['current_flocks']))
+        previous_flocks = response.context['previous_flocks']
+        self.assertEqual(10, previous_flocks.paginator.count)
+        self.assertEqual(list(reversed(self.old_flocks))[:8], list(previous_flocks))
+        self.assertAlmostEqual(self.old_flocks[2].computed_daily_growth, previous_flocks[7].computed_daily_growth)
+        self.assertEqual(110, previous_flocks[0].average_exit_weight)
+
+    def test_index_paging_and_ordering(self):
+        response = self.client.get(reverse('flocks:index'), {'page': 2, 'order': 'entry_date'})
+        self.assertEqual(self.old_flocks[8:], list(response.context['previous_flocks']))
+        response = self.client.get(reverse('flocks:index'), {'page': 'x', 'order': 'password', 'year': '2017'})
+        self.assertEqual('-entry_date', response.context['ordering'])
+        self.assertEqual(0, response.context['previous_flocks'].paginator.count)
+        # The filter stays on the page, so another year can be chosen.
+        self.assertContains(response, '<option value="2016" >2016</option>', html=False)
+
+    def test_index_filter_controls(self):
+        response = self.client.get(reverse('flocks:index'), {'order': 'entry_date', 'year': '2016'})
+        self.assertEqual([2016], response.context['years'])
+        self.assertEqual(10, response.context['previous_flocks'].paginator.count)
+        self.assertContains(response, '<option value="2016" selected>2016</option>', html=False)
+        self.assertContains(response, '<option value="entry_date" selected>Oldest first</option>', html=False)
+
+    def test_index_query_count(self):
+        self.client.get(reverse('flocks:index'))
+        with self.assertNumQueries(6):
+            # Session, user, current flocks, years, count and page of the previous flocks. The grow rate model is
+            # cached.
+            self.client.get(reverse('flocks:index'))
+
+
+class FlockDetailViewTest(TestCase):
+
+    def setUp(self):
+        User.objects.create_user(username='NormalUser', email='none@noprovider.test', password='Password')
+        self.client.login(username='NormalUser', password='Password')
+        today = datetime.date.today()
+        self.flock = Flock(entry_date=today - datetime.timedelta(days=20), entry_weight=400, number_of_animals=20)
+        self.flock.save()
+        building = Building(name='Building')
+        building.save()
+        self.rooms = [Room(name='Room%d' % index, capacity=10, group=building) for index in range(3)]
+        for room in self.rooms:
+            room.save()
+        self.rooms[0].animalroomentry_set.create(date=self.flock.entry_date, number_of_animals=10, flock=self.flock)
+        self.rooms[1].animalroomentry_set.create(date=self.flock.entry_date, number_of_animals=10, flock=self.flock)
+        self.rooms[1].animalroomexit_set.create(date=today - datetime.timedelta(days=5), number_of_animals=4,
+                                                flock=self.flock)
+        self.rooms[2].animalroomentry_set.create(date=today - datetime.timedelta(days=5), number_of_animals=4,
+                                                 flock=self.flock)
+        self.rooms[2].animalroomexit_set.create(date=today - datetime.timedelta(days=2), number_of_animals=4,
+                                                flock=self.flock)
+        death = self.flock.animaldeath_set.create(date=today, weight=30, cause='Unknown')
+        self.flock.animalseparation_set.create(date=today, reason='Sick', death=death)
+
+    def test_detail(self):
+        response = self.client.get(reverse('flocks:detail', kwargs={'flock_id': self.flock.id}))
+        self.assertEqual(200, response.status_code)
+        self.assertEqual([{'name': 'Building - Room0', 'occupancy': 10}, {'name': 'Building - Room1', 'occupancy': 6}],
+                         response.context['current_rooms'])
+        self.assertEqual(1, len(response.context['death_list']))
+        self.assertEqual(19, response.context['kpi_list'][0].value)
+
+    def test_detail_query_count(self):
+        url = reverse('flocks:detail', kwargs={'flock_id': self.flock.id})
+        self.client.get(url)
+        with self.assertNumQueries(7):
+            # Session, flock, deaths, separations, exits, rooms and the feed types. The feeding periods are cached.
+            self.client.get(url)
+        for room in self.rooms:
+            room.animalroomentry_set.create(date=self.flock.entry_date, number_of_animals=1, flock=self.flock)
+            room.animalroomexit_set.create(date=self.flock.entry_date, number_of_animals=1, flock=self.flock)
+        with self.assertNumQueries(7):
+            self.client.get(url)
+
+    def test_detail_query_count_with_more_occupied_rooms(self):
+        url = reverse('flocks:detail', kwargs={'flock_id': self.flock.id})
+        cache.clear()
+        with self.assertNumQueries(9):
+            # As above, with the grow rate model and the feeding periods of all the rooms loaded into the cache.
+            self.client.get(url)
+        building = self.rooms[0].group
+        feed_type = FeedType.objects.create(name='Feed', start_feeding_age=0, stop_feeding_age=100)
+        for index in range(3, 8):
+            room = Room.objects.create(name='Room%d' % index, capacity=10, group=building)
+            room.roomfeedingchange_set.create(date=self.flock.entry_date, feed_type=feed_type)
+            room.animalroomentry_set.create(date=self.flock.entry_date, number_of_animals=1, flock=self.flock)
+        cache.clear()
+        with self.assertNumQueries(9):
+            response = self.client.get(url)
+        self.assertEqual(7, len(response.context['current_rooms']))
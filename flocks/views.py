@@ -1,17 +1,59 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
 from django.http import HttpResponseRedirect
+from django.utils.translation import ugettext_lazy
 from django.views.generic import TemplateView
 from .forms import FlockForm
+from .detail import FlockDetail
 from .kpis import *
 
 
+PREVIOUS_FLOCKS_PER_PAGE = 8
+PREVIOUS_FLOCKS_ORDERINGS = [('-entry_date', ugettext_lazy('Newest first')),
+                             ('entry_date', ugettext_lazy('Oldest first')),
+                             ('-number_of_animals', ugettext_lazy('Most animals first')),
+                             ('number_of_animals', ugettext_lazy('Fewest animals first')),
+                             ('-death_count', ugettext_lazy('Most deaths first')),
+                             ('death_count', ugettext_lazy('Fewest deaths first'))]
+
+
 @login_required
 def index(request):
-    current_flocks = [obj for obj in Flock.objects.all() if obj.number_of_living_animals > 0]
-    old_flocks = [obj for obj in Flock.objects.all().order_by('-entry_date') if obj.number_of_living_animals == 0]
-    old_flocks = old_flocks[:8]
-    return render(request, 'flocks/index.html', {'current_flocks': current_flocks, 'previous_flocks': old_flocks})
+    """List the flocks at the farm, and a page of the flocks that left it.
+
+    Both lists come from querysets annotated with the animal counts, so the cost of the page does not depend on the
+    number of flocks in the history. The previous flocks can be filtered on their entry year (year), ordered (order)
+    and paged (page) through the query string, which the filter form of the page sets.
+    """
+    current_flocks = Flock.objects.present_at_farm()
+    old_flocks = Flock.objects.with_animal_counts().departed().with_exit_statistics()
+    years = [entry_year.year for entry_year in old_flocks.dates('entry_date', 'year', order='DESC')]
+
+    year = request.GET.get('year', '')
+    if year.isdigit():
+        old_flocks = old_flocks.filter(entry_date__year=int(year))
+
+    orderings = [value for value, label in PREVIOUS_FLOCKS_ORDERINGS]
+    ordering = request.GET.get('order', orderings[0])
+    if ordering not in orderings:
+        ordering = orderings[0]
+    old_flocks = old_flocks.order_by(ordering, '-id')
+
+    paginator = Paginator(old_flocks, PREVIOUS_FLOCKS_PER_PAGE)
+    try:
+        old_flocks = paginator.page(request.GET.get('page', 1))
+    except PageNotAnInteger:
+        old_flocks = paginator.page(1)
+    except EmptyPage:
+        old_flocks = paginator.page(paginator.num_pages)
+
+    return render(request, 'flocks/index.html', {'current_flocks': current_flocks,
+                                                 'previous_flocks': old_flocks,
+                                                 'ordering': ordering,
+                                                 'orderings': PREVIOUS_FLOCKS_ORDERINGS,
+                                                 'year': year,
+                                                 'years': years})
 
 
 @login_required
@@ -40,31 +82,16 @@ class FlockDetailView(TemplateView):
 
     def get(self, request, *args, **kwargs):
         flock_id = kwargs.get('flock_id', None)
-        self.flock = get_object_or_404(Flock, pk=flock_id)
+        self.flock = get_object_or_404(Flock.objects.with_animal_counts(), pk=flock_id)
         return super().get(request, args, kwargs)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        detail = FlockDetail(self.flock)
         context.update({'flock': self.flock})
-        context.update({'death_list': self.flock.animaldeath_set.all()})
-        context.update({'separation_list': self.flock.animalseparation_set.all()})
-        context.update({'exits_list': self.flock.animalflockexit_set.all()})
-        context.update({'current_rooms': self.__get_building_info()})
-        context.update({'kpi_list': self.__create_kpis()})
+        context.update({'death_list': detail.deaths})
+        context.update({'separation_list': detail.separations})
+        context.update({'exits_list': detail.exits})
+        context.update({'current_rooms': detail.current_rooms})
+        context.update({'kpi_list': detail.create_kpis()})
         return context
-
-    def __get_building_info(self):
-        room_entries = self.flock.animalroomentry_set.all()
-        current_rooms = [obj.room for obj in room_entries if obj.room.get_animals_for_flock(self.flock.id) > 0]
-        return [{'name': obj.__str__(), 'occupancy': obj.get_animals_for_flock(self.flock.id)} for obj in current_rooms]
-
-    def __create_kpis(self):
-        kpi_list = []
-        if self.flock.number_of_living_animals > 0:
-            kpi_list.append(NumberOfAnimalsKpi(self.flock))
-            kpi_list.append(EstimatedWeightKpi(self.flock))
-            kpi_list.append(ExitDateKpi(self.flock))
-            kpi_list.append(CurrentFeedTypeKpi(self.flock))
-        kpi_list.append(DeathPercentageKpi(self.flock))
-        kpi_list.append(SeparationsKpi(self.flock))
-        return kpi_list
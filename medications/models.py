@@ -1,9 +1,12 @@
 from django.db import models
 from django.db.models import Sum
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
 from django.core.validators import ValidationError
 from datetime import timedelta
 
 from flocks.models import Flock
+from Suinos.caching import AggregateCache
 
 
 class Medication(models.Model):
@@ -14,6 +17,7 @@ class Medication(models.Model):
     grace_period_days = models.IntegerField()
     instructions = models.TextField()
     quantity_unit = models.CharField(max_length=4, default='ml')
+    availability_cache = AggregateCache('medications.availability')
 
     def clean(self):
         if self.recommended_age_start >= self.recommended_age_stop:
@@ -22,10 +26,16 @@ class Medication(models.Model):
     @property
     def availability(self):
         """
-            Property that tells how much of this medicine is available at the farm.
+            Property that tells how much of this medicine is available at the farm. The value is kept in the cache,
+            until an entry, discard, treatment or application of the medication is saved or deleted.
         :return: A float value, indicating how much. The units depend on the units used for this medicine.
         :rtype: float
         """
+        if self.pk is None:
+            return self.__compute_availability()
+        return self.availability_cache.get(self.id, self.__compute_availability)
+
+    def __compute_availability(self):
         entry_quantity = self.medicationentry_set.all().aggregate(Sum('quantity'))['quantity__sum']
         used_quantity = self.__get_used_medication()
         discarded_quantity = self.medicationdiscard_set.all().aggregate(Sum('quantity'))['quantity__sum']
@@ -73,6 +83,11 @@ class Treatment(models.Model):
     flock = models.ForeignKey(Flock)
     comments = models.TextField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['flock', 'stop_date']),
+        ]
+
     @property
     def is_active(self):
         return self.stop_date is None
@@ -132,3 +147,41 @@ class Surgery(models.Model):
     recovery_time = models.IntegerField()
     treatment = models.ForeignKey(Treatment, null=True)
     flock = models.ForeignKey(Flock)
+
+
+@receiver(post_init, sender=MedicationEntry)
+@receiver(post_init, sender=MedicationDiscard)
+@receiver(post_init, sender=Treatment)
+@receiver(post_init, sender=MedicationApplication)
+def remember_availability_position(sender, instance, **kwargs):
+    """Remember the medication, or the treatment of an application, an event had when loaded, so that moving it also
+    invalidates the availability of the old medication."""
+    instance._availability_position = instance.__dict__.get(
+        'treatment_id' if sender is MedicationApplication else 'medication_id')
+
+
+@receiver(post_save, sender=Medication)
+@receiver(post_delete, sender=Medication)
+@receiver(post_save, sender=MedicationEntry)
+@receiver(post_delete, sender=MedicationEntry)
+@receiver(post_save, sender=MedicationDiscard)
+@receiver(post_delete, sender=MedicationDiscard)
+@receiver(post_save, sender=Treatment)
+@receiver(post_delete, sender=Treatment)
+@receiver(post_save, sender=MedicationApplication)
+@receiver(post_delete, sender=MedicationApplication)
+def invalidate_availability(sender, instance, **kwargs):
+    """Drop the cached availability of the medication(s) of a saved or deleted medication, entry, discard, treatment or
+    application."""
+    if sender is Medication:
+        Medication.availability_cache.invalidate(instance.id)
+        return
+
+    if sender is MedicationApplication:
+        treatment_ids = {getattr(instance, '_availability_position', None), instance.treatment_id} - {None}
+        medication_ids = set(Treatment.objects.filter(id__in=treatment_ids).values_list('medication_id', flat=True))
+        instance._availability_position = instance.treatment_id
+    else:
+        medication_ids = {getattr(instance, '_availability_position', None), instance.medication_id} - {None}
+        instance._availability_position = instance.medication_id
+    Medication.availability_cache.invalidate(*medication_ids)
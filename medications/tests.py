@@ -49,6 +49,20 @@ class MedicineModelTest(TestCase):
         application.save()
         self.assertEqual(90, med.availability)
 
+    def test_stock_quantity_cached_until_application(self):
+        med = Medication.objects.create(name='Medicine1', recommended_age_start=30, recommended_age_stop=20,
+                                        dosage_per_kg=3, grace_period_days=10)
+        med.medicationentry_set.create(date='2017-01-01', expiration_date='2017-10-01', quantity=100)
+        self.assertEqual(100, med.availability)
+        with self.assertNumQueries(0):
+            self.assertEqual(100, Medication(id=med.id).availability)
+
+        treatment = med.treatment_set.create(flock=self.flock1, start_date='2017-01-10')
+        treatment.medicationapplication_set.create(date='2017-01-10', dosage=10)
+        self.assertEqual(90, med.availability)
+        med.medicationdiscard_set.create(date='2017-02-02', quantity=30, reason='Bad storage')
+        self.assertEqual(60, med.availability)
+
     def test_stock_quantity_after_discard(self):
         med = Medication(name='Medicine1', recommended_age_start=30, recommended_age_stop=20, dosage_per_kg=3,
                          grace_period_days=10)